@@ -0,0 +1 @@
+# 使pytest在仓库根目录下运行时可以直接导入pair_doc
@@ -1,4 +1,12 @@
-from .pair_doc import build_doc
-from .lexer import PairDocTokenizer, PairDocLexer, PairDocTokenType
-from .ast import Gather, PairDocASTParser, PairDocASTNode, PairDocASTNodeTypes
-from .html_builder import build_content, build_html
+from .pair_doc import build_doc, parse_doc
+from .lexer import PairDocTokenizer, PairDocLexer, PairDocFastLexer, PairDocTokenType, PairDocTokenKind, TokenStream, SourceSpan
+from .ast import Gather, PairDocASTParser, PairDocPrecedenceParser, PairDocASTNode, PairDocASTNodeTypes
+from .html_builder import build_content, compile_content, build_html, iter_html, write_html, render_html, function_cache_scope, module_scope
+from .arena import PairDocASTArena
+from .cache import PairDocASTCache
+from .incremental import PairDocDocument
+from .codegen import generate_module, compile_template, load_template
+from .function_cache import PairDocFunctionCache
+from .optimizer import optimize_ast
+from .modules import PairDocModuleCache, PairDocModule
+from .batch import build_docs, PairDocResult
@@ -0,0 +1,228 @@
+import struct
+import operator
+from array import array
+from .ast import PairDocASTNode, PairDocASTNodeTypes
+from .lexer import SourceSpan
+
+# 非节点值所占槽位的类型（节点槽位的类型为PairDocASTNodeTypes的值）
+_SLOT_STRING = -1
+_SLOT_NONE = -2
+_SLOT_LIST = -3
+
+# 槽位的子项形式，对应PairDocASTNode.children可能的几种取值
+_SHAPE_NONE = 0
+_SHAPE_STRING = 1
+_SHAPE_NODE = 2
+_SHAPE_LIST = 3
+
+_NODE_TYPES = {t.value: t for t in PairDocASTNodeTypes}
+
+_SLOT_TYPES = set(_NODE_TYPES) | {_SLOT_STRING, _SLOT_NONE, _SLOT_LIST}
+_SLOT_BYTES = 1 + 1 + 4 + 4 + 4 + 8 + 8 # 每个槽位在各数组中所占的字节数
+
+_MAGIC = b'PDA1'
+_HEADER = struct.Struct('<4sqqq') # 魔数、槽位数、字符串数、字符串数据长度
+
+
+class PairDocASTArena:
+    """
+    扁平存储的语法树：所有节点与子项值按槽位存放在并列数组中，0号槽位为根。
+    每个槽位记录类型、子项形式、首个子槽位、子槽位数、字符串表下标与源码区间；
+    同一槽位的子槽位连续存放，且总位于父槽位之后
+    """
+    def __init__(self):
+        self.types = array('b')
+        self.shapes = array('B')
+        self.firsts = array('i')
+        self.counts = array('i')
+        self.payloads = array('i') # 字符串表下标，-1表示无
+        self.span_starts = array('q') # SourceSpan文本的源码字节区间（此时没有字符串表下标），-1表示无
+        self.span_ends = array('q')
+        self.strings = []
+        self.string_index = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def node_type(self, index):
+        """槽位的节点类型，非节点值返回None"""
+        return _NODE_TYPES.get(self.types[index])
+
+    def children(self, index):
+        """槽位的子槽位下标"""
+        first = self.firsts[index]
+        return range(first, first + self.counts[index])
+
+    def payload(self, index, buffer=None):
+        """槽位的文本；源码中的文本需要给定源码buffer"""
+        payload = self.payloads[index]
+        if payload >= 0:
+            return self.strings[payload]
+        if self.span_starts[index] >= 0 and buffer is not None:
+            return SourceSpan(buffer, self.span_starts[index], self.span_ends[index])
+        return None
+
+    def _intern(self, text):
+        index = self.string_index.get(text)
+        if index is None:
+            index = self.string_index[text] = len(self.strings)
+            self.strings.append(text)
+        return index
+
+    def _alloc(self, value):
+        # 分配槽位，返回需要展开的子项列表（没有则为None）
+        if isinstance(value, PairDocASTNode):
+            slot_type = value.node_type.value
+            children = value.children
+            if children is None:
+                shape, items = _SHAPE_NONE, None
+            elif isinstance(children, (str, SourceSpan)):
+                shape, items = _SHAPE_STRING, None
+            elif isinstance(children, PairDocASTNode):
+                shape, items = _SHAPE_NODE, [children]
+            elif isinstance(children, list):
+                shape, items = _SHAPE_LIST, children
+            else:
+                raise ValueError('Unsupported AST children: ', children)
+            text = children if shape == _SHAPE_STRING else None
+        elif isinstance(value, (str, SourceSpan)):
+            slot_type, shape, items, text = _SLOT_STRING, _SHAPE_STRING, None, value
+        elif value is None:
+            slot_type, shape, items, text = _SLOT_NONE, _SHAPE_NONE, None, None
+        elif isinstance(value, list):
+            slot_type, shape, items, text = _SLOT_LIST, _SHAPE_LIST, value, None
+        else:
+            raise ValueError('Unsupported AST value: ', value)
+        self.types.append(slot_type)
+        self.shapes.append(shape)
+        self.firsts.append(0)
+        self.counts.append(0)
+        if isinstance(text, SourceSpan): # 只记录源码区间，不解码
+            self.payloads.append(-1)
+            self.span_starts.append(text.start)
+            self.span_ends.append(text.end)
+        else:
+            self.payloads.append(-1 if text is None else self._intern(text))
+            self.span_starts.append(-1)
+            self.span_ends.append(-1)
+        return items
+
+    @classmethod
+    def from_node(cls, node):
+        """由PairDocASTNode（或parse得到的节点列表）构造，不递归"""
+        arena = cls()
+        pending = [(0, arena._alloc(node))]
+        while pending:
+            index, items = pending.pop()
+            if items is None:
+                continue
+            first = len(arena.types)
+            arena.firsts[index] = first
+            arena.counts[index] = len(items)
+            expanded = [arena._alloc(item) for item in items]
+            pending.extend((first + k, sub_items) for k, sub_items in enumerate(expanded))
+        return arena
+
+    def to_node(self, buffer=None):
+        """
+        还原为PairDocASTNode。源码中的文本只存有字节区间，还原为指向源码buffer（UTF-8编码的缓冲区）的SourceSpan；
+        子槽位总在父槽位之后，因此倒序一遍即可自底向上构造
+        """
+        values = [None] * len(self.types)
+        types, shapes, firsts, counts = self.types, self.shapes, self.firsts, self.counts
+        span_starts, span_ends = self.span_starts, self.span_ends
+        for index in range(len(types) - 1, -1, -1):
+            shape = shapes[index]
+            if shape == _SHAPE_STRING:
+                start = span_starts[index]
+                if start < 0:
+                    children = self.strings[self.payloads[index]]
+                elif buffer is None:
+                    raise ValueError('AST arena text refers to the source buffer')
+                else:
+                    children = SourceSpan(buffer, start, span_ends[index])
+            elif shape == _SHAPE_NODE:
+                children = values[firsts[index]]
+            elif shape == _SHAPE_LIST:
+                first = firsts[index]
+                children = values[first:first + counts[index]]
+            else:
+                children = None
+            slot_type = types[index]
+            if slot_type >= 0:
+                values[index] = PairDocASTNode(_NODE_TYPES[slot_type], children)
+            else:
+                values[index] = children
+            if shape == _SHAPE_NODE or shape == _SHAPE_LIST:
+                values[firsts[index]:firsts[index] + counts[index]] = [None] * counts[index] # 尽早释放已挂接的子项
+        return values[0] if values else None
+
+    def to_bytes(self):
+        """序列化为一段bytes（数组按本机字节序存放）"""
+        encoded = [text.encode('utf-8') for text in self.strings]
+        lengths = array('q', (len(data) for data in encoded))
+        blob = b''.join(encoded)
+        return b''.join((
+            _HEADER.pack(_MAGIC, len(self.types), len(self.strings), len(blob)),
+            self.types.tobytes(),
+            self.shapes.tobytes(),
+            self.firsts.tobytes(),
+            self.counts.tobytes(),
+            self.payloads.tobytes(),
+            self.span_starts.tobytes(),
+            self.span_ends.tobytes(),
+            lengths.tobytes(),
+            blob,
+        ))
+
+    def write_to(self, file):
+        """一次写入二进制文件对象"""
+        file.write(self.to_bytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        """由to_bytes的结果构造；数据截断或损坏时抛出ValueError"""
+        data = memoryview(data)
+        if len(data) < _HEADER.size:
+            raise ValueError('Invalid AST arena data')
+        magic, size, string_count, blob_length = _HEADER.unpack_from(data, 0)
+        if (magic != _MAGIC or size < 0 or string_count < 0 or blob_length < 0
+                or len(data) != _HEADER.size + size * _SLOT_BYTES + string_count * 8 + blob_length):
+            raise ValueError('Invalid AST arena data')
+        arena = cls()
+        offset = _HEADER.size
+        for name, count in (('types', size), ('shapes', size), ('firsts', size), ('counts', size),
+                            ('payloads', size), ('span_starts', size), ('span_ends', size)):
+            target = getattr(arena, name)
+            length = count * target.itemsize
+            target.frombytes(data[offset:offset + length])
+            offset += length
+        lengths = array('q')
+        lengths.frombytes(data[offset:offset + string_count * lengths.itemsize])
+        offset += string_count * lengths.itemsize
+        if offset + blob_length > len(data):
+            raise ValueError('Invalid AST arena data')
+        for length in lengths:
+            if length < 0:
+                raise ValueError('Invalid AST arena data')
+            try:
+                text = str(data[offset:offset + length], 'utf-8')
+            except UnicodeDecodeError:
+                raise ValueError('Invalid AST arena data') from None
+            arena.string_index[text] = len(arena.strings)
+            arena.strings.append(text)
+            offset += length
+        if offset != len(data) or not arena._valid():
+            raise ValueError('Invalid AST arena data')
+        return arena
+
+    def _valid(self):
+        # 下标都在范围内，to_node不会越界
+        size = len(self.types)
+        if not size:
+            return True
+        return (set(self.types) <= _SLOT_TYPES and max(self.shapes) <= _SHAPE_LIST
+                and min(self.counts) >= 0 and min(self.firsts) >= 0
+                and max(map(operator.add, self.firsts, self.counts)) <= size
+                and min(self.payloads) >= -1 and max(self.payloads) < len(self.strings)
+                and all(p >= 0 or s >= 0 for p, s, shape in zip(self.payloads, self.span_starts, self.shapes) if shape == _SHAPE_STRING))
@@ -1,132 +1,292 @@
-from .lexer import PairDocTokenizer, PairDocTokenType
+from .lexer import PairDocTokenKind, TokenStream, TokenStreamView
 import enum
+import threading
+import contextlib
+from bisect import bisect_left
+from .steps import run_steps
+
+_OPEN_BRACKETS = {'{': '}', '[': ']', '(': ')'}
+_CLOSE_BRACKETS = ('}', ']', ')')
 
 class NextToken:
     # 用于获取下一个token list的类，自动匹配括号
     
     def __init__(self, tokens):
+        if tokens.partners is None:
+            tokens.match_brackets()
         self.tokens = tokens
         self.index = 0
     def next(self, start_idx:int):
         stack = []
-        next_tokens = []
-        if start_idx >= len(self.tokens):
-            return next_tokens
+        tokens = self.tokens
+        if start_idx >= len(tokens):
+            return tokens[start_idx:start_idx]
+        if tokens.balanced:
+            # 括号配对表中记录了到配对括号的距离，直接跳到组的末尾
+            end_idx = start_idx + tokens.partner(start_idx) + 1
+            if start_idx < end_idx <= len(tokens):
+                return tokens[start_idx:end_idx]
+        end_idx = start_idx
         while True:
-            if self.tokens[start_idx]['token'] in ('{', '[', '(') and self.tokens[start_idx]['type'] == PairDocTokenType.TokenType_SYMBOL:
-                stack.append(self.tokens[start_idx]['token'])
-                next_tokens.append(self.tokens[start_idx])
-            elif self.tokens[start_idx]['token'] in ('}', ']', ')') and self.tokens[start_idx]['type'] == PairDocTokenType.TokenType_SYMBOL:
+            token = tokens.text(end_idx)
+            is_symbol = tokens.kind(end_idx) == PairDocTokenKind.SYMBOL
+            if is_symbol and token in _OPEN_BRACKETS:
+                stack.append(token)
+            elif is_symbol and token in _CLOSE_BRACKETS:
                 if len(stack) == 0:
-                    return next_tokens
+                    return tokens[start_idx:end_idx]
                     #raise Exception('Unmatched bracket')
                 poped = stack.pop()
-                if (poped == '{' and self.tokens[start_idx]['token'] != '}') or \
-                    (poped == '[' and self.tokens[start_idx]['token'] != ']') or \
-                    (poped == '(' and self.tokens[start_idx]['token'] != ')'):
+                if _OPEN_BRACKETS[poped] != token:
                     raise Exception('Unmatched bracket')
-                
-                next_tokens.append(self.tokens[start_idx])
-            else:
-                next_tokens.append(self.tokens[start_idx])
-            start_idx += 1            
-            if len(stack) == 0 or start_idx >= len(self.tokens):
+            end_idx += 1
+            if len(stack) == 0 or end_idx >= len(tokens):
                 break
-        return next_tokens
+        return tokens[start_idx:end_idx]
     
 class Gather:
     # 将token list中的token按照括号匹配进行分组，方便后续处理
     def __init__(self, tokens):
+        if not isinstance(tokens, (TokenStream, TokenStreamView)):
+            tokens = TokenStream.from_tokens(tokens)
         self.tokens = tokens
     def gather(self):
-        gathered = []
-        offset = 0
-        while next_token := NextToken(self.tokens).next(offset):
-            gathered.append(next_token)
-            offset += len(next_token)
+        memo = node_matcher.memo
+        if memo is not None:
+            # 同一次解析中同一段token只分组一次，返回同一个列表，使记忆表能以列表身份命中
+            key = memo.key(self.tokens)
+            gathered = memo.gathered.get(key)
+            if gathered is not None:
+                return gathered
+        gathered = _gather_balanced(self.tokens)
+        if gathered is None:
+            gathered = []
+            offset = 0
+            next_tokens = NextToken(self.tokens)
+            while next_token := next_tokens.next(offset):
+                gathered.append(next_token)
+                offset += len(next_token)
+        if memo is not None:
+            memo.gathered[key] = gathered
         return gathered
 
+def _gather_balanced(tokens):
+    # 括号完全配对时按配对表直接切出各组的视图，与NextToken的结果相同；遇到其他情况返回None
+    if tokens.__class__ is TokenStreamView:
+        stream, i, end = tokens.stream, tokens.start, tokens.end
+    else:
+        if tokens.partners is None:
+            tokens.match_brackets()
+        stream, i, end = tokens, 0, len(tokens)
+    if not stream.balanced:
+        return None
+    partners = stream.partners
+    gathered = []
+    while i < end:
+        j = i + partners[i] + 1
+        if not i < j <= end:
+            return None
+        gathered.append(TokenStreamView(stream, i, j))
+        i = j
+    return gathered
+
+class TokenListView:
+    """
+    token组列表（Gather的结果）中[start, end)范围的视图，与原列表共享数据，不复制
+    """
+    __slots__ = ('items', 'start', 'end')
+
+    def __init__(self, items, start, end):
+        if isinstance(items, TokenListView):
+            start += items.start
+            end += items.start
+            items = items.items
+        self.items = items
+        self.start = start
+        self.end = max(start, end)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if i.__class__ is int and 0 <= i < self.end - self.start:
+            return self.items[self.start + i]
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.end - self.start)
+            if step != 1:
+                raise ValueError('TokenListView only supports contiguous slices')
+            return TokenListView(self.items, self.start + start, self.start + stop)
+        if 0 <= i < self.end - self.start:
+            return self.items[self.start + i]
+        if -(self.end - self.start) <= i < 0:
+            return self.items[self.end + i]
+        raise IndexError('token list index out of range')
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield self.items[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+# 以下辅助函数的参数均为Gather得到的一组token（TokenStream）
+
 def _is_doc(token_list):
+    if token_list.__class__ is TokenStreamView:
+        return token_list.end - token_list.start >= 2 and _group_code(token_list) == _CODE_DOC
     if len(token_list) < 2:
         return False
-    return token_list[0]['token'] == '{' and token_list[-1]['token'] == '}'
+    return token_list.text(0) == '{' and token_list.text(-1) == '}'
 
 def _unwrap_doc(token_list):
     if len(token_list) < 2:
-        return []
+        return token_list[0:0]
     return token_list[1:-1]
 
 def _is_pair(token_list):
+    if token_list.__class__ is TokenStreamView:
+        return token_list.end - token_list.start >= 2 and _group_code(token_list) == _CODE_PAIR
     if len(token_list) < 2:
         return False
-    return token_list[0]['token'] == '[' and token_list[-1]['token'] == ']'
+    return token_list.text(0) == '[' and token_list.text(-1) == ']'
 
 def _unwrap_pair(token_list):
     if len(token_list) < 2:
-        return []
+        return token_list[0:0]
     return token_list[1:-1]
 def _is_tuple(token_list):
+    if token_list.__class__ is TokenStreamView:
+        return token_list.end - token_list.start >= 2 and _group_code(token_list) == _CODE_TUPLE
     if len(token_list) < 2:
         return False
-    return token_list[0]['token'] == '(' and token_list[-1]['token'] == ')'
+    return token_list.text(0) == '(' and token_list.text(-1) == ')'
 
 def _unwrap_tuple(token_list):
     if len(token_list) < 2:
-        return []
+        return token_list[0:0]
     return token_list[1:-1]
 
 def _is_sharp(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == '#' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, '#')
 
 def _is_exclamation(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == '!' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, '!')
 
 def _is_let(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == ':=' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, ':=')
 
 def _is_assign(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == '=' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, '=')
 def _concat(token_list):
-    return ''.join([token['token'] for token in token_list])
+    if len(token_list) == 1:
+        return token_list.text(0) # 单个token直接返回，保留SourceSpan不解码
+    return ''.join([str(token_list.text(i)) for i in range(len(token_list))])
 
 def _is_to(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == '->' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, '->')
 
 def _is_separator(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == ';' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, ';')
 def _is_comma(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == ',' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, ',')
 def _is_string(token_list):
     if len(token_list) != 1:
         return False
-    return token_list[0]['type'] == PairDocTokenType.TokenType_STRING
+    return token_list.kind(0) == PairDocTokenKind.STRING
 def _is_number(token_list):
     if len(token_list) != 1:
         return False
-    return token_list[0]['type'] == PairDocTokenType.TokenType_NUMBER
+    return token_list.kind(0) == PairDocTokenKind.NUMBER
 def _is_linebreak(token_list):
-    if len(token_list) != 1:
-        return False
-    return token_list[0]['token'] == '---' and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return _is_symbol(token_list, '---')
 
 def _is_symbol(token_list, symbol):
+    if token_list.__class__ is TokenStreamView:
+        # 逐token调用的判断，直接读取原流的数组
+        start = token_list.start
+        if token_list.end - start != 1:
+            return False
+        stream = token_list.stream
+        return stream.kinds[start] == PairDocTokenKind.SYMBOL and stream.texts[stream.text_ids[start]] == symbol
     if len(token_list) != 1:
         return False
-    return token_list[0]['token'] == symbol and token_list[0]['type'] == PairDocTokenType.TokenType_SYMBOL
+    return token_list.is_symbol(0, symbol)
+
+
+# token组的分类，用于匹配器分派与预测式解析
+_CODE_OTHER = 0
+_CODE_SHARP = 1
+_CODE_SEMICOLON = 2
+_CODE_COMMA = 3
+_CODE_PLUS_MINUS = 4
+_CODE_DOT = 5
+_CODE_EXCLAMATION = 6
+_CODE_LET = 7
+_CODE_ASSIGN = 8
+_CODE_COLON = 9
+_CODE_TO = 10
+_CODE_LINEBREAK = 11
+_CODE_DOC = 12
+_CODE_PAIR = 13
+_CODE_TUPLE = 14
+_CODE_STRING = 15
+_CODE_NUMBER = 16
+
+_SYMBOL_CODES = {
+    '#': _CODE_SHARP,
+    ';': _CODE_SEMICOLON,
+    ',': _CODE_COMMA,
+    '+': _CODE_PLUS_MINUS,
+    '-': _CODE_PLUS_MINUS,
+    '.': _CODE_DOT,
+    '!': _CODE_EXCLAMATION,
+    ':=': _CODE_LET,
+    '=': _CODE_ASSIGN,
+    ':': _CODE_COLON,
+    '->': _CODE_TO,
+    '---': _CODE_LINEBREAK,
+}
+
+_BRACKET_CODES = {'{': ('}', _CODE_DOC), '[': (']', _CODE_PAIR), '(': (')', _CODE_TUPLE)}
+
+def _group_code(token_list):
+    if token_list.__class__ is TokenStreamView:
+        # 直接读取原流的数组，与下面的通用判断等价
+        stream, start, end = token_list.stream, token_list.start, token_list.end
+        if end - start == 1:
+            kind = stream.kinds[start]
+            if kind == PairDocTokenKind.SYMBOL:
+                return _SYMBOL_CODES.get(stream.texts[stream.text_ids[start]], _CODE_OTHER)
+            if kind == PairDocTokenKind.STRING:
+                return _CODE_STRING
+            if kind == PairDocTokenKind.NUMBER:
+                return _CODE_NUMBER
+            return _CODE_OTHER
+        if end - start < 2:
+            return _CODE_OTHER
+        texts, text_ids = stream.texts, stream.text_ids
+        first = texts[text_ids[start]]
+        if first.__class__ is str:
+            closing = _BRACKET_CODES.get(first)
+            if closing is not None and texts[text_ids[end - 1]] == closing[0]:
+                return closing[1]
+            return _CODE_OTHER
+    if len(token_list) == 1:
+        kind = token_list.kind(0)
+        if kind == PairDocTokenKind.SYMBOL:
+            return _SYMBOL_CODES.get(token_list.text(0), _CODE_OTHER)
+        if kind == PairDocTokenKind.STRING:
+            return _CODE_STRING
+        if kind == PairDocTokenKind.NUMBER:
+            return _CODE_NUMBER
+        return _CODE_OTHER
+    if _is_doc(token_list):
+        return _CODE_DOC
+    if _is_pair(token_list):
+        return _CODE_PAIR
+    if _is_tuple(token_list):
+        return _CODE_TUPLE
+    return _CODE_OTHER
 
 
 class PairDocASTNodeTypes(enum.Enum):
@@ -159,36 +319,120 @@ class PairDocASTNode:
     def __repr__(self):
         return self.__str__()
 
+class MatchMemo:
+    """
+    一次解析内的packrat记忆表：同一token序列、同一起点、同一优先级上限只匹配一次。
+    token序列以底层列表（或TokenStream）的身份和范围作为键，
+    解析期间持有这些对象，保证id不会被复用
+    """
+    def __init__(self):
+        self.results = {}
+        self.gathered = {}
+        self.hits = 0
+        self.misses = 0
+        self._alive = {}
+
+    def key(self, sequence, start_idx=0):
+        if isinstance(sequence, (TokenListView, TokenStreamView)):
+            base = sequence.items if isinstance(sequence, TokenListView) else sequence.stream
+            start, end = sequence.start, sequence.end
+        else:
+            base, start, end = sequence, 0, len(sequence)
+        self._alive[id(base)] = base
+        return id(base), start + start_idx, end
+
+class _MatchState(threading.local):
+    # 每个线程独立的解析状态
+    def __init__(self):
+        self.in_parse = False
+        self.memo = None
+
 class NodeMatcher:
     def __init__(self):
         self.matchers = {}
         self.matcher_order = []
+        self.dispatch = {} # (首组分类, 次组分类) -> 按优先级排列的可适用匹配器
+        self.state = _MatchState()
+
+    @property
+    def memo(self):
+        return self.state.memo
+
+    @contextlib.contextmanager
+    def parse_scope(self, memoize=True):
+        """顶层解析期间启用记忆表，嵌套的解析共享同一个记忆表"""
+        state = self.state
+        if state.in_parse:
+            yield state.memo
+            return
+        state.in_parse = True
+        state.memo = MatchMemo() if memoize else None
+        try:
+            yield state.memo
+        finally:
+            state.in_parse = False
+            state.memo = None
     
-    def register(self, priority: int):
-        """装饰器，用于注册匹配器并指定优先级"""
-        def decorator(matcher_class):
-            self.matchers[matcher_class.__name__] = matcher_class
+    def register(self, priority: int, first=None, second=None):
+        """
+        装饰器，用于注册匹配器并指定优先级。
+        匹配器是无状态的可调用对象match(token_list, start_idx)，注册类时使用其match静态方法；
+        first/second为匹配器可能适用的首个/第二个token组的分类（None表示不限），用于分派索引
+        """
+        def decorator(matcher):
+            name = matcher.__name__
+            self.matchers[name] = (matcher.match if isinstance(matcher, type) else matcher, first, second)
             # 按优先级插入
             for i, (p, _) in enumerate(self.matcher_order):
                 if priority > p:
-                    self.matcher_order.insert(i, (priority, matcher_class.__name__))
+                    self.matcher_order.insert(i, (priority, name))
                     break
             else:
-                self.matcher_order.append((priority, matcher_class.__name__))
-            return matcher_class
+                self.matcher_order.append((priority, name))
+            self.dispatch.clear()
+            return matcher
         return decorator
-    
+
+    def candidates(self, first, second):
+        """首/次token组分类为first/second时可能适用的(优先级, 匹配器)"""
+        key = (first, second)
+        candidates = self.dispatch.get(key)
+        if candidates is None:
+            candidates = []
+            for priority, name in self.matcher_order:
+                match, accept_first, accept_second = self.matchers[name]
+                if accept_first is not None and first not in accept_first:
+                    continue
+                if accept_second is not None and second not in accept_second:
+                    continue
+                candidates.append((priority, match))
+            candidates = self.dispatch[key] = tuple(candidates)
+        return candidates
+
     def match(self, token_list, start_idx, skip_priority=None):
         """按优先级顺序尝试匹配"""
 
         if token_list is None or len(token_list) == 0:
             return PairDocASTNode(PairDocASTNodeTypes.NONE, None), 0
-        for priority, matcher_name in self.matcher_order:
+        memo = self.state.memo
+        if memo is None:
+            return self._match(token_list, start_idx, skip_priority)
+        key = memo.key(token_list, start_idx) + (skip_priority,)
+        result = memo.results.get(key)
+        if result is not None:
+            memo.hits += 1
+            return result
+        memo.misses += 1
+        result = memo.results[key] = self._match(token_list, start_idx, skip_priority)
+        return result
+
+    def _match(self, token_list, start_idx, skip_priority):
+        first = _group_code(token_list[start_idx])
+        second = _group_code(token_list[start_idx + 1]) if start_idx + 1 < len(token_list) else None
+        for priority, match in self.candidates(first, second):
             if skip_priority is not None and priority >= skip_priority:
                 continue
-            matcher_class = self.matchers[matcher_name]
-            matcher = matcher_class(token_list)
-            node, offset = matcher.match(start_idx)
+            node, offset = match(token_list, start_idx)
             if node:
                 return node, offset
         return None, 0
@@ -199,33 +443,32 @@ node_matcher = NodeMatcher()
 @node_matcher.register(priority=60)
 class PairDocSeparator:
     # 匹配 ;
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
+    @staticmethod
+    def match(token_list, start_idx):
         # 后向匹配，先搜索分号
         offset = 0
 
-        left = []
         separated = []
         last_offset = 0
-        while start_idx + offset < len(self.token_list):
-            if _is_separator(self.token_list[start_idx + offset]):
+        length = len(token_list)
+        while start_idx + offset < length:
+            if _is_separator(token_list[start_idx + offset]):
+                left = TokenListView(token_list, start_idx + last_offset, start_idx + offset)
                 node, node_offset = node_matcher.match(left, 0)
                 if not node:
                     return None, 0
                 if node_offset != len(left):
                     raise Exception("Invalid separator: Left side can't be fully matched: ", left)
                 separated.append(node)
-                left = []
                 offset += 1
                 last_offset = offset
-            elif _is_sharp(self.token_list[start_idx + offset]):
+            elif _is_sharp(token_list[start_idx + offset]):
                 break # 遇到新的#，停止匹配
             else:
-                left.append(self.token_list[start_idx + offset])
                 offset += 1
         if len(separated) == 0:
             return None, 0
+        left = TokenListView(token_list, start_idx + last_offset, start_idx + offset)
         node, node_offset = node_matcher.match(left, 0)
         if not node:
             return None, 0
@@ -234,66 +477,63 @@ class PairDocSeparator:
 @node_matcher.register(priority=59)
 class PairDocTuple:
     # 匹配 xxx, xxx, ...
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
+    @staticmethod
+    def match(token_list, start_idx):
         offset = 0
 
-        left = []
         separated = []
         last_offset = 0
-        while start_idx + offset < len(self.token_list):
-            if _is_comma(self.token_list[start_idx + offset]):
+        length = len(token_list)
+        while start_idx + offset < length:
+            if _is_comma(token_list[start_idx + offset]):
+                left = TokenListView(token_list, start_idx + last_offset, start_idx + offset)
                 node, node_offset = node_matcher.match(left, 0)
                 if not node:
                     return None, 0
                 if node_offset != len(left):
                     raise Exception("Invalid tuple: Left side can't be fully matched: ", left)
                 separated.append(node)
-                left = []
                 offset += 1
                 last_offset = offset
-            elif _is_sharp(self.token_list[start_idx + offset]):
+            elif _is_sharp(token_list[start_idx + offset]):
                 break # 遇到新的#，停止匹配
             else:
-                left.append(self.token_list[start_idx + offset])
                 offset += 1
         if len(separated) == 0:
             return None, 0
+        left = TokenListView(token_list, start_idx + last_offset, start_idx + offset)
         node, node_offset = node_matcher.match(left, 0)
         if not node:
             return None, 0
         return PairDocASTNode(PairDocASTNodeTypes.TUPLE, separated + [node]), last_offset + node_offset
 
 
-@node_matcher.register(priority=50)
+@node_matcher.register(priority=50, first=(_CODE_EXCLAMATION,))
 class PairDocNeverReturn:
     # 匹配 !
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if not _is_exclamation(self.token_list[start_idx]):
+    @staticmethod
+    def match(token_list, start_idx):
+        if not _is_exclamation(token_list[start_idx]):
             return None, 0
-        guess, offset = node_matcher.match(self.token_list, start_idx + 1)
+        guess, offset = node_matcher.match(token_list, start_idx + 1)
         if not guess:
             return None, 0
         return PairDocASTNode(PairDocASTNodeTypes.NEVERRETURN, guess), offset + 1
 
 
-@node_matcher.register(priority=40)
+@node_matcher.register(priority=40, second=(_CODE_LET,))
 class PairDocLet:
     # 匹配 xxx := xxx
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if start_idx + 2 >= len(self.token_list):
+    @staticmethod
+    def match(token_list, start_idx):
+        if start_idx + 2 >= len(token_list):
             return None, 0
-        if not _is_let(self.token_list[start_idx+1]):
+        if not _is_let(token_list[start_idx+1]):
             return None, 0
         
-        left = Gather(self.token_list[start_idx]).gather()
+        left = Gather(token_list[start_idx]).gather()
 
-        right_guess, offset = node_matcher.match(self.token_list, start_idx + 2) # 尝试匹配右边的表达式
+        right_guess, offset = node_matcher.match(token_list, start_idx + 2) # 尝试匹配右边的表达式
         if not right_guess:
             return None, 0
         
@@ -305,20 +545,19 @@ class PairDocLet:
         right_node = right_guess
         return PairDocASTNode(PairDocASTNodeTypes.LET, [left_node, right_node]), offset + 2
 
-@node_matcher.register(priority=30)
+@node_matcher.register(priority=30, second=(_CODE_ASSIGN,))
 class PairDocAssign:
     # 匹配 xxx = xxx
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if start_idx + 2 >= len(self.token_list):
+    @staticmethod
+    def match(token_list, start_idx):
+        if start_idx + 2 >= len(token_list):
             return None, 0
-        if not _is_assign(self.token_list[start_idx+1]):
+        if not _is_assign(token_list[start_idx+1]):
             return None, 0
         
-        left = Gather(self.token_list[start_idx]).gather()
+        left = Gather(token_list[start_idx]).gather()
 
-        right_guess, offset = node_matcher.match(self.token_list, start_idx + 2) # 尝试匹配右边的表达式
+        right_guess, offset = node_matcher.match(token_list, start_idx + 2) # 尝试匹配右边的表达式
         if not right_guess:
             return None, 0
         
@@ -334,54 +573,52 @@ class PairDocAssign:
 @node_matcher.register(priority=10)
 class PairDocOperatorLevel1:
     # +, -
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
+    @staticmethod
+    def match(token_list, start_idx):
         # 后向匹配，先搜索+和-
         offset = 0
 
-        left = []
         operation = None
         last_offset = 0
-        while start_idx + offset < len(self.token_list):
-            if _is_symbol(self.token_list[start_idx + offset], '+') or _is_symbol(self.token_list[start_idx + offset], '-'):
+        length = len(token_list)
+        while start_idx + offset < length:
+            if _is_symbol(token_list[start_idx + offset], '+') or _is_symbol(token_list[start_idx + offset], '-'):
+                left = TokenListView(token_list, start_idx, start_idx + offset)
                 node, node_offset = node_matcher.match(left, 0)
                 if not node:
                     return None, 0
                 if node_offset != len(left):
                     return None, 0
-                operation = self.token_list[start_idx + offset][0]['token']
+                operation = token_list[start_idx + offset].text(0)
                 offset += 1
                 last_offset = offset
                 left = node
                 break
-            elif _is_sharp(self.token_list[start_idx + offset]):
+            elif _is_sharp(token_list[start_idx + offset]):
                 break # 遇到新的#，停止匹配
             else:
-                left.append(self.token_list[start_idx + offset])
                 offset += 1
         if operation is None:
             return None, 0
-        node, node_offset = node_matcher.match(self.token_list, last_offset + start_idx)
+        node, node_offset = node_matcher.match(token_list, last_offset + start_idx)
         if not node:
             return None, 0
         return PairDocASTNode(PairDocASTNodeTypes.OPERATION, [left, operation, node]), last_offset + node_offset
 
 
-@node_matcher.register(priority=5)
+@node_matcher.register(priority=5, second=(_CODE_COLON,))
 class PairDocFunctionKeyVal:
     # 匹配 xxx: xxx
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if start_idx + 2 >= len(self.token_list):
+    @staticmethod
+    def match(token_list, start_idx):
+        if start_idx + 2 >= len(token_list):
             return None, 0
-        if not _is_symbol(self.token_list[start_idx+1], ':'):
+        if not _is_symbol(token_list[start_idx+1], ':'):
             return None, 0
         
-        left = Gather(self.token_list[start_idx]).gather()
+        left = Gather(token_list[start_idx]).gather()
 
-        right_guess, offset = node_matcher.match(self.token_list, start_idx + 2)
+        right_guess, offset = node_matcher.match(token_list, start_idx + 2)
 
         left_node, left_offset = node_matcher.match(left, 0)
         if not left_node:
@@ -391,39 +628,37 @@ class PairDocFunctionKeyVal:
         right_node = right_guess
         return PairDocASTNode(PairDocASTNodeTypes.KEYVAL, [left_node, right_node]), offset + 2
 
-@node_matcher.register(priority=4)
+@node_matcher.register(priority=4, first=(_CODE_TUPLE,), second=(_CODE_TO,))
 class PairDocFunctionDef:
     # 匹配 (xxx) -> {xxx}
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if start_idx + 2 >= len(self.token_list):
+    @staticmethod
+    def match(token_list, start_idx):
+        if start_idx + 2 >= len(token_list):
             return None, 0
-        if not _is_tuple(self.token_list[start_idx]) or not _is_to(self.token_list[start_idx+1]) or not _is_doc(self.token_list[start_idx+2]):
+        if not _is_tuple(token_list[start_idx]) or not _is_to(token_list[start_idx+1]) or not _is_doc(token_list[start_idx+2]):
             return None, 0
         
-        left_node, left_offset = node_matcher.match(Gather(_unwrap_tuple(self.token_list[start_idx])).gather(), 0)
+        left_node, left_offset = node_matcher.match(Gather(_unwrap_tuple(token_list[start_idx])).gather(), 0)
         if not left_node:
             return None, 0
-        right_node = PairDocASTParser(Gather(_unwrap_doc(self.token_list[start_idx+2])).gather()).parse_doc()
+        right_node = PairDocASTParser(Gather(_unwrap_doc(token_list[start_idx+2])).gather()).parse_doc()
         if not right_node:
             return None, 0
         return PairDocASTNode(PairDocASTNodeTypes.FUNCTIONDEF, [left_node, right_node]), 3
 
-@node_matcher.register(priority=4)
+@node_matcher.register(priority=4, second=(_CODE_PAIR, _CODE_DOC))
 class PairDocStyle:
     # 匹配 xxx {...} 或 xxx [...] {...}
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if not (start_idx + 2 < len(self.token_list) and _is_pair(self.token_list[start_idx+1]) and _is_doc(self.token_list[start_idx+2])) and \
-            not (start_idx + 1 < len(self.token_list) and _is_doc(self.token_list[start_idx+1])):
+    @staticmethod
+    def match(token_list, start_idx):
+        if not (start_idx + 2 < len(token_list) and _is_pair(token_list[start_idx+1]) and _is_doc(token_list[start_idx+2])) and \
+            not (start_idx + 1 < len(token_list) and _is_doc(token_list[start_idx+1])):
             return None, 0
         
-        if _is_pair(self.token_list[start_idx+1]):
-            left = Gather(self.token_list[start_idx]).gather()
-            args = Gather(_unwrap_pair(self.token_list[start_idx+1])).gather()
-            body = Gather(_unwrap_doc(self.token_list[start_idx+2])).gather()
+        if _is_pair(token_list[start_idx+1]):
+            left = Gather(token_list[start_idx]).gather()
+            args = Gather(_unwrap_pair(token_list[start_idx+1])).gather()
+            body = Gather(_unwrap_doc(token_list[start_idx+2])).gather()
             left_node, left_offset = node_matcher.match(left, 0)
             if not left_node:
                 return None, 0
@@ -437,8 +672,8 @@ class PairDocStyle:
             body_node = PairDocASTParser(body).parse_doc()
             return PairDocASTNode(PairDocASTNodeTypes.STYLE, [left_node, args_node, body_node]), 3            
         else:
-            left = Gather(self.token_list[start_idx]).gather()
-            body = Gather(_unwrap_doc(self.token_list[start_idx+1])).gather()
+            left = Gather(token_list[start_idx]).gather()
+            body = Gather(_unwrap_doc(token_list[start_idx+1])).gather()
             left_node, left_offset = node_matcher.match(left, 0)
             if not left_node:
                 return None, 0
@@ -450,24 +685,24 @@ class PairDocStyle:
 @node_matcher.register(priority=3)
 class PairDocMemberAccess:
     """匹配成员访问操作：xxx[xxx] 和 xxx.xxx"""
-    def __init__(self, token_list):
-        self.token_list = token_list
 
-    def match(self, start_idx):
+    @staticmethod
+    def match(token_list, start_idx):
         # 尝试匹配 [] 或 . 或 () 访问操作
         offset = 0
         access_points = []  # [(offset, type)] type: '[]' 或 '.'
-        while start_idx + offset < len(self.token_list):
-            if _is_pair(self.token_list[start_idx + offset]):
+        length = len(token_list)
+        while start_idx + offset < length:
+            if _is_pair(token_list[start_idx + offset]):
                 access_points.append((offset, '[]'))
                 offset += 1
-            elif _is_symbol(self.token_list[start_idx + offset], '.'):
+            elif _is_symbol(token_list[start_idx + offset], '.'):
                 access_points.append((offset, '.'))
                 offset += 1
-            elif _is_tuple(self.token_list[start_idx + offset]):
+            elif _is_tuple(token_list[start_idx + offset]):
                 access_points.append((offset, '()'))
                 offset += 1
-            elif _is_sharp(self.token_list[start_idx + offset]):
+            elif _is_sharp(token_list[start_idx + offset]):
                 break
             else:
                 offset += 1
@@ -479,7 +714,7 @@ class PairDocMemberAccess:
         idx = 0
         while idx < len(access_points):
             test_node, test_offset = node_matcher.match(
-                self.token_list[start_idx:start_idx + access_points[idx][0]], 
+                TokenListView(token_list, start_idx, start_idx + access_points[idx][0]),
                 0
             )
             if not test_node:
@@ -493,7 +728,7 @@ class PairDocMemberAccess:
             return None, 0
 
         # 处理左侧表达式
-        left = self.token_list[start_idx:start_idx + access_points[idx][0]]
+        left = TokenListView(token_list, start_idx, start_idx + access_points[idx][0])
         left_node, left_offset = node_matcher.match(left, 0)
         if not left_node or len(left) != left_offset:
             return None, 0
@@ -501,14 +736,14 @@ class PairDocMemberAccess:
         access_type = access_points[idx][1]
         if access_type == '[]':
             # 处理索引访问
-            index = Gather(_unwrap_pair(self.token_list[start_idx + access_points[idx][0]])).gather()
+            index = Gather(_unwrap_pair(token_list[start_idx + access_points[idx][0]])).gather()
             index_node, index_offset = node_matcher.match(index, 0)
             if not index_node or index_offset != len(index):
                 return None, 0
             right_node = index_node
         elif access_type == '()':
             # 处理函数调用
-            args = Gather(_unwrap_tuple(self.token_list[start_idx + access_points[idx][0]])).gather()
+            args = Gather(_unwrap_tuple(token_list[start_idx + access_points[idx][0]])).gather()
             args_node, args_offset = node_matcher.match(args, 0)
             if not args_node or args_offset != len(args):
                 return None, 0
@@ -518,7 +753,7 @@ class PairDocMemberAccess:
         else:  # access_type == '.'
             # 处理属性访问
             right_node, right_offset = node_matcher.match(
-                self.token_list, 
+                token_list, 
                 start_idx + access_points[idx][0] + 1
             )
             if not right_node:
@@ -540,31 +775,37 @@ class PairDocMemberAccess:
 @node_matcher.register(priority=1)
 class PairDocVariable:
     # 匹配变量
-    def __init__(self, token_list):
-        self.token_list = token_list
-    def match(self, start_idx):
-        if _is_tuple(self.token_list[start_idx]):
-            node, offset = node_matcher.match(Gather(_unwrap_tuple(self.token_list[start_idx])).gather(), 0)
+    @staticmethod
+    def match(token_list, start_idx):
+        if _is_tuple(token_list[start_idx]):
+            node, offset = node_matcher.match(Gather(_unwrap_tuple(token_list[start_idx])).gather(), 0)
             if not node:
                 return None, 0
             return node, 1
-        if _is_doc(self.token_list[start_idx]):
-            return PairDocASTParser(Gather(_unwrap_doc(self.token_list[start_idx])).gather()).parse(), 1
-        if _is_string(self.token_list[start_idx]):
-            return PairDocASTNode(PairDocASTNodeTypes.TEXT, _concat(self.token_list[start_idx])), 1
-        if _is_number(self.token_list[start_idx]):
-            return PairDocASTNode(PairDocASTNodeTypes.NUMBER, _concat(self.token_list[start_idx])), 1
-        if _is_linebreak(self.token_list[start_idx]):
+        if _is_doc(token_list[start_idx]):
+            return PairDocASTParser(Gather(_unwrap_doc(token_list[start_idx])).gather()).parse(), 1
+        if _is_string(token_list[start_idx]):
+            return PairDocASTNode(PairDocASTNodeTypes.TEXT, _concat(token_list[start_idx])), 1
+        if _is_number(token_list[start_idx]):
+            return PairDocASTNode(PairDocASTNodeTypes.NUMBER, _concat(token_list[start_idx])), 1
+        if _is_linebreak(token_list[start_idx]):
             return PairDocASTNode(PairDocASTNodeTypes.VARIABLE, "@linebreak"), 1
-        return PairDocASTNode(PairDocASTNodeTypes.VARIABLE, _concat(self.token_list[start_idx])), 1
+        return PairDocASTNode(PairDocASTNodeTypes.VARIABLE, _concat(token_list[start_idx])), 1
 
 
 
 class PairDocASTParser:
-    def __init__(self, token_list):
+    def __init__(self, token_list, memoize=True):
         self.token_list = token_list
         self.offset = 0
+        self.memoize = memoize
+        self.memo = None # 解析使用的MatchMemo，可通过hits/misses查看命中情况
     def parse(self)->list: # 返回一个list，每个元素是一个PairDocASTNode
+        with node_matcher.parse_scope(self.memoize) as memo:
+            self.memo = memo
+            return self._parse()
+
+    def _parse(self):
         ret = []
 
         not_doc = False
@@ -598,3 +839,407 @@ class PairDocASTParser:
 
     def parse_doc(self):
         return PairDocASTNode(PairDocASTNodeTypes.DOC, self.parse())
+
+
+class _GroupTable:
+    """
+    一个token组列表的预计算信息：每组的分类，以及从每个位置起下一个#、;、,、+/-和成员访问点的下标，
+    使各产生式能否适用都可以O(1)判断
+    """
+    def __init__(self, items):
+        n = len(items)
+        self.codes = codes = [_group_code(g) for g in items]
+        self.next_sharp = next_sharp = [n] * (n + 1)
+        self.next_semicolon = next_semicolon = [n] * (n + 1)
+        self.next_comma = next_comma = [n] * (n + 1)
+        self.next_plus_minus = next_plus_minus = [n] * (n + 1)
+        self.next_access = next_access = [n] * (n + 1)
+        # 从后向前一遍扫描，同时得到各个分类的下一个位置
+        sharp = semicolon = comma = plus_minus = access = n
+        for k in range(n - 1, -1, -1):
+            code = codes[k]
+            if code == _CODE_SHARP:
+                sharp = k
+            elif code == _CODE_SEMICOLON:
+                semicolon = k
+            elif code == _CODE_COMMA:
+                comma = k
+            elif code == _CODE_PLUS_MINUS:
+                plus_minus = k
+            elif code == _CODE_PAIR or code == _CODE_DOT or code == _CODE_TUPLE:
+                access = k
+            next_sharp[k] = sharp
+            next_semicolon[k] = semicolon
+            next_comma[k] = comma
+            next_plus_minus[k] = plus_minus
+            next_access[k] = access
+
+
+class _AccessScan:
+    """
+    成员访问从同一起点开始的逐个访问点检查，各终点的匹配共用：
+    points为按顺序找到的访问点（最后一个不小于已查询过的终点），full为左侧能完整匹配的前几个访问点的个数，
+    stopped表示第full个访问点的左侧不能完整匹配，unmatched表示其左侧匹配失败
+    """
+    __slots__ = ('points', 'full', 'stopped', 'unmatched')
+
+    def __init__(self, first):
+        self.points = [first]
+        self.full = 0
+        self.stopped = False
+        self.unmatched = False
+
+
+_NO_MATCH = (None, 0)
+# 单独出现时可能由变量以外的产生式匹配的分类
+_COMPOUND_CODES = frozenset((_CODE_SEMICOLON, _CODE_COMMA, _CODE_EXCLAMATION, _CODE_PLUS_MINUS))
+
+class PairDocPrecedenceParser:
+    """
+    预测式解析器，与PairDocASTParser生成完全相同的语法树。
+    不再逐个尝试已注册的匹配器，而是按优先级表（与node_matcher的注册优先级一致）
+    依据预计算的分组信息直接判断可以适用的产生式；每个(列表, 起点, 终点)的结果只计算一次
+    """
+    def __init__(self, token_list):
+        self.token_list = token_list
+        self.offset = 0
+        self._tables = {}
+        self._results = {}
+        self._access_scans = {}
+        self._gathered = {}
+        self._alive = []
+
+    def parse(self)->list:
+        return run_steps(self._parse(self.token_list))
+
+    def parse_doc(self):
+        return PairDocASTNode(PairDocASTNodeTypes.DOC, self.parse())
+
+    def _table(self, items):
+        table = self._tables.get(id(items))
+        if table is None:
+            table = self._tables[id(items)] = _GroupTable(items)
+            self._alive.append(items)
+        return table
+
+    def _gather(self, tokens):
+        # 同一段token只分组一次，保证列表身份稳定
+        key = (id(tokens.stream), tokens.start, tokens.end) if isinstance(tokens, TokenStreamView) else None
+        if key is not None and key in self._gathered:
+            return self._gathered[key]
+        gathered = Gather(tokens).gather()
+        if key is not None:
+            self._gathered[key] = gathered
+            self._alive.append(tokens.stream)
+        return gathered
+
+    # 以下方法返回由run_steps运行的步骤（生成器），嵌套的匹配不占用Python调用栈；
+    # 结果已知时直接返回(节点, offset)，产出它与产出得到该结果的步骤相同
+
+    def _parse(self, items):
+        # 与PairDocASTParser.parse相同的顶层循环
+        ret = []
+        codes = self._table(items).codes
+        offset = 0
+        n = len(items)
+        not_doc = False
+        while offset < n:
+            code = codes[offset]
+            if code == _CODE_SHARP:
+                not_doc = True
+                offset += 1
+                continue
+            if not_doc:
+                node, node_offset = yield self._match(items, n, offset)
+                if node:
+                    ret.append(node)
+                    offset += node_offset
+                else:
+                    offset += 1
+                not_doc = False
+            else:
+                if code == _CODE_DOC or code == _CODE_PAIR or code == _CODE_TUPLE:
+                    ret.append((yield self._parse_doc(self._gather(items[offset][1:-1]))))
+                else:
+                    ret.append(PairDocASTNode(PairDocASTNodeTypes.TEXT, _concat(items[offset])))
+                offset += 1
+        return ret
+
+    def _parse_doc(self, items):
+        return PairDocASTNode(PairDocASTNodeTypes.DOC, (yield self._parse(items)))
+
+    def _match_list(self, items):
+        return self._match_view(items, 0, len(items))
+
+    def _match_view(self, items, start, end):
+        """匹配子序列items[start:end]，对应node_matcher.match(items[start:end], 0)"""
+        if start == end:
+            return PairDocASTNode(PairDocASTNodeTypes.NONE, None), 0
+        return self._match(items, end, start)
+
+    def _match(self, items, end, start_idx):
+        """
+        在以end为结尾的非空序列中从start_idx开始匹配的步骤，返回的offset相对于start_idx
+        """
+        if start_idx >= end:
+            raise IndexError('token list index out of range')
+        key = (id(items), start_idx, end)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+        return self._match_uncached(items, end, start_idx, key)
+
+    def _match_uncached(self, items, hi, i, key):
+        # 各产生式先做O(1)的适用性判断，不适用时直接返回_NO_MATCH而不创建步骤
+        table = self._table(items)
+        if hi - i == 1 and table.codes[i] not in _COMPOUND_CODES:
+            # 单个token组且不会被其他产生式匹配：只能是变量
+            result = self._variable(items, table, hi, i)
+            if result.__class__ is not tuple:
+                result = yield result
+            self._results[key] = result
+            return result
+        for production in self._PRECEDENCE:
+            result = production(self, items, table, hi, i)
+            if result.__class__ is not tuple:
+                result = yield result
+            if result[0]:
+                break
+        else:
+            result = _NO_MATCH
+        self._results[key] = result
+        return result
+
+    def _separated(self, items, table, hi, i, next_index, node_type, name):
+        # 优先级60/59：以;或,分隔，直到下一个#为止
+        end = min(table.next_sharp[i], hi)
+        split = next_index[i]
+        if split >= end:
+            return _NO_MATCH
+        return self._separated_steps(items, i, end, split, next_index, node_type, name)
+
+    def _separated_steps(self, items, i, end, split, next_index, node_type, name):
+        separated = []
+        start = i
+        while split < end:
+            node, node_offset = yield self._match_view(items, start, split)
+            if not node:
+                return None, 0
+            if node_offset != split - start:
+                raise Exception("Invalid %s: Left side can't be fully matched: " % name, TokenListView(items, start, split))
+            separated.append(node)
+            start = split + 1
+            split = next_index[start]
+        node, node_offset = yield self._match_view(items, start, end)
+        if not node:
+            return None, 0
+        return PairDocASTNode(node_type, separated + [node]), start - i + node_offset
+
+    def _separator(self, items, table, hi, i):
+        return self._separated(items, table, hi, i, table.next_semicolon, PairDocASTNodeTypes.SEPARATOR, 'separator')
+
+    def _tuple(self, items, table, hi, i):
+        return self._separated(items, table, hi, i, table.next_comma, PairDocASTNodeTypes.TUPLE, 'tuple')
+
+    def _never_return(self, items, table, hi, i):
+        # 优先级50：!xxx
+        if table.codes[i] != _CODE_EXCLAMATION:
+            return _NO_MATCH
+        return self._never_return_steps(items, hi, i)
+
+    def _never_return_steps(self, items, hi, i):
+        guess, offset = yield self._match(items, hi, i + 1)
+        if not guess:
+            return None, 0
+        return PairDocASTNode(PairDocASTNodeTypes.NEVERRETURN, guess), offset + 1
+
+    def _binding(self, items, table, hi, i, code, node_type, name):
+        # 优先级40/30：xxx := xxx 与 xxx = xxx
+        if i + 2 >= hi or table.codes[i + 1] != code:
+            return _NO_MATCH
+        return self._binding_steps(items, hi, i, node_type, name)
+
+    def _binding_steps(self, items, hi, i, node_type, name):
+        right_node, offset = yield self._match(items, hi, i + 2)
+        if not right_node:
+            return None, 0
+        left_node, left_offset = yield self._match_view(items, i, i + 1)
+        if not left_node:
+            return None, 0
+        if left_offset != 1:
+            raise Exception("Invalid %s: Left side can't be fully matched: " % name, TokenListView(items, i, i + 1))
+        return PairDocASTNode(node_type, [left_node, right_node]), offset + 2
+
+    def _let(self, items, table, hi, i):
+        return self._binding(items, table, hi, i, _CODE_LET, PairDocASTNodeTypes.LET, 'let')
+
+    def _assign(self, items, table, hi, i):
+        return self._binding(items, table, hi, i, _CODE_ASSIGN, PairDocASTNodeTypes.ASSIGN, 'assgin')
+
+    def _operator_level1(self, items, table, hi, i):
+        # 优先级10：第一个+或-，左侧必须完整匹配，右侧向后匹配
+        split = table.next_plus_minus[i]
+        if split >= min(table.next_sharp[i], hi):
+            return _NO_MATCH
+        return self._operator_level1_steps(items, hi, i, split)
+
+    def _operator_level1_steps(self, items, hi, i, split):
+        left_node, left_offset = yield self._match_view(items, i, split)
+        if not left_node or left_offset != split - i:
+            return None, 0
+        right_node, right_offset = yield self._match(items, hi, split + 1)
+        if not right_node:
+            return None, 0
+        return PairDocASTNode(PairDocASTNodeTypes.OPERATION, [left_node, items[split].text(0), right_node]), split + 1 - i + right_offset
+
+    def _key_value(self, items, table, hi, i):
+        # 优先级5：xxx: xxx，右侧允许匹配失败
+        if i + 2 >= hi or table.codes[i + 1] != _CODE_COLON:
+            return _NO_MATCH
+        return self._key_value_steps(items, hi, i)
+
+    def _key_value_steps(self, items, hi, i):
+        right_node, offset = yield self._match(items, hi, i + 2)
+        left_node, left_offset = yield self._match_view(items, i, i + 1)
+        if not left_node:
+            return None, 0
+        if left_offset != 1:
+            raise Exception("Invalid key value pair: Left side can't be fully matched: ", TokenListView(items, i, i + 1))
+        return PairDocASTNode(PairDocASTNodeTypes.KEYVAL, [left_node, right_node]), offset + 2
+
+    def _function_def(self, items, table, hi, i):
+        # 优先级4：(xxx) -> {xxx}
+        codes = table.codes
+        if i + 2 >= hi or codes[i] != _CODE_TUPLE or codes[i + 1] != _CODE_TO or codes[i + 2] != _CODE_DOC:
+            return _NO_MATCH
+        return self._function_def_steps(items, i)
+
+    def _function_def_steps(self, items, i):
+        left_node, left_offset = yield self._match_list(self._gather(items[i][1:-1]))
+        if not left_node:
+            return None, 0
+        right_node = yield self._parse_doc(self._gather(items[i + 2][1:-1]))
+        return PairDocASTNode(PairDocASTNodeTypes.FUNCTIONDEF, [left_node, right_node]), 3
+
+    def _style(self, items, table, hi, i):
+        # 优先级4：xxx {...} 或 xxx [...] {...}
+        codes = table.codes
+        with_args = i + 2 < hi and codes[i + 1] == _CODE_PAIR and codes[i + 2] == _CODE_DOC
+        if not with_args and not (i + 1 < hi and codes[i + 1] == _CODE_DOC):
+            return _NO_MATCH
+        return self._style_steps(items, i, with_args)
+
+    def _style_steps(self, items, i, with_args):
+        if with_args:
+            args = self._gather(items[i + 1][1:-1])
+            body = self._gather(items[i + 2][1:-1])
+        else:
+            body = self._gather(items[i + 1][1:-1])
+        left_node, left_offset = yield self._match_view(items, i, i + 1)
+        if not left_node:
+            return None, 0
+        if left_offset != 1:
+            raise Exception("Invalid style: Left side can't be fully matched: ", TokenListView(items, i, i + 1))
+        if not with_args:
+            return PairDocASTNode(PairDocASTNodeTypes.STYLE, [left_node, None, (yield self._parse_doc(body))]), 2
+        args_node, args_offset = yield self._match_list(args)
+        if not args_node:
+            return None, 0
+        if args_offset != len(args):
+            raise Exception("Invalid style: Args can't be fully matched: ", args)
+        return PairDocASTNode(PairDocASTNodeTypes.STYLE, [left_node, args_node, (yield self._parse_doc(body))]), 3
+
+    def _member_access(self, items, table, hi, i):
+        # 优先级3：xxx[xxx]、xxx.xxx、xxx(xxx)，取左侧能完整匹配的最后一个访问点
+        first = table.next_access[i]
+        if first == i or first >= min(table.next_sharp[i], hi):
+            return _NO_MATCH
+        return self._member_access_steps(items, table, hi, i)
+
+    def _member_access_steps(self, items, table, hi, i):
+        # 左侧在各访问点处结束的匹配与终点无关：同一起点的访问点只从左到右找一遍、左侧只检查一次，
+        # 各终点只取其中位于终点之前的部分，访问链的解析是线性的
+        key = (id(items), i)
+        scan = self._access_scans.get(key)
+        if scan is None:
+            scan = self._access_scans[key] = _AccessScan(table.next_access[i])
+        end = min(table.next_sharp[i], hi)
+        points = scan.points
+        next_access = table.next_access
+        while points[-1] < end:
+            points.append(next_access[points[-1] + 1])
+        count = bisect_left(points, end)
+        while scan.full < count and not scan.stopped:
+            point = points[scan.full]
+            test_node, test_offset = yield self._match_view(items, i, point)
+            if not test_node:
+                scan.stopped = scan.unmatched = True
+            elif test_offset < point - i:
+                scan.stopped = True
+            else:
+                scan.full += 1
+        if scan.full < count and scan.unmatched:
+            return None, 0
+        idx = min(scan.full, count) - 1
+        if idx < 0:
+            return None, 0
+        point = points[idx]
+        left_node, left_offset = yield self._match_view(items, i, point)
+        if not left_node or left_offset != point - i:
+            return None, 0
+        code = table.codes[point]
+        if code == _CODE_PAIR:
+            index = self._gather(items[point][1:-1])
+            index_node, index_offset = yield self._match_list(index)
+            if not index_node or index_offset != len(index):
+                return None, 0
+            return PairDocASTNode(PairDocASTNodeTypes.OPERATION, [left_node, '[]', index_node]), point - i + 1
+        if code == _CODE_TUPLE:
+            args = self._gather(items[point][1:-1])
+            args_node, args_offset = yield self._match_list(args)
+            if not args_node or args_offset != len(args):
+                return None, 0
+            if args_node.node_type != PairDocASTNodeTypes.TUPLE:
+                args_node = PairDocASTNode(PairDocASTNodeTypes.TUPLE, [args_node]) # 单个参数的情况
+            return PairDocASTNode(PairDocASTNodeTypes.FUNCTIONCALL, [left_node, args_node]), point - i + 1
+        right_node, right_offset = yield self._match(items, hi, point + 1)
+        if not right_node:
+            return None, 0
+        return PairDocASTNode(PairDocASTNodeTypes.OPERATION, [left_node, '.', right_node]), point - i + right_offset + 1
+
+    def _variable(self, items, table, hi, i):
+        # 优先级1：单个token组
+        code = table.codes[i]
+        group = items[i]
+        if code == _CODE_TUPLE or code == _CODE_DOC:
+            return self._group_steps(group, code)
+        if code == _CODE_STRING:
+            return PairDocASTNode(PairDocASTNodeTypes.TEXT, _concat(group)), 1
+        if code == _CODE_NUMBER:
+            return PairDocASTNode(PairDocASTNodeTypes.NUMBER, _concat(group)), 1
+        if code == _CODE_LINEBREAK:
+            return PairDocASTNode(PairDocASTNodeTypes.VARIABLE, "@linebreak"), 1
+        return PairDocASTNode(PairDocASTNodeTypes.VARIABLE, _concat(group)), 1
+
+    def _group_steps(self, group, code):
+        if code == _CODE_TUPLE:
+            node, offset = yield self._match_list(self._gather(group[1:-1]))
+            if not node:
+                return None, 0
+            return node, 1
+        return (yield self._parse(self._gather(group[1:-1]))), 1
+
+    # 优先级表，顺序与node_matcher中注册的优先级一致
+    _PRECEDENCE = (
+        _separator,
+        _tuple,
+        _never_return,
+        _let,
+        _assign,
+        _operator_level1,
+        _key_value,
+        _function_def,
+        _style,
+        _member_access,
+        _variable,
+    )
@@ -0,0 +1,165 @@
+import os
+import pickle
+import traceback
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from .ast import PairDocPrecedenceParser
+from .pair_doc import build_doc
+from .modules import PairDocModuleCache
+from .function_cache import PairDocFunctionCache
+
+
+class PairDocResult:
+    """
+    build_docs中一个文档的结果：index为文档在sources中的位置；
+    成功时html为生成的HTML，失败时error为异常，traceback为工作进程中的调用栈文本
+    """
+    def __init__(self, index, html=None, error=None, traceback=None):
+        self.index = index
+        self.html = html
+        self.error = error
+        self.traceback = traceback
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.error is None:
+            return f"PairDocResult({self.index}, {len(self.html)} chars)"
+        return f"PairDocResult({self.index}, error={self.error!r})"
+
+
+def _portable(error):
+    # 异常要送回主进程；参数中带有无法序列化的对象（如指向内存映射的SourceSpan）时改为文本
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class _Worker:
+    """在工作进程中构建文档；preload中的模块在创建时加载到本进程的模块缓存，之后的导入直接命中"""
+    def __init__(self, preload, module_root, base_dir, parser_class, cache, function_cache):
+        self.base_dir = base_dir
+        self.modules = PairDocModuleCache(module_root) if module_root is not None else None
+        self.parser_class = parser_class
+        self.cache = cache
+        self.function_cache = PairDocFunctionCache() if function_cache else None
+        self.error = None # 预加载失败时所有文档都报告这个错误，而不是让进程池反复重启工作进程
+        try:
+            for path in preload:
+                self.modules.load(os.fspath(path), base_dir)
+        except Exception as e:
+            self.error = e, traceback.format_exc()
+
+    def __call__(self, task):
+        index, source = task
+        if self.error is not None:
+            return index, None, _portable(self.error[0]), self.error[1]
+        try:
+            html = build_doc(source, parser_class=self.parser_class, cache=self.cache,
+                             function_cache=self.function_cache, modules=self.modules, base_dir=None if isinstance(source, os.PathLike) else self.base_dir)
+        except Exception as e:
+            return index, None, _portable(e), traceback.format_exc()
+        return index, html, None, None
+
+
+_worker = None # 工作进程中的_Worker
+
+def _init_worker(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+def _run_chunk(tasks):
+    return [_worker(task) for task in tasks]
+
+
+def _failed(chunk, error, trace):
+    return [PairDocResult(index, error=error, traceback=trace) for index, _ in chunk]
+
+
+def _run_pool(tasks, workers, chunksize, ordered, init_args):
+    """
+    在进程池中按块构建，同时最多提交workers * 2块。
+    工作进程异常退出时进程池不再可用：已提交而未完成的块都报告BrokenProcessPool，其余的块在新的进程池中继续
+    """
+    chunks = iter(lambda: list(islice(tasks, chunksize)), [])
+    pending = deque(islice(chunks, workers * 2)) # 尚未提交的块
+    while pending:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=init_args)
+        running = {} # 按提交顺序排列的future -> 块
+        broken = False
+        try:
+            while True:
+                while pending and not broken:
+                    try:
+                        running[pool.submit(_run_chunk, pending[0])] = pending[0]
+                    except BrokenProcessPool:
+                        broken = True
+                    else:
+                        pending.popleft()
+                if not running:
+                    break
+                if ordered:
+                    done = [next(iter(running))]
+                    wait(done)
+                else:
+                    done = wait(running, return_when=FIRST_COMPLETED).done
+                for future in done:
+                    chunk = running.pop(future)
+                    try:
+                        results = [PairDocResult(*result) for result in future.result()]
+                    except BrokenProcessPool as e:
+                        broken = True
+                        results = _failed(chunk, e, None)
+                    except Exception as e:
+                        # 块无法发送到工作进程或结果无法送回
+                        results = _failed(chunk, e, traceback.format_exc())
+                    yield from results
+                if not broken:
+                    pending.extend(islice(chunks, len(done)))
+        finally:
+            # 调用方提前结束迭代时不再开始排队中的块
+            pool.shutdown(cancel_futures=True)
+        pending.extend(islice(chunks, workers * 2 - len(pending)))
+
+
+def build_docs(sources, workers=None, chunksize=None, ordered=True, module_root=None, preload=(), base_dir=None,
+               parser_class=PairDocPrecedenceParser, cache=None, function_cache=False):
+    """
+    用进程池批量构建文档，逐个产出PairDocResult。
+    sources中每项与build_doc的doc相同，可以是源码str、UTF-8编码的bytes或文件路径（os.PathLike，在工作进程中读取）。
+    workers为进程数，默认为CPU数；为1时在当前进程中依次构建。
+    chunksize为每次发给工作进程的文档数，默认按文档数分成每个进程约4批（sources没有长度时为1）。
+    ordered为True时按sources的顺序产出，否则按完成顺序产出。
+    给定module_root时每个工作进程使用各自的PairDocModuleCache(module_root)，文档可以import/include其中的模块；
+    preload中的模块文件在每个工作进程启动时加载一次，相对路径与源码文档中的导入都相对于base_dir（默认为module_root）。
+    cache（PairDocASTCache）由所有工作进程共用；function_cache为True时每个工作进程使用各自的PairDocFunctionCache。
+    某个文档出错时其结果带有error，其余文档照常构建；
+    工作进程异常退出时，当时未完成的各块文档的结果带有BrokenProcessPool，之后的文档在新的进程池中构建
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    preload = tuple(preload)
+    if preload and module_root is None:
+        raise ValueError("preload requires module_root")
+    if base_dir is not None:
+        base_dir = os.path.abspath(base_dir)
+    init_args = (preload, module_root, base_dir, parser_class, cache, function_cache)
+    tasks = enumerate(sources)
+    if workers <= 1:
+        worker = _Worker(*init_args)
+        for task in tasks:
+            yield PairDocResult(*worker(task))
+        return
+    if chunksize is None:
+        try:
+            chunksize, extra = divmod(len(sources), workers * 4)
+            chunksize += bool(extra)
+        except TypeError:
+            chunksize = 1
+    yield from _run_pool(tasks, workers, max(chunksize, 1), ordered, init_args)
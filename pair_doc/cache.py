@@ -0,0 +1,122 @@
+import os
+import struct
+import zlib
+import hashlib
+import tempfile
+from .arena import PairDocASTArena
+
+PARSER_VERSION = 1 # 语法或语法树结构变化时递增，使旧缓存失效
+
+_SUFFIX = '.pdast'
+_CHECKSUM = struct.Struct('<I') # 文件以数据的CRC32开头
+
+
+class PairDocASTCache:
+    """
+    以源码内容哈希为键的语法树磁盘缓存，值为序列化的PairDocASTArena。
+    写入先写临时文件再原子替换，多个进程可同时读写同一目录；
+    总大小超过max_bytes时按最近使用时间（文件mtime）淘汰。
+    总大小在第一次写入时统计一次，之后按本对象写入的字节数累加，超过max_bytes才重新扫描目录并淘汰到low_water以下
+    （其它进程的写入在重新扫描时计入）
+    """
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, low_water=0.9):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.total = None # 估计的缓存总大小，None表示尚未统计
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, source, parser_name=''):
+        """source为源码str或UTF-8编码的缓冲区"""
+        digest = hashlib.sha256(('%d:%s:' % (PARSER_VERSION, parser_name)).encode('utf-8'))
+        digest.update(source.encode('utf-8') if isinstance(source, str) else source)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key):
+        """命中时返回PairDocASTArena，否则返回None；截断或损坏的缓存文件视为未命中并删除"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            if len(data) < _CHECKSUM.size or _CHECKSUM.unpack_from(data)[0] != zlib.crc32(memoryview(data)[_CHECKSUM.size:]):
+                raise ValueError('Corrupted AST cache entry')
+            arena = PairDocASTArena.from_bytes(memoryview(data)[_CHECKSUM.size:])
+        except (ValueError, EOFError, struct.error):
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path) # 更新最近使用时间
+        except OSError:
+            pass
+        self.hits += 1
+        return arena
+
+    def put(self, key, arena):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            data = arena.to_bytes()
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_CHECKSUM.pack(zlib.crc32(data)))
+                f.write(data)
+            size = _CHECKSUM.size + len(data)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        if self.total is None or self.total + size > self.max_bytes:
+            self.evict()
+        else:
+            self.total += size
+
+    def evict(self):
+        """扫描目录并更新total，总大小超过max_bytes时淘汰最久未使用的缓存文件，直到不超过max_bytes * low_water"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(_SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError: # 已被其它进程删除
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total > self.max_bytes:
+            target = self.max_bytes * self.low_water
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        self.total = total
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(_SUFFIX):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+        self.total = 0
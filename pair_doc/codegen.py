@@ -0,0 +1,523 @@
+import os
+import tempfile
+import importlib.util
+from .ast import PairDocASTNode, PairDocASTNodeTypes, PairDocPrecedenceParser
+from .steps import run_steps
+from .html_builder import ContentTypes, _BUILTIN_TEXTS, _unwrap_block, _call_context, _call_function, _interpret_body, _eval_state
+from .html_builder import _module_call, _emit, _join_pieces, _PieceWriter, _StreamPieces, _render_node, _fusable
+from .optimizer import optimize_ast
+from .pair_doc import parse_doc
+
+_PACKAGE = __name__.rpartition('.')[0]
+
+_HEADER = f'''# 由{__name__}生成，请勿修改
+from {_PACKAGE}.codegen import TemplateBody as _TemplateBody, _function, _run_body, _render_call, _open_style, _close_style, _render_template
+from {_PACKAGE}.html_builder import Content as _Content, ContentTypes as _ContentTypes, Context as _Context
+from {_PACKAGE}.html_builder import _call_function, _import_module, _index, _member, _emit, _FLUSH_PIECES
+from {_PACKAGE}.html_builder import function_cache_scope as _function_cache_scope, module_scope as _module_scope
+
+_TEXT = _ContentTypes.TEXT
+_STYLE = _ContentTypes.STYLE
+_BLOCK = _ContentTypes.BLOCK
+_FUNCTION = _ContentTypes.FUNCTION
+_TUPLE = _ContentTypes.TUPLE
+_KEYVALUE = _ContentTypes.KEYVALUE
+_INT = _ContentTypes.INT
+_FLOAT = _ContentTypes.FLOAT
+'''
+
+_FOOTER = '''
+def build_content(context_vars=None):
+    """与build_content(语法树, context_vars)的结果相同"""
+    return _run0(context_vars)
+
+def render(output=None, function_cache=None, modules=None, base_dir=None):
+    """
+    与build_doc相同：返回HTML；给定output（二进制文件对象或文本流）时边求值边写入output并返回None。
+    function_cache与modules、base_dir的含义与build_doc相同
+    """
+    with _function_cache_scope(function_cache), _module_scope(modules, base_dir):
+        return _render_template(_render0, _FUSABLE, output)
+'''
+
+
+class TemplateBody:
+    """
+    生成模块中的函数体：run(上下文)返回函数体的值，render(上下文, out)将其HTML片段追加到out；
+    str与原函数体语法树的str相同，因此FUNCTION内容输出为HTML时与解释执行一致
+    """
+    __slots__ = ('run', 'render', 'text')
+
+    def __init__(self, run, render, text):
+        self.run = run
+        self.render = render
+        self.text = text
+
+    def __call__(self, context_vars):
+        return self.run(context_vars)
+
+    def __str__(self):
+        return self.text
+
+
+# 以下为生成模块在运行时使用的辅助函数
+
+def _function(content):
+    # 被调用的值：解包块并检查是函数
+    func = _unwrap_block(content)
+    if func.content_type != ContentTypes.FUNCTION:
+        raise ValueError("Not a function")
+    return func
+
+def _run_body(body, context_vars):
+    # 生成的函数体直接运行，其余函数体（导入的模块或传入的值中定义的函数）解释执行
+    if body.__class__ is TemplateBody:
+        return body.run(context_vars)
+    return _interpret_body(body, context_vars)
+
+def _render_call(func, args, out):
+    """输出函数调用的结果，与_render_node相同：未启用函数缓存时函数体直接输出，不构造其值"""
+    if _eval_state.function_cache is not None:
+        _emit(out, _call_function(func, args, _run_body))
+        return
+    new_context, body = _call_context(func, args)
+    if body.__class__ is TemplateBody:
+        body.render(new_context, out)
+    elif isinstance(body, PairDocASTNode):
+        _render_node(body, new_context, out, 0)
+    else:
+        _emit(out, _interpret_body(body, new_context))
+
+def _open_style(out, style, args):
+    # 写出开始标签，返回_close_style写出结束标签所需的值：结束标签本身，或样式的值
+    if args is None and style is not None and style.content_type is ContentTypes.TEXT and style.content.__class__ is str:
+        out.append(f'<{style.content}>')
+        return f'</{style.content}>'
+    out.append('<')
+    _emit(out, style)
+    if args is not None:
+        out.append(' ')
+        _emit(out, args)
+    out.append('>')
+    return style
+
+def _close_style(out, close):
+    if close.__class__ is str:
+        out.append(close)
+        return
+    out.append('</')
+    _emit(out, close)
+    out.append('>')
+
+def _render_template(render, fusable, output):
+    # 与render_html相同地运行生成的_render0
+    if output is None:
+        out = []
+        render(None, out)
+        return _join_pieces(out)
+    writer = _PieceWriter(output)
+    out = _StreamPieces(writer, fusable)
+    try:
+        render(None, out)
+    except BaseException:
+        out.flush()
+        writer.flush()
+        raise
+    out.close()
+    return None
+
+
+class _FunctionWriter:
+    # 一个生成函数的代码行，每个节点的值存入一个局部变量。
+    # 子节点的值被父节点使用后其局部变量即可复用，函数的局部变量数与嵌套深度成正比
+    def __init__(self, signature):
+        self.lines = [f'def {signature}:']
+        self.temps = 0
+
+    def temp(self):
+        self.temps += 1
+        return f'_t{self.temps}'
+
+    def emit(self, line):
+        self.lines.append('    ' + line)
+
+    def mark(self):
+        return self.temps
+
+    def release(self, mark):
+        self.temps = mark
+
+    def assign(self, expr):
+        name = self.temp()
+        self.emit(f'{name} = {expr}')
+        return name
+
+
+def _unbound(ctx, names, nullable):
+    # 运行时names都未被绑定的条件，与_render_node使用预先输出的部分时的检查相同
+    checks = [f'{ctx}.get({name!r}) is None' for name in sorted(names)]
+    if not checks:
+        return 'True'
+    if nullable:
+        return f"{ctx} is None or ({' and '.join(checks)})"
+    return ' and '.join(checks)
+
+
+class _ModuleWriter:
+    """
+    将语法树翻译为Python模块源码。
+    文档与每个函数定义的函数体各生成求值的_run<n>(ctx)与输出的_render<n>(ctx, out)两个模块级函数；
+    节点按build_content的求值顺序展开为直线代码，运算符、访问方式与内置变量在生成时确定。
+    输出时文档、样式与函数体直接写入out，与render_html相同，只有作为值使用的部分才构造Content；
+    语法树带有optimize_ast的输出方案时，不依赖变量的部分直接写出预先生成的HTML。
+    生成的各方法返回由run_steps运行的步骤，要生成的函数排入队列依次生成，嵌套深度不受Python调用栈限制
+    """
+    def __init__(self):
+        self.functions = []
+        self.bodies = []
+        self.count = 0
+        self.pending = [] # (类型, 编号, 节点)，类型为'run'或'render'
+
+    def schedule(self, kind, node):
+        # 安排生成_run<n>或_render<n>，返回n
+        index = self.count
+        self.count += 1
+        self.pending.append((kind, index, node))
+        return index
+
+    def source(self, ast):
+        self.count = 1
+        self.pending.append(('run', 0, ast))
+        self.pending.append(('render', 0, ast))
+        for kind, index, node in self.pending: # 生成过程中排入的函数同样在此生成
+            if kind == 'run':
+                writer = _FunctionWriter(f'_run{index}(ctx)')
+                result = run_steps(self.node(writer, node, 'ctx'))
+                writer.emit(f'return {result}')
+            else:
+                writer = _FunctionWriter(f'_render{index}(ctx, out)')
+                if node.__class__ is list: # 文档中合并输出的各项
+                    run_steps(self._render_items(writer, node, 'ctx'))
+                else:
+                    run_steps(self.render(writer, node, 'ctx'))
+                writer.emit('return None')
+            self.functions.append('\n'.join(writer.lines))
+        parts = [_HEADER, f'_FUSABLE = {_fusable(ast)!r}']
+        parts.extend(self.functions)
+        parts.extend(self.bodies)
+        parts.append(_FOOTER)
+        return '\n\n'.join(parts)
+
+    def node(self, writer, ast, ctx):
+        """生成计算ast的代码的步骤，结果为保存其值的局部变量名（或常量表达式）"""
+        if not isinstance(ast, PairDocASTNode):
+            # 与build_content一样在运行时因缺少node_type出错
+            message = f"'{type(ast).__name__}' object has no attribute 'node_type'"
+            writer.emit(f'raise AttributeError({message!r})')
+            return 'None'
+        method = getattr(self, '_' + ast.node_type.name.lower(), None)
+        if method is None:
+            writer.emit("raise ValueError('Unknown AST type')")
+            return 'None'
+        return method(writer, ast.children, ctx)
+
+    def render(self, writer, ast, ctx):
+        """生成将ast的HTML片段追加到out的代码的步骤，与_render_node对应"""
+        if not isinstance(ast, PairDocASTNode):
+            return self._render_value(writer, ast, ctx)
+        method = getattr(self, '_render_' + ast.node_type.name.lower(), None)
+        if method is None:
+            return self._render_value(writer, ast, ctx)
+        return method(writer, ast, ctx)
+
+    def _render_value(self, writer, ast, ctx):
+        mark = writer.mark()
+        value = yield self.node(writer, ast, ctx)
+        writer.emit(f'_emit(out, {value})')
+        writer.release(mark)
+
+    def _style(self, writer, children, ctx):
+        style, args, body = children
+        mark = writer.mark()
+        style = yield self.node(writer, style, ctx)
+        args = (yield self.node(writer, args, ctx)) if args is not None else 'None'
+        body = yield self.node(writer, body, ctx)
+        writer.release(mark)
+        return writer.assign(f'_Content(_STYLE, ({style}, {args}, {body}))')
+
+    def _render_style(self, writer, ast, ctx):
+        style, args, body = ast.children
+        mark = writer.mark()
+        close = writer.temp()
+        plan = getattr(ast, 'render_plan', None)
+        if plan is not None:
+            # 样式名与参数不依赖变量：变量未被绑定时写出预先生成的标签，否则调用单独生成的求值函数
+            open_tag, close_tag, names = plan
+            style = f'_run{self.schedule("run", style)}({ctx})'
+            args = f'_run{self.schedule("run", args)}({ctx})' if args is not None else 'None'
+            writer.emit(f'if {_unbound(ctx, names, True)}:')
+            writer.emit(f'    out.append({open_tag!r})')
+            writer.emit(f'    {close} = {close_tag!r}')
+            writer.emit('else:')
+            writer.emit(f'    {close} = _open_style(out, {style}, {args})')
+        else:
+            style = yield self.node(writer, style, ctx)
+            args = (yield self.node(writer, args, ctx)) if args is not None else 'None'
+            writer.emit(f'{close} = _open_style(out, {style}, {args})')
+        yield self.render(writer, body, ctx)
+        writer.emit(f'_close_style(out, {close})')
+        writer.release(mark)
+
+    def _text(self, writer, children, ctx):
+        return writer.assign(f'_Content(_TEXT, {str(children)!r})')
+
+    def _render_text(self, writer, ast, ctx):
+        writer.emit(f'out.append({str(ast.children)!r})')
+
+    def _number(self, writer, children, ctx):
+        if '.' in children or 'e' in children:
+            content_type, convert = '_FLOAT', float
+        else:
+            content_type, convert = '_INT', int
+        try:
+            value = repr(convert(children))
+        except ValueError: # 在运行时以相同方式出错
+            value = f'{convert.__name__}({str(children)!r})'
+        return writer.assign(f'_Content({content_type}, {value})')
+
+    def _variable(self, writer, name, ctx):
+        name = str(name)
+        result = writer.assign(f'{ctx}.get({name!r})')
+        writer.emit(f'if {result} is None:')
+        if name == '$':
+            writer.emit(f"    {result} = {ctx}.get('__args__')")
+        else:
+            writer.emit(f'    {result} = _Content(_TEXT, {_BUILTIN_TEXTS.get(name, name)!r})')
+        return result
+
+    def _unfunctional(self, writer, children, ctx):
+        return self.node(writer, children, ctx)
+
+    def _render_unfunctional(self, writer, ast, ctx):
+        return self.render(writer, ast.children, ctx)
+
+    def _binding(self, writer, children, ctx, method):
+        key, value = children
+        if not isinstance(key, PairDocASTNode):
+            return (yield self.node(writer, key, ctx))
+        if key.node_type != PairDocASTNodeTypes.VARIABLE:
+            writer.emit("raise ValueError('Not a variable')")
+            return 'None'
+        value = yield self.node(writer, value, ctx)
+        writer.emit(f'{ctx}.{method}({str(key.children)!r}, {value})')
+        return value
+
+    def _let(self, writer, children, ctx):
+        return self._binding(writer, children, ctx, 'let')
+
+    def _assign(self, writer, children, ctx):
+        return self._binding(writer, children, ctx, 'update')
+
+    def _neverreturn(self, writer, children, ctx):
+        mark = writer.mark()
+        yield self.node(writer, children, ctx)
+        writer.release(mark)
+        return 'None'
+
+    def _render_neverreturn(self, writer, ast, ctx):
+        yield self._neverreturn(writer, ast.children, ctx)
+
+    def _doc(self, writer, children, ctx):
+        mark = writer.mark()
+        new_ctx = writer.assign(f'_Context({ctx})')
+        # 文档的各项依次写入输出列表
+        items = writer.assign('[]')
+        items_mark = writer.mark()
+        for child in children:
+            item = yield self.node(writer, child, new_ctx)
+            writer.emit(f'{items}.append({item})')
+            writer.release(items_mark)
+        writer.release(mark)
+        return writer.assign(f'_Content(_BLOCK, {items})')
+
+    def _render_doc(self, writer, ast, ctx):
+        mark = writer.mark()
+        new_ctx = writer.assign(f'_Context({ctx})')
+        plan = getattr(ast, 'render_plan', None)
+        if plan is None:
+            plan = ast.children
+        for i, item in enumerate(plan):
+            if i > 0:
+                writer.emit("out.append(' ')")
+            if item.__class__ is not tuple:
+                yield self.render(writer, item, new_ctx)
+            else:
+                html, names, nodes = item
+                if not names:
+                    writer.emit(f'out.append({html!r})')
+                else:
+                    # 变量被绑定时回退到单独生成的函数，输出合并前的各项
+                    writer.emit(f'if {_unbound(new_ctx, names, False)}:')
+                    writer.emit(f'    out.append({html!r})')
+                    writer.emit('else:')
+                    writer.emit(f'    _render{self.schedule("render", nodes)}({new_ctx}, out)')
+            writer.emit('if len(out) >= _FLUSH_PIECES and out.__class__ is not list: out.flush()')
+        writer.release(mark)
+
+    def _render_items(self, writer, items, ctx):
+        for i, item in enumerate(items):
+            if i > 0:
+                writer.emit("out.append(' ')")
+            yield self.render(writer, item, ctx)
+
+    def _separator(self, writer, children, ctx):
+        results = []
+        for child in children:
+            results.append((yield self.node(writer, child, ctx)))
+        if not results:
+            writer.emit("raise IndexError('list index out of range')")
+            return 'None'
+        return results[-1]
+
+    def _render_separator(self, writer, ast, ctx):
+        children = ast.children
+        if not children:
+            writer.emit("raise IndexError('list index out of range')")
+            return
+        mark = writer.mark()
+        for child in children[:-1]:
+            yield self.node(writer, child, ctx)
+        writer.release(mark)
+        yield self.render(writer, children[-1], ctx)
+
+    def _functiondef(self, writer, children, ctx):
+        args, body = children
+        mark = writer.mark()
+        args = yield self.node(writer, args, ctx)
+        writer.release(mark)
+        index = self.schedule('run', body)
+        self.pending.append(('render', index, body))
+        name = f'_body{index}'
+        self.bodies.append(f'{name} = _TemplateBody(_run{index}, _render{index}, {str(body)!r})')
+        return writer.assign(f'_Content(_FUNCTION, [{ctx}, {args}, {name}])')
+
+    def _call(self, writer, children, ctx):
+        # 求得被调用的函数与参数，返回(函数, 参数, import/include的名字)；
+        # 函数节点是import/include时，运行时名字未被绑定则函数为None，表示导入模块
+        func, args = children
+        module_call = _module_call(func, None)
+        if module_call is not None:
+            func = writer.assign(f'None if {ctx} is None else {ctx}.get({module_call!r})')
+            writer.emit(f'if {func} is not None:')
+            writer.emit(f'    {func} = _function({func})')
+        else:
+            func = yield self.node(writer, func, ctx)
+            func = writer.assign(f'_function({func})')
+        args = yield self.node(writer, args, ctx)
+        return func, args, module_call
+
+    def _functioncall(self, writer, children, ctx):
+        mark = writer.mark()
+        func, args, module_call = yield self._call(writer, children, ctx)
+        writer.release(mark)
+        result = writer.temp()
+        if module_call is not None:
+            writer.emit(f'if {func} is None:')
+            writer.emit(f'    {result} = _import_module({module_call!r}, {args}, {ctx})')
+            writer.emit('else:')
+            writer.emit(f'    {result} = _call_function({func}, {args}, _run_body)')
+        else:
+            writer.emit(f'{result} = _call_function({func}, {args}, _run_body)')
+        return result
+
+    def _render_functioncall(self, writer, ast, ctx):
+        mark = writer.mark()
+        func, args, module_call = yield self._call(writer, ast.children, ctx)
+        if module_call is not None:
+            writer.emit(f'if {func} is None:')
+            writer.emit(f'    _emit(out, _import_module({module_call!r}, {args}, {ctx}))')
+            writer.emit('else:')
+            writer.emit(f'    _render_call({func}, {args}, out)')
+        else:
+            writer.emit(f'_render_call({func}, {args}, out)')
+        writer.release(mark)
+
+    def _operation(self, writer, children, ctx):
+        left, op, right = children
+        mark = writer.mark()
+        left = yield self.node(writer, left, ctx)
+        right = yield self.node(writer, right, ctx)
+        writer.release(mark)
+        if op == '+':
+            return writer.assign(f'{left} + {right}')
+        if op == '-':
+            return writer.assign(f'{left} - {right}')
+        if op == '[]':
+            return writer.assign(f'_index({left}, {right})')
+        if op == '.':
+            return writer.assign(f'_member({left}, {right})')
+        writer.emit(f'raise ValueError({"Unknown operation: " + op!r})')
+        return 'None'
+
+    def _tuple(self, writer, children, ctx):
+        mark = writer.mark()
+        results = []
+        for child in children:
+            results.append((yield self.node(writer, child, ctx)))
+        items = ', '.join(results)
+        writer.release(mark)
+        return writer.assign(f'_Content(_TUPLE, [c for c in ({items},) if c is not None])' if results else '_Content(_TUPLE, [])')
+
+    def _none(self, writer, children, ctx):
+        return 'None'
+
+    def _keyval(self, writer, children, ctx):
+        key, value = children
+        mark = writer.mark()
+        key = yield self.node(writer, key, ctx)
+        value = yield self.node(writer, value, ctx)
+        writer.release(mark)
+        return writer.assign(f'_Content(_KEYVALUE, [{key}, {value}])')
+
+
+def generate_module(ast):
+    """
+    将语法树翻译为Python模块源码。模块提供build_content(context_vars=None)与
+    render(output=None, function_cache=None, modules=None, base_dir=None)，
+    结果与对该语法树解释执行build_content与build_doc相同
+    """
+    return _ModuleWriter().source(ast)
+
+
+def compile_template(doc, path, parser_class=PairDocPrecedenceParser):
+    """
+    将PairDoc源码doc（str或UTF-8编码的缓冲区）翻译为Python模块写入path，并返回加载的模块。
+    模板会被多次输出，生成前先由optimize_ast预先输出不依赖变量的部分。写入先写临时文件再原子替换
+    """
+    source = generate_module(optimize_ast(parse_doc(doc, parser_class)))
+    path = os.fspath(path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(source)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return load_template(path)
+
+
+def load_template(path):
+    """
+    加载compile_template生成的模块。经由标准的源码加载器导入，
+    字节码缓存在__pycache__中，源码未变化时直接使用.pyc
+    """
+    path = os.fspath(path)
+    name = 'pair_doc_template_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
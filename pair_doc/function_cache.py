@@ -0,0 +1,272 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from .ast import PairDocASTNode, PairDocASTNodeTypes
+from .lexer import SourceSpan
+from .html_builder import Content, ContentTypes, _Scope, _resolve, _binding_plan, _module_call
+
+_OPERATORS = ('+', '-', '[]', '.')
+_SCALAR_TYPES = (ContentTypes.TEXT, ContentTypes.INT, ContentTypes.FLOAT)
+_IMPURE = object() # 分析结果：函数体不可缓存
+_MISSING = object()
+
+
+class _Impure(Exception):
+    pass
+
+
+def _visit(node, scope, reads, callee=False):
+    # 按求值顺序遍历函数体，记录读取的外部变量；遇到可能有副作用或依赖调用环境的节点时抛出_Impure
+    if not isinstance(node, PairDocASTNode):
+        raise _Impure()
+    node_type = node.node_type
+    children = node.children
+    if node_type == PairDocASTNodeTypes.VARIABLE:
+        if children == '$':
+            raise _Impure()
+        if _resolve(scope, children)[1] is None:
+            reads[children] = reads.get(children, True) and callee
+    elif node_type in (PairDocASTNodeTypes.TEXT, PairDocASTNodeTypes.NUMBER, PairDocASTNodeTypes.NONE):
+        pass
+    elif node_type == PairDocASTNodeTypes.STYLE:
+        style, args, body = children
+        _visit(style, scope, reads)
+        if args is not None:
+            _visit(args, scope, reads)
+        _visit(body, scope, reads)
+    elif node_type in (PairDocASTNodeTypes.UNFUNCTIONAL, PairDocASTNodeTypes.NEVERRETURN):
+        _visit(children, scope, reads)
+    elif node_type in (PairDocASTNodeTypes.LET, PairDocASTNodeTypes.ASSIGN):
+        key, value = children
+        if not isinstance(key, PairDocASTNode) or key.node_type != PairDocASTNodeTypes.VARIABLE:
+            raise _Impure()
+        _visit(value, scope, reads)
+        if node_type == PairDocASTNodeTypes.LET:
+            scope.bind(key.children)
+        elif _resolve(scope, key.children)[1] is None: # 给函数体外的变量赋值
+            raise _Impure()
+    elif node_type == PairDocASTNodeTypes.DOC:
+        scope = _Scope(scope)
+        for child in children:
+            _visit(child, scope, reads)
+    elif node_type in (PairDocASTNodeTypes.SEPARATOR, PairDocASTNodeTypes.TUPLE):
+        for child in children:
+            _visit(child, scope, reads)
+    elif node_type == PairDocASTNodeTypes.FUNCTIONCALL:
+        func, args = children
+        if _module_call(func, None) is not None: # 导入模块依赖文件内容并绑定变量
+            raise _Impure()
+        _visit(func, scope, reads, callee=True)
+        _visit(args, scope, reads)
+    elif node_type == PairDocASTNodeTypes.OPERATION:
+        left, op, right = children
+        if op not in _OPERATORS:
+            raise _Impure()
+        _visit(left, scope, reads)
+        _visit(right, scope, reads)
+    elif node_type == PairDocASTNodeTypes.KEYVAL:
+        key, value = children
+        _visit(key, scope, reads)
+        _visit(value, scope, reads)
+    else: # 函数定义捕获调用时的上下文，其余节点类型无法分析
+        raise _Impure()
+
+_analyses = weakref.WeakKeyDictionary()
+
+def _analyze(body):
+    """
+    分析函数体，返回((变量名, 是否只用作被调用的函数), ...)；不可缓存时返回_IMPURE。
+    函数体内没有函数定义、没有给外部变量赋值、不读取$时，其结果只取决于所读取的外部变量的值
+    """
+    try:
+        result = _analyses.get(body)
+    except TypeError: # 无法弱引用的函数体（例如生成模块中的函数体）不分析
+        return _IMPURE
+    if result is None:
+        reads = {}
+        try:
+            _visit(body, _Scope(None), reads)
+            result = tuple(reads.items())
+        except (_Impure, TypeError, ValueError, AttributeError, RecursionError):
+            result = _IMPURE
+        _analyses[body] = result
+    return result
+
+
+def _scalar_key(value):
+    # 不可变的值按类型与内容作为键，其余返回None
+    if value is None:
+        return ()
+    content_type = getattr(value, 'content_type', None)
+    if content_type not in _SCALAR_TYPES:
+        return None
+    content = value.content
+    # SourceSpan与str在int()等用法中表现不同，TextRope与str相同
+    return (content_type.value, isinstance(content, SourceSpan), str(content))
+
+
+_fingerprints = weakref.WeakKeyDictionary()
+
+def _fingerprint(body):
+    """
+    函数体的结构摘要：节点类型与文本都相同的函数体（例如两次解析同一文档得到的）摘要相同，
+    不同文档中定义的同一函数可以共用缓存项。无法弱引用的函数体返回None
+    """
+    try:
+        digest = _fingerprints.get(body)
+    except TypeError:
+        return None
+    if digest is None:
+        h = hashlib.blake2b(digest_size=16)
+        stack = [body]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, PairDocASTNode):
+                h.update(b'N%d:' % item.node_type.value)
+                stack.append(item.children)
+            elif isinstance(item, (list, tuple)):
+                h.update(b'L%d:' % len(item))
+                stack.extend(reversed(item))
+            elif item is None:
+                h.update(b'0')
+            else:
+                text = str(item).encode('utf-8')
+                h.update(b'S%d:' % len(text))
+                h.update(text)
+        digest = _fingerprints[body] = h.digest()
+    return digest
+
+
+def _function_key(func, lookup, visiting):
+    """
+    函数调用结果的键：函数体的结构摘要、函数体读取的外部变量的值，以及被调用的函数的键。
+    lookup(name)给出变量在函数体中读取到的值。结果不可缓存时返回None
+    """
+    if id(func) in visiting: # 递归调用
+        return None
+    context, func_args, body = func.content
+    reads = _analyze(body)
+    if reads is _IMPURE:
+        return None
+    digest = _fingerprint(body)
+    if digest is None:
+        return None
+    visiting.add(id(func))
+    parts = [digest]
+    for name, callee in reads:
+        value = lookup(name)
+        if callee and getattr(value, 'content_type', None) == ContentTypes.FUNCTION:
+            part = _callee_key(value, visiting)
+        else:
+            part = _scalar_key(value)
+        if part is None:
+            return None
+        parts.append(part)
+    visiting.discard(id(func))
+    return tuple(parts)
+
+
+def _callee_key(func, visiting):
+    # 被调用的函数：形参的值来自调用处或不可变的默认值，形参名、个数与默认值计入键；其余外部变量在定义时的上下文中查找
+    try:
+        context, func_args, body = func.content
+        plan = _binding_plan(func_args)
+    except Exception:
+        return None
+    params = []
+    for name, value in plan.defaults.items():
+        default = _scalar_key(value)
+        if default is None:
+            return None
+        params.append((str(name), default))
+    def lookup(name):
+        if name in plan.defaults:
+            return None
+        return context.get(name) if context is not None else None
+    key = _function_key(func, lookup, visiting)
+    if key is None:
+        return None
+    return (plan.count, tuple(params), key)
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _freeze(content, seen):
+    """
+    将结果转换为不可变的构造方案：不可变的值原样保存，其余内容保存为(类型, 子方案...)。
+    包含函数（捕获了调用时的上下文）或同一可变对象出现多次时不可缓存
+    """
+    if content is None:
+        return None
+    content_type = content.content_type
+    if content_type in _SCALAR_TYPES:
+        return content
+    if id(content) in seen:
+        raise _Uncacheable()
+    seen.add(id(content))
+    if content_type == ContentTypes.STYLE:
+        style, args, children = content.content
+        return (content_type, _freeze(style, seen), _freeze(args, seen), _freeze(children, seen))
+    if content_type in (ContentTypes.BLOCK, ContentTypes.TUPLE, ContentTypes.KEYVALUE):
+        return (content_type, tuple(_freeze(c, seen) for c in content.content))
+    raise _Uncacheable()
+
+def _thaw(recipe):
+    # 按构造方案重新构造结果，可变的部分每次都是新的对象
+    if recipe.__class__ is not tuple:
+        return recipe
+    if recipe[0] is ContentTypes.STYLE:
+        _, style, args, children = recipe
+        return Content(ContentTypes.STYLE, (_thaw(style), _thaw(args), _thaw(children)))
+    return Content(recipe[0], [_thaw(r) for r in recipe[1]])
+
+
+class PairDocFunctionCache:
+    """
+    纯函数调用结果的LRU缓存，通过function_cache_scope或build_doc(function_cache=...)启用。
+    函数体没有副作用、读取到的外部变量与参数都是不可变的值（文本、数字或只被调用的纯函数）时，
+    以函数体的结构摘要与这些值为键缓存结果，同一缓存在多次构建之间共用时，各次构建中定义的同一函数也能命中；
+    结果保存为构造方案，每次命中都重新构造，调用方修改结果不影响缓存。缓存项只保存键与构造方案，不持有函数及其上下文
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict() # 键 -> 结果的构造方案
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def call(self, func, body, context, run_body):
+        """在context中运行函数体body，可缓存时先查缓存"""
+        key = _function_key(func, context.get, set())
+        if key is None:
+            return run_body(body, context)
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not _MISSING: # 命中的结果也可能是None
+            return _thaw(entry)
+        result = run_body(body, context)
+        try:
+            stored = _freeze(result, set())
+        except _Uncacheable:
+            return result
+        with self.lock:
+            self.entries[key] = stored
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return result
@@ -1,5 +1,11 @@
 from .ast import Gather, PairDocASTParser, PairDocASTNodeTypes, PairDocASTNode
+from .lexer import SourceSpan
+from .steps import run_steps
+import io
 import enum
+import weakref
+import threading
+import contextlib
 
 
 
@@ -16,6 +22,99 @@ class ContentTypes(enum.Enum):
     FLOAT = 8
 
 
+_ROPE_MIN = 128 # 拼接结果短于此长度时直接拼成str
+
+def _text_length(text):
+    # 文本长度；SourceSpan按字节数计，只用于决定是否拼接为TextRope
+    if isinstance(text, SourceSpan):
+        return text.end - text.start
+    if isinstance(text, TextRope):
+        return text.length
+    return len(text)
+
+class TextRope:
+    """
+    由两段文本拼接而成的TEXT内容，拼接时不复制文本，只在需要str时拼成一个字符串并缓存。
+    两段文本为str、SourceSpan或TextRope，节点创建后不再改变，可以被多个TextRope共享；
+    在比较、哈希、下标、转换为数字等用法中与拼接得到的str相同
+    """
+    __slots__ = ('left', 'right', 'length', 'flat')
+
+    def __init__(self, left, right, length):
+        self.left = left
+        self.right = right
+        self.length = length
+        self.flat = None
+
+    @staticmethod
+    def concat(left, right):
+        """返回left + right的文本，较短时为str"""
+        length = _text_length(left) + _text_length(right)
+        if length < _ROPE_MIN:
+            return str(left) + str(right)
+        if (isinstance(left, TextRope) and left.flat is None and isinstance(left.right, str)
+                and isinstance(right, str) and len(left.right) + len(right) < _ROPE_MIN):
+            # 逐段追加短文本时合并末尾的短片段，避免每段一个节点
+            return TextRope(left.left, left.right + right, length)
+        return TextRope(left, right, length)
+
+    def chunks(self):
+        """按顺序产出各片段（str或SourceSpan），不拼接"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, TextRope):
+                if node.flat is not None:
+                    yield node.flat
+                else:
+                    stack.append(node.right)
+                    stack.append(node.left)
+            else:
+                yield node
+
+    def __str__(self):
+        if self.flat is None:
+            self.flat = ''.join([str(chunk) for chunk in self.chunks()])
+            self.left = self.right = None
+        return self.flat
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __eq__(self, value):
+        if isinstance(value, TextRope):
+            value = str(value)
+        return str(self) == value
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __len__(self):
+        return len(str(self))
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __contains__(self, value):
+        return value in str(self)
+
+    def __getitem__(self, i):
+        return str(self)[i]
+
+    def __add__(self, value):
+        return str(self) + value
+
+    def __radd__(self, value):
+        return value + str(self)
+
+    def __int__(self):
+        return int(str(self))
+
+    def __float__(self):
+        return float(str(self))
+
+_TEXT_TYPES = (str, SourceSpan, TextRope)
+
 class Content:
     def __init__(self, content_type, content):
         self.content_type = content_type
@@ -32,6 +131,8 @@ class Content:
             self.content.append(value)
             return self
         if self.content_type == ContentTypes.TEXT and value.content_type == ContentTypes.TEXT:
+            if isinstance(self.content, _TEXT_TYPES) and isinstance(value.content, _TEXT_TYPES):
+                return Content(ContentTypes.TEXT, TextRope.concat(self.content, value.content))
             return Content(ContentTypes.TEXT, self.content + value.content)
         if self.content_type == ContentTypes.BLOCK:
             self.content.append(value)
@@ -59,19 +160,26 @@ class Context:
         self.vars = {}
     def let(self, key, value):
         self.vars[key] = value
+    # update与get沿上下文链循环查找，遇到其他类型的上下文时交给它继续查找
     def update(self, key, value):
-        if key in self.vars:
-            self.vars[key] = value
-        elif self.super_context is not None:
-            self.super_context.update(key, value)
-        else:
-            raise ValueError("Variable not found")
+        context = self
+        while context.__class__ is Context:
+            if key in context.vars:
+                context.vars[key] = value
+                return
+            context = context.super_context
+            if context is None:
+                raise ValueError("Variable not found")
+        context.update(key, value)
     def get(self, key):
-        if key in self.vars:
-            return self.vars[key]
-        if self.super_context is not None:
-            return self.super_context.get(key)
-        return None
+        context = self
+        while context.__class__ is Context:
+            if key in context.vars:
+                return context.vars[key]
+            context = context.super_context
+            if context is None:
+                return None
+        return context.get(key)
     
     def copy(self):
         new_context = Context(self.super_context)
@@ -85,199 +193,1338 @@ def _get_variable(token, context_vars:Context = None):
     v = context_vars.get(token)
     if v is not None:
         return v
-    if _is_text(token, 'n') or _is_text(token, 'br'):
-        return Content(ContentTypes.TEXT, '<br>')
-    if _is_text(token, 't') or _is_text(token, 'tab'):
-        return Content(ContentTypes.TEXT, '&nbsp;&nbsp;&nbsp;&nbsp;')
-    if _is_text(token, 'q') or _is_text(token, 'quot'):
-        return Content(ContentTypes.TEXT, '&quot;')
-    if _is_text(token, 's'):
-        return Content(ContentTypes.TEXT, '&nbsp;')
-    if _is_text(token, '@linebreak'): # 分割线
-        return Content(ContentTypes.TEXT, '<hr>')
+    builtin = _BUILTIN_CONTENTS.get(token) # 换行、制表、引号、空格与分割线等内置变量
+    if builtin is not None:
+        return builtin
     if _is_text(token, '$'):
         return context_vars.get('__args__')
     return Content(ContentTypes.TEXT, token)
 
 def _unwrap_block(content:Content):
     # 如果是块类型，那么解包并获得最后一个元素
-    if isinstance(content, Content) and content.content_type == ContentTypes.BLOCK:
-        return _unwrap_block(content.content[-1])
+    while isinstance(content, Content) and content.content_type == ContentTypes.BLOCK:
+        content = content.content[-1]
     return content
     
 
-def build_content(ast, context_vars:Context = None)->str:
-    def _build(ast:PairDocASTNode):
+class _BindingPlan:
+    """
+    函数形参的绑定方案，由形参元组一次算出并缓存在其上：
+    defaults为形参名到默认值的映射，names为去重后按首次出现顺序排列的形参名，count为形参个数
+    """
+    def __init__(self, func_args:Content):
+        params = func_args.content
+        self.count = len(params)
+        self.defaults = {x.content[0].content: x.content[1] for x in params}
+        self.names = list(self.defaults)
+
+    def bind(self, key_values, non_key_values):
+        """返回参数名到值的映射"""
+        arg_map = self.defaults.copy()
+        names = self.names
+        if key_values:
+            # 先处理key-value赋值，剩下的参数按顺序赋给未被赋值的形参
+            used = set()
+            for kv in key_values:
+                key, value = kv.content
+                arg_map[key.content] = value
+                used.add(key.content)
+            names = [k for k in names if k not in used]
+        if len(non_key_values) > self.count:
+            raise ValueError("Too many arguments")
+        for k, v in zip(names, non_key_values):
+            arg_map[k] = v
+        return arg_map
+
+def _binding_plan(func_args:Content):
+    # 形参元组在函数定义后不再改变，元素个数不同时说明不是同一组形参，重新计算
+    plan = getattr(func_args, 'binding_plan', None)
+    if plan is None or plan.count != len(func_args.content):
+        plan = _BindingPlan(func_args)
+        func_args.binding_plan = plan
+    return plan
+
+def _call_context(func:Content, args:Content):
+    """为函数调用绑定参数，返回(函数体的上下文, 函数体)"""
+    context, func_args, body = func.content
+
+    #遍历参数，将参数赋值，有两种情况，一种是直接赋值，一种是key-value赋值
+    key_values = []
+    non_key_values = []
+    for c in args.content:
+        if c.content_type == ContentTypes.KEYVALUE:
+            key_values.append(c)
+        else:
+            non_key_values.append(c)
+
+    new_context = Context(context)
+    new_context.vars = _binding_plan(func_args).bind(key_values, non_key_values)
+    return new_context, body
+
+class _EvalState(threading.local):
+    # 每个线程独立的求值状态
+    def __init__(self):
+        self.function_cache = None
+        self.modules = None
+        self.module_dir = None
+
+_eval_state = _EvalState()
+
+@contextlib.contextmanager
+def function_cache_scope(cache):
+    """在此期间当前线程中的求值用cache（PairDocFunctionCache）缓存纯函数的调用结果，None表示不缓存"""
+    previous = _eval_state.function_cache
+    _eval_state.function_cache = cache
+    try:
+        yield cache
+    finally:
+        _eval_state.function_cache = previous
+
+@contextlib.contextmanager
+def module_scope(modules, directory=None):
+    """
+    在此期间当前线程中的import/include从modules（PairDocModuleCache）加载模块，
+    相对路径相对于directory（None表示modules的root）
+    """
+    previous = _eval_state.modules, _eval_state.module_dir
+    _eval_state.modules, _eval_state.module_dir = modules, directory
+    try:
+        yield modules
+    finally:
+        _eval_state.modules, _eval_state.module_dir = previous
+
+_MODULE_CALLS = ('import', 'include') # 未被绑定时作为导入模块的内置函数
+
+def _module_call(func, context_vars:Context):
+    # 函数调用的函数节点是未被绑定的import/include时返回其名字，否则返回None
+    if (func.__class__ is PairDocASTNode and func.children in _MODULE_CALLS and func.node_type == PairDocASTNodeTypes.VARIABLE
+            and (context_vars is None or context_vars.get(func.children) is None)):
+        return str(func.children)
+    return None
+
+def _import_module(name, args:Content, context_vars:Context):
+    """运行import/include(路径)：将模块的导出绑定到context_vars中，include还返回模块输出的HTML"""
+    modules = _eval_state.modules
+    if modules is None:
+        raise ValueError("Module imports are not enabled, pass modules=PairDocModuleCache(root) to build_doc")
+    if len(args.content) != 1 or args.content[0].content_type != ContentTypes.TEXT:
+        raise ValueError("Invalid module path")
+    module = modules.load(str(args.content[0].content), _eval_state.module_dir)
+    module.bind(context_vars)
+    if name == 'include':
+        return Content(ContentTypes.TEXT, module.html())
+    return None
 
-        if ast.node_type == PairDocASTNodeTypes.STYLE:
-            style, args, children = ast.children
-            style = build_content(style, context_vars=context_vars)
+def _call_function(func:Content, args:Content, run_body):
+    """绑定参数并由run_body(函数体, 上下文)运行函数体，启用了函数缓存时先查缓存"""
+    new_context, body = _call_context(func, args)
+    cache = _eval_state.function_cache
+    if cache is None:
+        return run_body(body, new_context)
+    return cache.call(func, body, new_context, run_body)
+
+def _index(left:Content, right:Content):
+    # left[right]
+    if left.content_type == ContentTypes.TUPLE:
+        return left.content[int(right.content)]
+    if left.content_type == ContentTypes.TEXT:
+        return Content(ContentTypes.TEXT, left.content[int(right.content)])
+    raise ValueError("Cannot use [] on non-tuple or non-text")
+
+_RECORD_MIN = 8 # 元素数不少于此值的元组在成员访问时建立键索引
+_MISSING = object()
+
+class _Record:
+    """
+    键值对元组的键索引，以属性record保存在元组上。keys为键到首个同键键值对的映射，
+    覆盖元组的前count个元素；元组只会在末尾追加元素，访问时补上新追加的部分。
+    遇到非键值对或键不可哈希的元素时停止建立索引，之后的元素仍按顺序查找
+    """
+    def __init__(self):
+        self.keys = {}
+        self.count = 0
+        self.complete = True
+
+    def update(self, items):
+        keys = self.keys
+        while self.complete and self.count < len(items):
+            c = items[self.count]
+            try:
+                if c.content_type != ContentTypes.KEYVALUE:
+                    raise TypeError()
+                keys.setdefault(c.content[0].content, c)
+            except (AttributeError, TypeError, IndexError):
+                self.complete = False
+                break
+            self.count += 1
+
+def _record_lookup(left:Content, key):
+    # 通过键索引查找元组中的键值对，返回值；索引无法给出与顺序查找相同的结果时返回_MISSING
+    items = left.content
+    record = getattr(left, 'record', None)
+    if record is None:
+        if len(items) < _RECORD_MIN:
+            return _MISSING
+        record = left.record = _Record()
+    record.update(items)
+    try:
+        c = record.keys.get(key)
+    except TypeError:
+        return _MISSING
+    if c is None or not c.content[0].content == key:
+        return _MISSING
+    return c.content[1]
+
+def _member(left:Content, right:Content):
+    # left.right
+    if left.content_type == ContentTypes.TUPLE:
+        value = _record_lookup(left, right.content)
+        if value is not _MISSING:
+            return value
+        for c in left.content:
+            if not c.content_type == ContentTypes.KEYVALUE:
+                raise ValueError("Not a key-value pair")
+            if c.content[0].content == right.content:
+                return c.content[1]
+        raise ValueError("Key not found: " + right.content)
+    if left.content_type == ContentTypes.KEYVALUE:
+        if right.content_type != ContentTypes.TEXT:
+            raise ValueError("Cannot use non-text key")
+        if right.content == 'key':
+            return left.content[0]
+        if right.content == 'value':
+            return left.content[1]
+        raise ValueError("Unknown key: " + right.content)
+    if left.content_type == ContentTypes.TEXT:
+        if right.content_type != ContentTypes.INT:
+            raise ValueError("Cannot use non-number index for text")
+        return Content(ContentTypes.TEXT, left.content[int(right.content)])
+    raise ValueError("Cannot use . on non-tuple or non-text")
+
+def _interpret_body(body, context_vars:Context):
+    return build_content(body, context_vars=context_vars)
+
+def _check_binds(children):
+    stack = list(children)
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, PairDocASTNode):
+            return True
+        node_type = node.node_type
+        children = node.children
+        if node_type == PairDocASTNodeTypes.LET:
+            return True
+        if node_type in (PairDocASTNodeTypes.DOC, PairDocASTNodeTypes.TEXT, PairDocASTNodeTypes.NUMBER,
+                         PairDocASTNodeTypes.VARIABLE, PairDocASTNodeTypes.NONE):
+            continue # 嵌套的文档有自己的上下文
+        if node_type in (PairDocASTNodeTypes.UNFUNCTIONAL, PairDocASTNodeTypes.NEVERRETURN):
+            stack.append(children)
+        elif node_type == PairDocASTNodeTypes.STYLE:
+            style, args, body = children
+            stack.append(style)
             if args is not None:
-                args = build_content(args, context_vars=context_vars)
-            children = build_content(children, context_vars=context_vars)
-            return Content(ContentTypes.STYLE, (style, args, children))
-
-        if ast.node_type == PairDocASTNodeTypes.TEXT:
-            return Content(ContentTypes.TEXT, ast.children)
-        if ast.node_type == PairDocASTNodeTypes.NUMBER:
-            if '.' in ast.children or 'e' in ast.children:
-                return Content(ContentTypes.FLOAT, float(ast.children))
-            else:
-                return Content(ContentTypes.INT, int(ast.children))
-        if ast.node_type == PairDocASTNodeTypes.VARIABLE:
-            return _get_variable(ast.children, context_vars=context_vars)
-        if ast.node_type == PairDocASTNodeTypes.UNFUNCTIONAL:
-            return build_content(ast.children, context_vars=context_vars)
-        if ast.node_type == PairDocASTNodeTypes.LET:
-            key, value = ast.children
-            if key.node_type != PairDocASTNodeTypes.VARIABLE:
-                raise ValueError("Not a variable")
-            k = key.children
-            v = build_content(value, context_vars=context_vars)
-            context_vars.let(k, v)
+                stack.append(args)
+            stack.append(body)
+        elif node_type == PairDocASTNodeTypes.OPERATION:
+            left, op, right = children
+            stack.append(left)
+            stack.append(right)
+        elif node_type == PairDocASTNodeTypes.FUNCTIONDEF:
+            stack.append(children[0]) # 函数体在调用时的新上下文中运行
+        elif node_type == PairDocASTNodeTypes.FUNCTIONCALL and _module_call(children[0], None) is not None:
+            return True # 导入模块时绑定其导出
+        elif node_type in (PairDocASTNodeTypes.SEPARATOR, PairDocASTNodeTypes.TUPLE, PairDocASTNodeTypes.ASSIGN,
+                           PairDocASTNodeTypes.KEYVAL, PairDocASTNodeTypes.FUNCTIONCALL):
+            stack.extend(children)
+        else:
+            return True
+    return False
+
+_binding_docs = weakref.WeakKeyDictionary()
+
+def _doc_context(ast, context_vars:Context):
+    """
+    文档求值时使用的上下文。文档的各项（不进入嵌套的文档与函数体）中没有LET与import/include时，
+    新建的上下文中不会有变量，与外层上下文的查找与赋值结果相同，直接使用外层上下文，
+    使上下文链只随实际绑定变量的文档层数增长
+    """
+    if context_vars is None:
+        return Context(None)
+    try:
+        binds = _binding_docs.get(ast)
+    except TypeError:
+        return Context(context_vars)
+    if binds is None:
+        try:
+            binds = _check_binds(ast.children)
+        except Exception: # 结构不完整的语法树，求值时按原样出错
+            binds = True
+        _binding_docs[ast] = binds
+    return Context(context_vars) if binds else context_vars
+
+def build_content(ast, context_vars:Context = None)->str:
+    return _eval(ast, context_vars, 0)
+
+_TEXT = PairDocASTNodeTypes.TEXT
+_VARIABLE = PairDocASTNodeTypes.VARIABLE
+_NUMBER = PairDocASTNodeTypes.NUMBER
+_NONE = PairDocASTNodeTypes.NONE
+_DOC = PairDocASTNodeTypes.DOC
+_STYLE = PairDocASTNodeTypes.STYLE
+_UNFUNCTIONAL = PairDocASTNodeTypes.UNFUNCTIONAL
+_NEVERRETURN = PairDocASTNodeTypes.NEVERRETURN
+_LET = PairDocASTNodeTypes.LET
+_ASSIGN = PairDocASTNodeTypes.ASSIGN
+_SEPARATOR = PairDocASTNodeTypes.SEPARATOR
+_FUNCTIONDEF = PairDocASTNodeTypes.FUNCTIONDEF
+_FUNCTIONCALL = PairDocASTNodeTypes.FUNCTIONCALL
+_OPERATION = PairDocASTNodeTypes.OPERATION
+_TUPLE = PairDocASTNodeTypes.TUPLE
+_KEYVAL = PairDocASTNodeTypes.KEYVAL
+
+_MAX_DEPTH = 150 # 递归求值与输出的最大嵌套层数，更深的子树由run_steps以显式栈运行
+_SHALLOW_DEPTH = 32 # 嵌套少于此层数时文档总是新建上下文，不必检查其中是否绑定变量（见_doc_context）
+
+def _eval(ast, context_vars:Context, depth):
+    """
+    递归求值ast，结果与run_steps(_content(ast, context_vars))相同但没有生成器的开销；
+    depth为已嵌套的层数，达到_MAX_DEPTH时余下的子树改用步骤求值，嵌套深度仍不受Python调用栈限制
+    """
+    node_type = ast.node_type
+    if node_type is _TEXT:
+        return Content(ContentTypes.TEXT, ast.children)
+    if node_type is _VARIABLE:
+        return _get_variable(ast.children, context_vars)
+    if node_type is _NUMBER or node_type is _NONE:
+        return _content(ast, context_vars)
+    if depth >= _MAX_DEPTH:
+        return run_steps(_content(ast, context_vars))
+    depth += 1
+    if node_type is _FUNCTIONCALL:
+        func, args = ast.children
+        module_call = _module_call(func, context_vars)
+        if module_call is not None:
+            return _import_module(module_call, _eval(args, context_vars, depth), context_vars)
+        func = _unwrap_block(_eval(func, context_vars, depth))
+        if func.content_type != ContentTypes.FUNCTION:
+            raise ValueError("Not a function")
+        args = _eval(args, context_vars, depth)
+        if _eval_state.function_cache is None and isinstance(func.content[2], PairDocASTNode):
+            new_context, body = _call_context(func, args)
+            return _eval(body, new_context, depth)
+        return _call_function(func, args, lambda body, new_context: _eval(body, new_context, depth))
+    if node_type is _DOC:
+        new_context = Context(context_vars) if depth <= _SHALLOW_DEPTH else _doc_context(ast, context_vars)
+        return Content(ContentTypes.BLOCK, [_eval(c, new_context, depth) for c in ast.children])
+    if node_type is _STYLE:
+        style, args, children = ast.children
+        style = _eval(style, context_vars, depth)
+        if args is not None:
+            args = _eval(args, context_vars, depth)
+        return Content(ContentTypes.STYLE, (style, args, _eval(children, context_vars, depth)))
+    if node_type is _TUPLE:
+        result = []
+        for c in ast.children:
+            c = _eval(c, context_vars, depth)
+            if c is not None: # 去掉None
+                result.append(c)
+        return Content(ContentTypes.TUPLE, result)
+    if node_type is _KEYVAL:
+        key, value = ast.children
+        key = _eval(key, context_vars, depth)
+        return Content(ContentTypes.KEYVALUE, [key, _eval(value, context_vars, depth)])
+    if node_type is _OPERATION:
+        left, op, right = ast.children
+        left = _eval(left, context_vars, depth)
+        right = _eval(right, context_vars, depth)
+        if op == '+':
+            return left + right
+        if op == '-':
+            return left - right
+        if op == '[]':
+            return _index(left, right)
+        if op == '.':
+            return _member(left, right)
+        raise ValueError("Unknown operation: " + op)
+    if node_type is _LET or node_type is _ASSIGN:
+        key, value = ast.children
+        if key.node_type != PairDocASTNodeTypes.VARIABLE:
+            raise ValueError("Not a variable")
+        v = _eval(value, context_vars, depth)
+        if node_type is _LET:
+            context_vars.let(key.children, v)
+        else:
+            context_vars.update(key.children, v)
+        return v
+    if node_type is _FUNCTIONDEF:
+        args, body = ast.children
+        return Content(ContentTypes.FUNCTION, [context_vars, _eval(args, context_vars, depth), body])
+    if node_type is _NEVERRETURN:
+        _eval(ast.children, context_vars, depth)
+        return None
+    if node_type is _UNFUNCTIONAL:
+        return _eval(ast.children, context_vars, depth)
+    if node_type is _SEPARATOR:
+        result = [_eval(c, context_vars, depth) for c in ast.children]
+        return result[-1]
+    return run_steps(_content(ast, context_vars)) # 未知类型在此报错
+
+def _content(ast, context_vars:Context):
+    """
+    求值ast的步骤：叶子节点直接返回值，其余节点返回由run_steps运行的生成器。
+    子节点的求值以产出步骤代替递归调用，嵌套深度不受Python调用栈限制
+    """
+    node_type = ast.node_type
+    if node_type == PairDocASTNodeTypes.TEXT:
+        return Content(ContentTypes.TEXT, ast.children)
+    if node_type == PairDocASTNodeTypes.VARIABLE:
+        return _get_variable(ast.children, context_vars=context_vars)
+    if node_type == PairDocASTNodeTypes.NUMBER:
+        if '.' in ast.children or 'e' in ast.children:
+            return Content(ContentTypes.FLOAT, float(ast.children))
+        else:
+            return Content(ContentTypes.INT, int(ast.children))
+    if node_type == PairDocASTNodeTypes.NONE:
+        return None
+    return _content_steps(ast, node_type, context_vars)
+
+def _content_steps(ast, node_type, context_vars:Context):
+    if node_type == PairDocASTNodeTypes.STYLE:
+        style, args, children = ast.children
+        style = yield _content(style, context_vars)
+        if args is not None:
+            args = yield _content(args, context_vars)
+        children = yield _content(children, context_vars)
+        return Content(ContentTypes.STYLE, (style, args, children))
+    if node_type == PairDocASTNodeTypes.UNFUNCTIONAL:
+        return (yield _content(ast.children, context_vars))
+    if node_type == PairDocASTNodeTypes.LET:
+        key, value = ast.children
+        if key.node_type != PairDocASTNodeTypes.VARIABLE:
+            raise ValueError("Not a variable")
+        k = key.children
+        v = yield _content(value, context_vars)
+        context_vars.let(k, v)
+        return v
+    if node_type == PairDocASTNodeTypes.NEVERRETURN:
+        yield _content(ast.children, context_vars)
+        return None
+    if node_type == PairDocASTNodeTypes.DOC:
+        new_context = _doc_context(ast, context_vars)
+        doc_items = []
+        for c in ast.children:
+            doc_items.append((yield _content(c, new_context)))
+        return Content(ContentTypes.BLOCK, doc_items)
+    if node_type == PairDocASTNodeTypes.ASSIGN:
+        key, value = ast.children
+        if key.node_type != PairDocASTNodeTypes.VARIABLE:
+            raise ValueError("Not a variable")
+        k = key.children
+        v = yield _content(value, context_vars)
+        context_vars.update(k, v)
+        return v
+    if node_type == PairDocASTNodeTypes.SEPARATOR:
+        result = []
+        for c in ast.children:
+            result.append((yield _content(c, context_vars)))
+        return result[-1]
+    if node_type == PairDocASTNodeTypes.FUNCTIONDEF:
+        args, body = ast.children
+        args = yield _content(args, context_vars)
+        return Content(ContentTypes.FUNCTION, [context_vars, args, body])
+    if node_type == PairDocASTNodeTypes.FUNCTIONCALL:
+        func, args = ast.children
+        module_call = _module_call(func, context_vars)
+        if module_call is not None:
+            return _import_module(module_call, (yield _content(args, context_vars)), context_vars)
+        func = _unwrap_block((yield _content(func, context_vars)))
+        if func.content_type != ContentTypes.FUNCTION:
+            raise ValueError("Not a function")
+
+        args = yield _content(args, context_vars)
+        #print(f"Executing function: <{func}> with {args}")
+
+        if _eval_state.function_cache is None and isinstance(func.content[2], PairDocASTNode):
+            # 函数体同样作为步骤求值，递归的函数调用不占用Python调用栈
+            new_context, body = _call_context(func, args)
+            return (yield _content(body, new_context))
+        return _call_function(func, args, _interpret_body)
+    if node_type == PairDocASTNodeTypes.OPERATION:
+        left, op, right = ast.children
+        left = yield _content(left, context_vars)
+        right = yield _content(right, context_vars)
+        if op == '+':
+            return left + right
+        if op == '-':
+            return left - right
+        if op == '[]':
+            return _index(left, right)
+        if op == '.':
+            return _member(left, right)
+        raise ValueError("Unknown operation: " + op)
+    if node_type == PairDocASTNodeTypes.TUPLE:
+        result = []
+        for c in ast.children:
+            c = yield _content(c, context_vars)
+            if c is not None: # 去掉None
+                result.append(c)
+        return Content(ContentTypes.TUPLE, result)
+    if node_type == PairDocASTNodeTypes.KEYVAL:
+        key, value = ast.children
+        key = yield _content(key, context_vars)
+        value = yield _content(value, context_vars)
+        return Content(ContentTypes.KEYVALUE, [key, value])
+    raise ValueError("Unknown AST type")
+
+# 内置变量对应的文本，与_get_variable一致
+_BUILTIN_TEXTS = {
+    'n': '<br>',
+    'br': '<br>',
+    't': '&nbsp;&nbsp;&nbsp;&nbsp;',
+    'tab': '&nbsp;&nbsp;&nbsp;&nbsp;',
+    'q': '&quot;',
+    'quot': '&quot;',
+    's': '&nbsp;',
+    '@linebreak': '<hr>',
+}
+
+# 文本值不会被原地修改，内置变量的值可以共用
+_BUILTIN_CONTENTS = {name: Content(ContentTypes.TEXT, text) for name, text in _BUILTIN_TEXTS.items()}
+
+_UNBOUND = object() # 尚未绑定的槽位
+
+class _Frame(Context):
+    """
+    编译求值时DOC对应的上下文。编译时已确定的变量按槽位存放在列表slots中，
+    names为变量名到槽位的映射，由同一DOC的所有运行共享；其余变量仍存放在vars中
+    """
+    def __init__(self, super_context, names):
+        super().__init__(super_context)
+        self.names = names
+        self.slots = [_UNBOUND] * len(names)
+    def let(self, key, value):
+        slot = self.names.get(key)
+        if slot is None:
+            self.vars[key] = value
+        else:
+            self.slots[slot] = value
+    def update(self, key, value):
+        context = self
+        while context.__class__ is _Frame:
+            slot = context.names.get(key)
+            if slot is not None and context.slots[slot] is not _UNBOUND:
+                context.slots[slot] = value
+                return
+            if key in context.vars:
+                context.vars[key] = value
+                return
+            context = context.super_context
+            if context is None:
+                raise ValueError("Variable not found")
+        context.update(key, value)
+    def get(self, key):
+        context = self
+        while context.__class__ is _Frame:
+            slot = context.names.get(key)
+            if slot is not None and context.slots[slot] is not _UNBOUND:
+                return context.slots[slot]
+            if key in context.vars:
+                return context.vars[key]
+            context = context.super_context
+            if context is None:
+                return None
+        return context.get(key)
+
+    def copy(self):
+        new_context = _Frame(self.super_context, self.names)
+        new_context.slots = self.slots.copy()
+        new_context.vars = self.vars.copy()
+        return new_context
+
+class _Scope:
+    """
+    编译时的DOC作用域，按求值顺序记录已绑定的变量名及其槽位。
+    一个编译单元（文档或函数体）内没有条件分支，DOC中的绑定只来自其中的LET与import/include，
+    因此编译到某处时已绑定的变量就是运行到该处时已绑定的变量；
+    dynamic表示已编译的部分中有import/include，之后绑定的变量名在编译时未知
+    """
+    def __init__(self, parent):
+        self.parent = parent
+        self.names = {}
+        self.dynamic = False
+    def bind(self, name):
+        slot = self.names.get(name)
+        if slot is None:
+            slot = self.names[name] = len(self.names)
+        return slot
+
+def _resolve(scope, name):
+    # 返回(层数, 槽位)；变量不在编译单元内的作用域中时返回(编译单元内的作用域层数, None)，
+    # 遇到dynamic的作用域时返回(其层数, None)，从该作用域开始动态查找
+    depth = 0
+    while scope is not None:
+        slot = scope.names.get(name)
+        if slot is not None:
+            return depth, slot
+        if scope.dynamic:
+            return depth, None
+        depth += 1
+        scope = scope.parent
+    return depth, None
+
+# 函数体在FUNCTION内容中仍以语法树保存，调用时取其编译结果
+_compiled_bodies = weakref.WeakKeyDictionary()
+
+def _compiled_body(body):
+    try:
+        run = _compiled_bodies.get(body)
+    except TypeError: # 无法弱引用的函数体不缓存
+        return _compile(body, None)
+    if run is None:
+        run = _compiled_bodies[body] = _compile(body, None)
+    return run
+
+def _run_compiled_body(body, context_vars:Context):
+    return _compiled_body(body)(context_vars)
+
+def _compile_fallback(ast):
+    # 结构不合法的节点在运行时交给build_content，以相同的方式报错
+    def run_fallback(context_vars):
+        return build_content(ast, context_vars=context_vars)
+    return run_fallback
+
+def _compile_error(message):
+    def run_error(context_vars):
+        raise ValueError(message)
+    return run_error
+
+def _compile_style(children, scope):
+    style, args, body = children
+    style = _compile(style, scope)
+    args = _compile(args, scope) if args is not None else None
+    body = _compile(body, scope)
+    def run_style(context_vars):
+        style_content = style(context_vars)
+        args_content = args(context_vars) if args is not None else None
+        return Content(ContentTypes.STYLE, (style_content, args_content, body(context_vars)))
+    return run_style
+
+def _compile_text(children, scope):
+    def run_text(context_vars):
+        return Content(ContentTypes.TEXT, children)
+    return run_text
+
+def _compile_number(children, scope):
+    if '.' in children or 'e' in children:
+        content_type, value = ContentTypes.FLOAT, float(children)
+    else:
+        content_type, value = ContentTypes.INT, int(children)
+    def run_number(context_vars):
+        return Content(content_type, value)
+    return run_number
+
+def _compile_variable(name, scope):
+    if name == '$':
+        def default(context_vars):
+            return context_vars.get('__args__')
+    else:
+        text = _BUILTIN_TEXTS.get(name, name)
+        def default(context_vars):
+            return Content(ContentTypes.TEXT, text)
+    depth, slot = _resolve(scope, name)
+    if slot is not None:
+        # 静态绑定：按(层数, 槽位)直接读取
+        if depth == 0:
+            def run_local(context_vars):
+                v = context_vars.slots[slot]
+                if v is not None:
+                    return v
+                return default(context_vars)
+            return run_local
+        def run_outer(context_vars):
+            frame = context_vars
+            for _ in range(depth):
+                frame = frame.super_context
+            v = frame.slots[slot]
+            if v is not None:
+                return v
+            return default(context_vars)
+        return run_outer
+    if depth == 0:
+        def run_dynamic(context_vars):
+            v = context_vars.get(name)
+            if v is not None:
+                return v
+            return default(context_vars)
+        return run_dynamic
+    # 动态查找：编译单元内的作用域中都没有该变量，从编译单元外的上下文开始查找
+    def run_dynamic_outer(context_vars):
+        outer = context_vars
+        for _ in range(depth):
+            outer = outer.super_context
+        v = outer.get(name) if outer is not None else None
+        if v is not None:
             return v
-        if ast.node_type == PairDocASTNodeTypes.NEVERRETURN:
-            build_content(ast.children, context_vars=context_vars)
-            return None
-        if ast.node_type == PairDocASTNodeTypes.DOC:
-            new_context = Context(context_vars)
-            doc_items = [build_content(c, context_vars=new_context) for c in ast.children]
-            return Content(ContentTypes.BLOCK, doc_items)
-        if ast.node_type == PairDocASTNodeTypes.ASSIGN:
-            key, value = ast.children
-            if key.node_type != PairDocASTNodeTypes.VARIABLE:
-                raise ValueError("Not a variable")
-            k = key.children
-            v = build_content(value, context_vars=context_vars)
-            context_vars.update(k, v)
+        return default(context_vars)
+    return run_dynamic_outer
+
+def _compile_unfunctional(children, scope):
+    return _compile(children, scope)
+
+def _compile_let(children, scope):
+    key, value = children
+    if key.node_type != PairDocASTNodeTypes.VARIABLE:
+        return _compile_error("Not a variable")
+    name = key.children
+    value = _compile(value, scope)
+    if scope is None:
+        def run_let(context_vars):
+            v = value(context_vars)
+            context_vars.let(name, v)
             return v
-        if ast.node_type == PairDocASTNodeTypes.SEPARATOR:
-            result = [build_content(c, context_vars=context_vars) for c in ast.children]
-            return result[-1]
-        if ast.node_type == PairDocASTNodeTypes.FUNCTIONDEF:
-            args, body = ast.children
-            args = build_content(args, context_vars=context_vars)
-            return Content(ContentTypes.FUNCTION, [context_vars, args, body])
-        if ast.node_type == PairDocASTNodeTypes.FUNCTIONCALL:
-            func, args = ast.children
-            func = _unwrap_block(build_content(func, context_vars=context_vars))
-            if func.content_type != ContentTypes.FUNCTION:
-                raise ValueError("Not a function")
-            
-            args = build_content(args, context_vars=context_vars)
-            #print(f"Executing function: <{func}> with {args}")
-
-            context, func_args, body = func.content
-
-            #遍历参数，将参数赋值，有两种情况，一种是直接赋值，一种是key-value赋值
-            #先处理key-value赋值，然后将剩下的参数按顺序赋值
-            key_values = [c for c in args.content if c.content_type == ContentTypes.KEYVALUE]
-            non_key_values = [c for c in args.content if c.content_type != ContentTypes.KEYVALUE]
-
-            arg_map = {x.content[0].content: x.content[1] for x in (func_args.content)}
-            default_arg_map_is_used = {x.content[0].content: False for x in (func_args.content)}
+        return run_let
+    slot = scope.bind(name)
+    def run_let_slot(context_vars):
+        v = value(context_vars)
+        context_vars.slots[slot] = v
+        return v
+    return run_let_slot
 
+def _compile_assign(children, scope):
+    key, value = children
+    if key.node_type != PairDocASTNodeTypes.VARIABLE:
+        return _compile_error("Not a variable")
+    name = key.children
+    value = _compile(value, scope)
+    depth, slot = _resolve(scope, name)
+    if slot is None:
+        def run_assign(context_vars):
+            v = value(context_vars)
+            context_vars.update(name, v)
+            return v
+        return run_assign
+    def run_assign_slot(context_vars):
+        v = value(context_vars)
+        frame = context_vars
+        for _ in range(depth):
+            frame = frame.super_context
+        frame.slots[slot] = v
+        return v
+    return run_assign_slot
 
-            for kv in key_values:
-                key, value = kv.content
-                arg_map[key.content] = value
-                if key.content in arg_map:
-                    default_arg_map_is_used[key.content] = True
-            for i, v in enumerate(non_key_values):
-                if i >= len(func_args.content):
-                    raise ValueError("Too many arguments")
-                # 查找第一个未使用的默认参数
-                for k, used in default_arg_map_is_used.items():
-                    if not used:
-                        arg_map[k] = v
-                        default_arg_map_is_used[k] = True
-                        break
-                
-
-            new_context = Context(context)
-            for k, v in arg_map.items():
-                new_context.let(k, v)
-
-            result = build_content(body, context_vars=new_context)
-            return result
-        if ast.node_type == PairDocASTNodeTypes.OPERATION:
-            left, op, right = ast.children
-            left = build_content(left, context_vars=context_vars)
-            right = build_content(right, context_vars=context_vars)
-            if op == '+':
-                return left + right
-            if op == '-':
-                return left - right
-            if op == '[]':
-                if left.content_type == ContentTypes.TUPLE:
-                    return left.content[int(right.content)]
-                if left.content_type == ContentTypes.TEXT:
-                    return Content(ContentTypes.TEXT, left.content[int(right.content)])
-                raise ValueError("Cannot use [] on non-tuple or non-text")
-            if op == '.':
-                if left.content_type == ContentTypes.TUPLE:
-                    for c in left.content:
-                        if not c.content_type == ContentTypes.KEYVALUE:
-                            raise ValueError("Not a key-value pair")
-                        if c.content[0].content == right.content:
-                            return c.content[1]
-                    raise ValueError("Key not found: " + right.content)
-                if left.content_type == ContentTypes.KEYVALUE:
-                    if right.content_type != ContentTypes.TEXT:
-                        raise ValueError("Cannot use non-text key")
-                    if right.content == 'key':
-                        return left.content[0]
-                    if right.content == 'value':
-                        return left.content[1]
-                    raise ValueError("Unknown key: " + right.content)
-                if left.content_type == ContentTypes.TEXT:
-                    if right.content_type != ContentTypes.INT:
-                        raise ValueError("Cannot use non-number index for text")
-                    return Content(ContentTypes.TEXT, left.content[int(right.content)])
-                raise ValueError("Cannot use . on non-tuple or non-text")
-            raise ValueError("Unknown operation: " + op)
-        if ast.node_type == PairDocASTNodeTypes.TUPLE:
-            result = [build_content(c, context_vars=context_vars) for c in ast.children]
-            result = [c for c in result if c is not None] # 去掉None
-            return Content(ContentTypes.TUPLE, result)
-        if ast.node_type == PairDocASTNodeTypes.NONE:
-            return None
-        if ast.node_type == PairDocASTNodeTypes.KEYVAL:
-            key, value = ast.children
-            key = build_content(key, context_vars=context_vars)
-            value = build_content(value, context_vars=context_vars)
-            return Content(ContentTypes.KEYVALUE, [key, value])
-        raise ValueError("Unknown AST type")
-    
-    return _build(ast)
+def _compile_never_return(children, scope):
+    run = _compile(children, scope)
+    def run_never_return(context_vars):
+        run(context_vars)
+        return None
+    return run_never_return
+
+def _compile_doc(children, scope):
+    scope = _Scope(scope)
+    items = [_compile(c, scope) for c in children]
+    names = scope.names
+    def run_doc(context_vars):
+        new_context = _Frame(context_vars, names)
+        return Content(ContentTypes.BLOCK, [item(new_context) for item in items])
+    return run_doc
+
+def _compile_separator(children, scope):
+    items = [_compile(c, scope) for c in children]
+    def run_separator(context_vars):
+        return [item(context_vars) for item in items][-1]
+    return run_separator
+
+def _compile_function_def(children, scope):
+    args, body = children
+    args = _compile(args, scope)
+    def run_function_def(context_vars):
+        return Content(ContentTypes.FUNCTION, [context_vars, args(context_vars), body])
+    return run_function_def
+
+def _compile_function_call(children, scope):
+    func, args = children
+    module_call = None
+    if _module_call(func, None) is not None and _resolve(scope, func.children)[1] is None:
+        module_call = str(func.children)
+        if scope is not None:
+            scope.dynamic = True
+    func = _compile(func, scope)
+    args = _compile(args, scope)
+    if module_call is not None:
+        # 调用时名字仍未被绑定才是导入模块
+        def run_module_call(context_vars):
+            if context_vars.get(module_call) is None:
+                return _import_module(module_call, args(context_vars), context_vars)
+            return run_function_call(context_vars)
+    def run_function_call(context_vars):
+        func_content = _unwrap_block(func(context_vars))
+        if func_content.content_type != ContentTypes.FUNCTION:
+            raise ValueError("Not a function")
+        return _call_function(func_content, args(context_vars), _run_compiled_body)
+    if module_call is not None:
+        return run_module_call
+    return run_function_call
+
+def _compile_operation(children, scope):
+    left, op, right = children
+    left = _compile(left, scope)
+    right = _compile(right, scope)
+    if op == '+':
+        def run_add(context_vars):
+            return left(context_vars) + right(context_vars)
+        return run_add
+    if op == '-':
+        def run_sub(context_vars):
+            return left(context_vars) - right(context_vars)
+        return run_sub
+    if op == '[]':
+        def run_index(context_vars):
+            return _index(left(context_vars), right(context_vars))
+        return run_index
+    if op == '.':
+        def run_member(context_vars):
+            return _member(left(context_vars), right(context_vars))
+        return run_member
+    def run_unknown(context_vars):
+        left(context_vars)
+        right(context_vars)
+        raise ValueError("Unknown operation: " + op)
+    return run_unknown
+
+def _compile_tuple(children, scope):
+    items = [_compile(c, scope) for c in children]
+    def run_tuple(context_vars):
+        result = [item(context_vars) for item in items]
+        return Content(ContentTypes.TUPLE, [c for c in result if c is not None])
+    return run_tuple
+
+def _compile_none(children, scope):
+    def run_none(context_vars):
+        return None
+    return run_none
+
+def _compile_key_value(children, scope):
+    key, value = children
+    key = _compile(key, scope)
+    value = _compile(value, scope)
+    def run_key_value(context_vars):
+        return Content(ContentTypes.KEYVALUE, [key(context_vars), value(context_vars)])
+    return run_key_value
+
+_COMPILERS = {
+    PairDocASTNodeTypes.STYLE: _compile_style,
+    PairDocASTNodeTypes.TEXT: _compile_text,
+    PairDocASTNodeTypes.NUMBER: _compile_number,
+    PairDocASTNodeTypes.VARIABLE: _compile_variable,
+    PairDocASTNodeTypes.UNFUNCTIONAL: _compile_unfunctional,
+    PairDocASTNodeTypes.LET: _compile_let,
+    PairDocASTNodeTypes.NEVERRETURN: _compile_never_return,
+    PairDocASTNodeTypes.DOC: _compile_doc,
+    PairDocASTNodeTypes.ASSIGN: _compile_assign,
+    PairDocASTNodeTypes.SEPARATOR: _compile_separator,
+    PairDocASTNodeTypes.FUNCTIONDEF: _compile_function_def,
+    PairDocASTNodeTypes.FUNCTIONCALL: _compile_function_call,
+    PairDocASTNodeTypes.OPERATION: _compile_operation,
+    PairDocASTNodeTypes.TUPLE: _compile_tuple,
+    PairDocASTNodeTypes.NONE: _compile_none,
+    PairDocASTNodeTypes.KEYVAL: _compile_key_value,
+}
+
+def _compile(ast, scope):
+    if not isinstance(ast, PairDocASTNode):
+        return _compile_fallback(ast)
+    compiler = _COMPILERS.get(ast.node_type)
+    if compiler is None:
+        return _compile_error("Unknown AST type")
+    try:
+        return compiler(ast.children, scope)
+    except Exception:
+        return _compile_fallback(ast)
+
+def compile_content(ast):
+    """
+    将语法树编译为由闭包组成的树，每种节点对应一个专门的闭包，运算符、访问方式与内置变量在编译时确定；
+    编译单元内能静态确定绑定的变量解析为(层数, 槽位)，按槽位直接读写，其余变量仍沿上下文链动态查找。
+    返回run(context_vars=None)，结果与build_content(ast, context_vars)相同，可重复运行
+    """
+    run = _compile(ast, None)
+    def run_content(context_vars:Context = None):
+        return run(context_vars)
+    return run_content
+
+_END = object()
+_WRITE_BUFFER = 1 << 16 # write_html合并片段后再写出的大小
+
+def _separated(items, separator, end=None):
+    # 依次产出items，相邻两项之间产出separator，最后产出end
+    for i, item in enumerate(items):
+        if i > 0:
+            yield separator
+        yield item
+    if end is not None:
+        yield end
+
+def _iter_pieces(content:Content):
+    """
+    按顺序产出HTML片段（str或SourceSpan），拼接后与build_html的结果相同。
+    以迭代器栈代替递归，同时保留的只有当前路径上每层的迭代器
+    """
+    TEXT, STYLE, BLOCK, TUPLE, KEYVALUE, INT, FLOAT, FUNCTION = (
+        ContentTypes.TEXT, ContentTypes.STYLE, ContentTypes.BLOCK, ContentTypes.TUPLE,
+        ContentTypes.KEYVALUE, ContentTypes.INT, ContentTypes.FLOAT, ContentTypes.FUNCTION)
+    stack = [iter((content,))]
+    top = stack[-1]
+    while True:
+        item = next(top, _END)
+        if item is _END:
+            stack.pop()
+            if not stack:
+                return
+            top = stack[-1]
+            continue
+        if item is None:
+            continue
+        if item.__class__ is str: # 分隔符与标签等已生成的片段
+            yield item
+            continue
+        content_type = item.content_type
+        if content_type is TEXT:
+            text = item.content
+            if text.__class__ is str or isinstance(text, SourceSpan): # SourceSpan在输出时才解码
+                yield text
+            elif isinstance(text, TextRope):
+                yield from text.chunks() # TextRope在输出时才拼接
+            else:
+                yield str(text)
+            continue
+        if content_type is STYLE:
+            style, args, children = item.content
+            style = build_html(style)
+            if args is not None:
+                yield f'<{style} {build_html(args)}>'
+            else:
+                yield f'<{style}>'
+            top = iter((children, f'</{style}>'))
+        elif content_type is BLOCK:
+            top = _separated(item.content, ' ')
+        elif content_type is TUPLE:
+            yield '('
+            top = _separated(item.content, ', ', ')')
+        elif content_type is KEYVALUE:
+            key, value = item.content
+            top = iter((key, ': ', value))
+        elif content_type is INT or content_type is FLOAT:
+            yield str(item.content)
+            continue
+        elif content_type is FUNCTION:
+            context, args, body = item.content
+            top = iter((args, f' -> {{{body}}}'))
+        else:
+            raise ValueError("Unknown content type")
+        stack.append(top)
+
+def iter_html(content:Content):
+    """逐段产出HTML字符串，可用作WSGI/ASGI响应体等流式输出的来源"""
+    for piece in _iter_pieces(content):
+        yield piece if piece.__class__ is str else str(piece)
 
 def build_html(content:Content)->str:
     if content is None:
         return ''
-    if content.content_type == ContentTypes.TEXT:
+    if content.content_type is ContentTypes.TEXT and content.content.__class__ is str:
         return content.content
-    if content.content_type == ContentTypes.STYLE:
-        style, args, children = content.content
-        style = build_html(style)
-        children = build_html(children)
+    return ''.join([piece if piece.__class__ is str else str(piece) for piece in _iter_pieces(content)])
+
+class _PieceWriter:
+    """
+    将HTML片段合并到一定大小再写入output：文本流（io.TextIOBase）写入str，其余视为二进制文件对象以UTF-8写入。
+    写入二进制文件时，来自源码缓冲区的SourceSpan文本不经过解码，较长的直接从缓冲区写出
+    """
+    def __init__(self, output):
+        self.output = output
+        self.text_mode = isinstance(output, io.TextIOBase)
+        self.pending = []
+        self.size = 0
+
+    def write(self, piece):
+        if self.text_mode:
+            if piece.__class__ is not str:
+                piece = str(piece)
+        elif isinstance(piece, SourceSpan):
+            if piece.end - piece.start >= _WRITE_BUFFER:
+                self.flush()
+                piece.write_to(self.output)
+                return
+            piece = piece.buffer[piece.start:piece.end]
+        else:
+            piece = piece.encode('utf-8')
+        self.pending.append(piece)
+        self.size += len(piece)
+        if self.size >= _WRITE_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.output.write(('' if self.text_mode else b'').join(self.pending))
+            self.pending.clear()
+            self.size = 0
+
+def write_html(content:Content, output):
+    """将HTML逐段写入output（二进制文件对象或文本流），片段合并到一定大小再写出"""
+    writer = _PieceWriter(output)
+    for piece in _iter_pieces(content):
+        writer.write(piece)
+    writer.flush()
+
+def _may_alias(ast):
+    # 值是否可能是已有的对象（变量的值、函数的返回值、元组的元素等），而不是此节点新建的
+    while ast.node_type in (PairDocASTNodeTypes.UNFUNCTIONAL, PairDocASTNodeTypes.SEPARATOR, PairDocASTNodeTypes.OPERATION):
+        if ast.node_type == PairDocASTNodeTypes.UNFUNCTIONAL:
+            ast = ast.children
+        elif ast.node_type == PairDocASTNodeTypes.SEPARATOR:
+            if not ast.children:
+                return False
+            ast = ast.children[-1]
+        elif ast.children[1] == '+': # 列表内容相加时返回左操作数本身
+            ast = ast.children[0]
+        else:
+            return ast.children[1] != '-'
+    return ast.node_type in (PairDocASTNodeTypes.VARIABLE, PairDocASTNodeTypes.FUNCTIONCALL,
+                             PairDocASTNodeTypes.LET, PairDocASTNodeTypes.ASSIGN)
+
+def _check_fusable(ast):
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, PairDocASTNode):
+            return False
+        node_type = node.node_type
+        children = node.children
+        if node_type in (PairDocASTNodeTypes.TEXT, PairDocASTNodeTypes.NUMBER, PairDocASTNodeTypes.VARIABLE, PairDocASTNodeTypes.NONE):
+            continue
+        if node_type in (PairDocASTNodeTypes.UNFUNCTIONAL, PairDocASTNodeTypes.NEVERRETURN):
+            stack.append(children)
+        elif node_type in (PairDocASTNodeTypes.DOC, PairDocASTNodeTypes.SEPARATOR, PairDocASTNodeTypes.TUPLE):
+            if not isinstance(children, list):
+                return False
+            stack.extend(children)
+        elif node_type == PairDocASTNodeTypes.STYLE:
+            style, args, body = children
+            stack.append(style)
+            if args is not None:
+                stack.append(args)
+            stack.append(body)
+        elif node_type == PairDocASTNodeTypes.OPERATION:
+            left, op, right = children
+            if not isinstance(left, PairDocASTNode) or (op == '+' and _may_alias(left)):
+                return False
+            stack.append(left)
+            stack.append(right)
+        elif node_type in (PairDocASTNodeTypes.LET, PairDocASTNodeTypes.ASSIGN, PairDocASTNodeTypes.KEYVAL,
+                           PairDocASTNodeTypes.FUNCTIONDEF, PairDocASTNodeTypes.FUNCTIONCALL):
+            stack.extend(children)
+        else:
+            return False
+    return True
+
+_fusable_docs = weakref.WeakKeyDictionary()
+
+def _fusable(ast):
+    """
+    求值过程中已求得的值是否不会再被修改。
+    Content相加时列表内容会原地追加，语法树中没有对可能是已有对象的值做加法时，求得的值不会再改变
+    """
+    try:
+        result = _fusable_docs.get(ast)
+    except TypeError:
+        return False
+    if result is None:
+        try:
+            result = _check_fusable(ast)
+        except Exception: # 结构不完整的语法树，求值时按原样出错
+            result = False
+        _fusable_docs[ast] = result
+    return result
+
+def _immutable(content:Content):
+    # 值中不含列表内容（块、元组、键值对、函数），之后不会被修改
+    stack = [content]
+    while stack:
+        content = stack.pop()
+        if content is None:
+            continue
+        content_type = getattr(content, 'content_type', None)
+        if content_type is ContentTypes.STYLE and isinstance(content.content, tuple):
+            stack.extend(content.content)
+        elif content_type not in (ContentTypes.TEXT, ContentTypes.INT, ContentTypes.FLOAT):
+            return False
+    return True
+
+_FLUSH_PIECES = 1024 # 边求值边写出时，片段数达到此值后写出已确定的部分
+
+def _emit(out, content:Content):
+    # 将值追加到片段列表，值本身到写出时才展开为HTML（见_StreamPieces与_join_pieces）
+    if content is None:
+        return
+    content_type = content.content_type
+    if content_type is ContentTypes.TEXT and (content.content.__class__ is str or content.content.__class__ is SourceSpan):
+        out.append(content.content) # 文本与数值不会被原地修改
+    elif content_type is ContentTypes.INT or content_type is ContentTypes.FLOAT:
+        out.append(str(content.content))
+    else:
+        out.append(content)
+
+def _join_pieces(out):
+    # 片段列表拼接为HTML，其中的值此时展开，展开的是求值结束时的值，与先求值再输出时相同
+    parts = []
+    for piece in out:
+        if piece.__class__ is str:
+            parts.append(piece)
+        elif piece.__class__ is Content:
+            parts.extend([p if p.__class__ is str else str(p) for p in _iter_pieces(piece)])
+        else:
+            parts.append(str(piece))
+    return ''.join(parts)
+
+class _StreamPieces(list):
+    """
+    边求值边写出时的片段列表，文档各项之间片段数达到_FLUSH_PIECES时由flush写出已确定的前缀。
+    fusable为False时值在输出后仍可能被修改（例如块在输出后又被原地追加），只写出到第一个可能被修改的值之前，
+    之后的部分到求值结束时由close写出
+    """
+    def __init__(self, writer:_PieceWriter, fusable):
+        super().__init__()
+        self.writer = writer
+        self.fusable = fusable
+        self.blocked = False
+
+    def flush(self):
+        if self.blocked:
+            return
+        write = self.writer.write
+        count = 0
+        for piece in self:
+            if piece.__class__ is Content:
+                if not (self.fusable or _immutable(piece)):
+                    self.blocked = True
+                    break
+                try:
+                    pieces = list(_iter_pieces(piece))
+                except Exception: # 无法输出的值留到求值结束后再出错，与先求值再输出时的顺序一致
+                    self.blocked = True
+                    break
+                for p in pieces:
+                    write(p)
+            else:
+                write(piece)
+            count += 1
+        del self[:count]
+
+    def close(self):
+        write = self.writer.write
+        for piece in self:
+            if piece.__class__ is Content:
+                for p in _iter_pieces(piece):
+                    write(p)
+            else:
+                write(piece)
+        self.clear()
+        self.writer.flush()
+
+def _render_node(ast, context_vars:Context, out, depth):
+    """
+    按build_content的求值顺序求值ast，并将其值的HTML片段追加到out。
+    文档、样式与函数体直接输出，只有作为值使用的部分（绑定、参数、运算数等）才构造Content；
+    与_eval相同，嵌套达到_MAX_DEPTH层时余下的子树由run_steps运行_render的步骤
+    """
+    node_type = ast.node_type
+    if node_type is _TEXT:
+        out.append(ast.children)
+        return
+    if node_type is _VARIABLE:
+        _emit(out, _get_variable(ast.children, context_vars))
+        return
+    if depth >= _MAX_DEPTH:
+        run_steps(_render(ast, context_vars, out))
+        return
+    depth += 1
+    if node_type is _DOC:
+        new_context = Context(context_vars) if depth <= _SHALLOW_DEPTH else _doc_context(ast, context_vars)
+        plan = getattr(ast, 'render_plan', None) # optimize_ast预先输出的部分
+        if plan is None:
+            plan = ast.children
+        for i, item in enumerate(plan):
+            if i > 0:
+                out.append(' ')
+            if item.__class__ is not tuple:
+                _render_node(item, new_context, out, depth)
+            else:
+                html, names, nodes = item
+                if all(new_context.get(name) is None for name in names):
+                    out.append(html)
+                else:
+                    for j, c in enumerate(nodes):
+                        if j > 0:
+                            out.append(' ')
+                        _render_node(c, new_context, out, depth)
+            if out.__class__ is not list and len(out) >= _FLUSH_PIECES:
+                out.flush()
+        return
+    if node_type is _STYLE:
+        style, args, children = ast.children
+        plan = getattr(ast, 'render_plan', None)
+        if plan is not None and (context_vars is None or all(context_vars.get(name) is None for name in plan[2])):
+            out.append(plan[0])
+            _render_node(children, context_vars, out, depth)
+            out.append(plan[1])
+            return
+        style = _eval(style, context_vars, depth)
         if args is not None:
-            args = build_html(args)
-            return f'<{style} {args}>{children}</{style}>'
-        return f'<{style}>{children}</{style}>'
-    if content.content_type == ContentTypes.BLOCK:
-        return ' '.join([build_html(c) for c in content.content])
-    if content.content_type == ContentTypes.TUPLE:
-        return "(" + ', '.join([build_html(c) for c in content.content]) + ")"
-    if content.content_type == ContentTypes.KEYVALUE:
-        key, value = content.content
-        key = build_html(key)
-        value = build_html(value)
-        return f'{key}: {value}'
-    if content.content_type == ContentTypes.INT:
-        return str(content.content)
-    if content.content_type == ContentTypes.FLOAT:
-        return str(content.content)
-    if content.content_type == ContentTypes.FUNCTION:
-        context, args, body = content.content
-        return f"{build_html(args)} -> {{{body}}}"
-    raise ValueError("Unknown content type")
+            args = _eval(args, context_vars, depth)
+        if args is None and style is not None and style.content_type is ContentTypes.TEXT and style.content.__class__ is str:
+            out.append(f'<{style.content}>')
+            _render_node(children, context_vars, out, depth)
+            out.append(f'</{style.content}>')
+            return
+        out.append('<')
+        _emit(out, style)
+        if args is not None:
+            out.append(' ')
+            _emit(out, args)
+        out.append('>')
+        _render_node(children, context_vars, out, depth)
+        out.append('</')
+        _emit(out, style)
+        out.append('>')
+        return
+    if node_type is _FUNCTIONCALL and _eval_state.function_cache is None:
+        func, args = ast.children
+        if _module_call(func, context_vars) is not None:
+            _emit(out, _eval(ast, context_vars, depth))
+            return
+        func = _unwrap_block(_eval(func, context_vars, depth))
+        if func.content_type != ContentTypes.FUNCTION:
+            raise ValueError("Not a function")
+        args = _eval(args, context_vars, depth)
+        new_context, body = _call_context(func, args)
+        if isinstance(body, PairDocASTNode):
+            _render_node(body, new_context, out, depth)
+        else:
+            _emit(out, _interpret_body(body, new_context))
+        return
+    if node_type is _UNFUNCTIONAL:
+        _render_node(ast.children, context_vars, out, depth)
+        return
+    if node_type is _NEVERRETURN:
+        _eval(ast.children, context_vars, depth)
+        return
+    if node_type is _SEPARATOR:
+        if not ast.children:
+            raise IndexError('list index out of range')
+        for c in ast.children[:-1]:
+            _eval(c, context_vars, depth)
+        _render_node(ast.children[-1], context_vars, out, depth)
+        return
+    _emit(out, _eval(ast, context_vars, depth))
+
+def _render(ast, context_vars:Context, out):
+    """_render_node的步骤形式（由run_steps运行），用于嵌套超过_MAX_DEPTH层的部分"""
+    if ast.node_type == PairDocASTNodeTypes.TEXT:
+        out.append(ast.children)
+        return None
+    return _render_steps(ast, context_vars, out)
+
+def _render_steps(ast, context_vars:Context, out):
+    node_type = ast.node_type
+    if node_type == PairDocASTNodeTypes.DOC:
+        new_context = _doc_context(ast, context_vars)
+        plan = getattr(ast, 'render_plan', None)
+        if plan is None:
+            plan = ast.children
+        for i, item in enumerate(plan):
+            if i > 0:
+                out.append(' ')
+            if item.__class__ is not tuple:
+                yield _render(item, new_context, out)
+            else:
+                html, names, nodes = item
+                if all(new_context.get(name) is None for name in names):
+                    out.append(html)
+                else:
+                    for j, c in enumerate(nodes):
+                        if j > 0:
+                            out.append(' ')
+                        yield _render(c, new_context, out)
+            if out.__class__ is not list and len(out) >= _FLUSH_PIECES:
+                out.flush()
+        return
+    if node_type == PairDocASTNodeTypes.STYLE:
+        style, args, children = ast.children
+        plan = getattr(ast, 'render_plan', None)
+        if plan is not None and (context_vars is None or all(context_vars.get(name) is None for name in plan[2])):
+            out.append(plan[0])
+            yield _render(children, context_vars, out)
+            out.append(plan[1])
+            return
+        style = yield _content(style, context_vars)
+        if args is not None:
+            args = yield _content(args, context_vars)
+        out.append('<')
+        _emit(out, style)
+        if args is not None:
+            out.append(' ')
+            _emit(out, args)
+        out.append('>')
+        yield _render(children, context_vars, out)
+        out.append('</')
+        _emit(out, style)
+        out.append('>')
+        return
+    if node_type == PairDocASTNodeTypes.UNFUNCTIONAL:
+        yield _render(ast.children, context_vars, out)
+        return
+    if node_type == PairDocASTNodeTypes.NEVERRETURN:
+        yield _content(ast.children, context_vars)
+        return
+    if node_type == PairDocASTNodeTypes.SEPARATOR:
+        if not ast.children:
+            raise IndexError('list index out of range')
+        for c in ast.children[:-1]:
+            yield _content(c, context_vars)
+        yield _render(ast.children[-1], context_vars, out)
+        return
+    if (node_type == PairDocASTNodeTypes.FUNCTIONCALL and _eval_state.function_cache is None
+            and _module_call(ast.children[0], context_vars) is None):
+        func, args = ast.children
+        func = _unwrap_block((yield _content(func, context_vars)))
+        if func.content_type != ContentTypes.FUNCTION:
+            raise ValueError("Not a function")
+        args = yield _content(args, context_vars)
+        new_context, body = _call_context(func, args)
+        if isinstance(body, PairDocASTNode):
+            yield _render(body, new_context, out)
+        else:
+            _emit(out, _interpret_body(body, new_context))
+        return
+    _emit(out, (yield _content(ast, context_vars)))
+
+def render_html(ast, output=None):
+    """
+    求值文档语法树并输出HTML，结果与build_html(build_content(ast))相同。
+    边求值边输出，不构造整个文档的Content；给定output（二进制文件对象或文本流）时逐段写入output并返回None，
+    此时求值出错前已确定的部分写出到output中
+    """
+    if output is None:
+        out = []
+        _render_node(ast, None, out, 0)
+        return _join_pieces(out)
+    writer = _PieceWriter(output)
+    out = _StreamPieces(writer, _fusable(ast))
+    try:
+        _render_node(ast, None, out, 0)
+    except BaseException:
+        out.flush()
+        writer.flush()
+        raise
+    out.close()
+    return None
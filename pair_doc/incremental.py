@@ -0,0 +1,365 @@
+from itertools import chain, islice
+from operator import itemgetter, sub
+from .lexer import PairDocTokenizer, PairDocFastLexer, PairDocTokenKind, TokenStream, _CLOSING_BRACKETS, _STREAM_LOOKAHEAD
+from .ast import Gather, PairDocPrecedenceParser, PairDocASTNode, PairDocASTNodeTypes, _is_sharp
+
+_OPENING_BRACKETS = frozenset(_CLOSING_BRACKETS.values())
+_CHUNK = 256 # _MeasuredList每块的目标项数
+
+
+class _CrossesBoundary(Exception):
+    pass
+
+
+class _StatementParser(PairDocPrecedenceParser):
+    """
+    单独解析一条语句。token_list末尾带上下一条语句的#，使所有边界判断与在整个文档中解析时一致；
+    向后匹配从boundary（该#）或之后开始时说明语句依赖后面的内容，抛出_CrossesBoundary
+    """
+    def __init__(self, token_list, boundary):
+        super().__init__(token_list)
+        self.boundary = boundary
+
+    def _match(self, items, end, start_idx):
+        if self.boundary is not None and start_idx >= self.boundary and items is self.token_list:
+            raise _CrossesBoundary()
+        return super()._match(items, end, start_idx)
+
+
+class _Fenwick:
+    """前缀和树：修改一个值与求前缀和都是O(log n)"""
+    __slots__ = ('tree',)
+
+    def __init__(self, values):
+        tree = [0]
+        tree.extend(values)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def add(self, i, delta):
+        tree = self.tree
+        i += 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """前i个值之和"""
+        tree = self.tree
+        total = 0
+        while i:
+            total += tree[i]
+            i &= i - 1
+        return total
+
+    def search(self, value):
+        """各值非负时，前缀和不超过value的最长前缀：返回(长度, value减去该前缀和)"""
+        tree = self.tree
+        i = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            j = i + step
+            if j < len(tree) and tree[j] <= value:
+                i = j
+                value -= tree[j]
+            step >>= 1
+        return i, value
+
+
+class _MeasuredList:
+    """
+    分块保存的序列，measures为每项的若干个非负整数度量。
+    各块的项数与度量之和由Fenwick树维护：按下标取项、求前缀和、按前缀和定位都是O(log n)加上块长；
+    替换一段只重建所在的块，块数变化时才重建Fenwick树
+    """
+    def __init__(self, entries, measures):
+        self.measures = measures
+        self.chunks = [entries[i:i + _CHUNK] for i in range(0, len(entries), _CHUNK)]
+        self.length = len(entries)
+        self.sums = [[sum(map(measure, chunk)) for chunk in self.chunks] for measure in measures]
+        self._build_trees()
+
+    def _build_trees(self):
+        self.counts = _Fenwick(map(len, self.chunks))
+        self.trees = [_Fenwick(sums) for sums in self.sums]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        k, j = self.counts.search(i)
+        return self.chunks[k][j]
+
+    def iterate(self, i):
+        """从下标i开始依次产出各项"""
+        k, j = self.counts.search(i)
+        for chunk in islice(self.chunks, k, None):
+            yield from islice(chunk, j, None)
+            j = 0
+
+    def prefix(self, i, m=0):
+        """前i项的第m个度量之和"""
+        k, j = self.counts.search(i)
+        total = self.trees[m].prefix(k)
+        if j:
+            total += sum(map(self.measures[m], self.chunks[k][:j]))
+        return total
+
+    def bisect(self, value, m=0):
+        """第m个度量的前缀和不超过value的最大项数，value为负时为-1"""
+        if value < 0:
+            return -1
+        k, value = self.trees[m].search(value)
+        i = self.counts.prefix(k)
+        if k < len(self.chunks):
+            measure = self.measures[m]
+            for entry in self.chunks[k]:
+                value -= measure(entry)
+                if value < 0:
+                    break
+                i += 1
+        return i
+
+    def replace(self, start, end, entries):
+        """将[start, end)的项替换为entries"""
+        chunks = self.chunks
+        k, j = self.counts.search(start)
+        if k == len(chunks) and k:
+            k -= 1
+            j = len(chunks[k])
+        stop, tail = self.counts.search(end)
+        merged = chunks[k][:j] if k < len(chunks) else []
+        merged.extend(entries)
+        if stop < len(chunks):
+            merged.extend(islice(chunks[stop], tail, None))
+            stop += 1
+        if len(merged) < _CHUNK // 2 and stop < len(chunks):
+            # 过短的块并入下一块，块数不随删除增长
+            merged.extend(chunks[stop])
+            stop += 1
+        if len(merged) > 2 * _CHUNK:
+            pieces = [merged[i:i + _CHUNK] for i in range(0, len(merged), _CHUNK)]
+        else:
+            pieces = [merged] if merged else []
+        old_lengths = list(map(len, chunks[k:stop]))
+        self.length += len(merged) - sum(old_lengths)
+        chunks[k:stop] = pieces
+        resized = len(pieces) != len(old_lengths)
+        for m, measure in enumerate(self.measures):
+            sums = self.sums[m]
+            new_sums = [sum(map(measure, piece)) for piece in pieces]
+            if not resized:
+                for i, total in enumerate(new_sums, k):
+                    self.trees[m].add(i, total - sums[i])
+            sums[k:stop] = new_sums
+        if resized:
+            self._build_trees()
+        else:
+            for i, (piece, old_length) in enumerate(zip(pieces, old_lengths), k):
+                self.counts.add(i, len(piece) - old_length)
+
+
+def _node_count(segment):
+    return len(segment[1])
+
+
+class PairDocDocument:
+    """
+    可增量更新的已解析文档。
+    顶层token组按#划分为语句（从一个#到下一个#），每条语句单独解析并保存结果；
+    apply_edit只重新扫描被修改的区域、只对受影响的顶层token组重新分组，
+    并只重新解析包含它们的语句，其余语句的语法树直接复用。
+    复用的顶层token组保留其被扫描时的token位置，当前的源码位置由各组的宽度累加得到：
+    顶层token组与语句都保存在_MeasuredList中，按位置定位与替换一段都不必遍历整个文档
+    """
+    def __init__(self, text):
+        self.lexer = PairDocFastLexer()
+        self.text = text
+        self.items = None # 顶层token组的(token组, 到下一组起点或文本末尾的距离)
+        self.base = 0 # 第一个顶层token组在源码中的起始位置
+        self.segments = None # 每条语句的(顶层token组数, 语法树节点列表)
+        self.incremental = False
+        self.ast = None
+        self._reparse_all()
+
+    def apply_edit(self, offset, removed_len, inserted_text):
+        """
+        将text[offset:offset + removed_len]替换为inserted_text，返回新的语法树。
+        新旧语法树共用顶层节点列表，之前返回的语法树不应再使用
+        """
+        if offset < 0 or removed_len < 0 or offset + removed_len > len(self.text):
+            raise ValueError('Invalid edit range: ', offset, removed_len)
+        self.text = self.text[:offset] + inserted_text + self.text[offset + removed_len:]
+        try:
+            if not self.incremental or not self._reparse_edit(offset, removed_len, len(inserted_text)):
+                self._reparse_all()
+        except BaseException:
+            self.incremental = False # 解析出错后状态不完整，下次编辑时整体重新解析
+            self.ast = None
+            raise
+        return self.ast
+
+    def _reparse_all(self):
+        self.incremental = False
+        stream = PairDocTokenizer(self.lexer).parse_stream(self.text)
+        groups = Gather(stream).gather()
+        if not stream.balanced:
+            # 括号不配对时分组依赖于整个文档，只能整体解析
+            self.ast = PairDocPrecedenceParser(groups).parse_doc()
+            return
+        starts = [group.position(0) for group in groups]
+        self.base = starts[0] if starts else 0
+        self.items = _MeasuredList(self._spaced(groups, starts, len(self.text)), (itemgetter(1),))
+        segments = []
+        start = 0
+        while start < len(groups):
+            segment, start = self._parse_segment(start)
+            segments.append(segment)
+        self.segments = _MeasuredList(segments, (itemgetter(0), _node_count))
+        self.ast = PairDocASTNode(PairDocASTNodeTypes.DOC, list(chain.from_iterable(map(itemgetter(1), segments))))
+        self.incremental = True
+
+    @staticmethod
+    def _spaced(groups, starts, follow):
+        """按各组的起点与其后的位置follow求每组的宽度"""
+        ends = starts[1:]
+        ends.append(follow)
+        return list(zip(groups, map(sub, ends, starts)))
+
+    def _start(self, idx):
+        return self.base + self.items.prefix(idx)
+
+    def _next_sharp(self, idx):
+        for group, _ in self.items.iterate(idx):
+            if _is_sharp(group):
+                break
+            idx += 1
+        return idx
+
+    def _parse_segment(self, start):
+        """
+        单独解析从start开始的一条语句，返回((顶层token组数, 节点列表), 结束位置)。
+        语句只有在向后匹配越过自身的边界时才依赖后面的内容，此时与下一条语句合并后重新解析
+        """
+        items = self.items
+        end = self._next_sharp(start + 1)
+        while True:
+            boundary = end - start if end < len(items) else None
+            groups = list(map(itemgetter(0), islice(items.iterate(start), end + 1 - start)))
+            try:
+                nodes = _StatementParser(groups, boundary).parse()
+                break
+            except _CrossesBoundary:
+                end = self._next_sharp(end + 1)
+                continue
+            except Exception:
+                pass
+            # 复用的顶层token组保留着旧的token位置：出错时按当前文本重新扫描这些组再解析，错误中的位置与整体解析时相同
+            nodes = _StatementParser(self._rescan(start, end + 1), boundary).parse()
+            break
+        return (end - start, nodes), end
+
+    def _rescan(self, start, end):
+        """重新扫描顶层token组[start, end)所在的文本，返回位置与当前文本一致的token组；扫描需要回退到参考实现时扫描整个文本"""
+        text = self.text
+        scan = self.lexer.scan_token
+        stream = TokenStream()
+        pos = self._start(start)
+        stop = self._start(end) if end < len(self.items) else len(text)
+        while pos < stop:
+            result = scan(text, pos, True)
+            if result is None:
+                stream = PairDocTokenizer(self.lexer).parse_stream(text)
+                return Gather(stream).gather()[start:end]
+            token, kind, token_end = result
+            if kind is not None and kind != PairDocTokenKind.COMMENT:
+                stream.append(token, kind, pos)
+            pos = token_end
+        stream.match_brackets()
+        return Gather(stream).gather()
+
+    def _relex(self, restart, edit_end, delta):
+        """
+        从顶层token组的起点restart开始扫描新文本，直到在括号外回到某个未修改的旧顶层token组的起点。
+        返回(新的token流, 该旧token组的下标)；遇到不配对的括号或需要回退到参考实现的情况时返回None
+        """
+        text = self.text
+        items = self.items
+        scan = self.lexer.scan_token
+        stream = TokenStream()
+        stack = []
+        pos = restart
+        resume = edit_end + delta # 新文本中未修改部分的起点
+        while True:
+            if not stack and pos >= resume:
+                idx = items.bisect(pos - delta - self.base)
+                if 0 <= idx < len(items) and self._start(idx) == pos - delta:
+                    return stream, idx
+            if pos >= len(text):
+                if stack:
+                    return None
+                return stream, len(items)
+            result = scan(text, pos, True)
+            if result is None:
+                return None
+            token, kind, end = result
+            if kind is not None and kind != PairDocTokenKind.COMMENT:
+                if kind == PairDocTokenKind.SYMBOL:
+                    if token in _OPENING_BRACKETS:
+                        stack.append(token)
+                    elif token in _CLOSING_BRACKETS:
+                        if not stack or stack.pop() != _CLOSING_BRACKETS[token]:
+                            return None
+                stream.append(token, kind, pos)
+            pos = end
+
+    def _reparse_edit(self, offset, removed_len, inserted_len):
+        delta = inserted_len - removed_len
+        items = self.items
+        count = len(items)
+        # 之前的token只依赖于其后_STREAM_LOOKAHEAD个字符以内的文本，从距离修改处足够远的顶层token组开始重新扫描
+        first = min(items.bisect(offset - _STREAM_LOOKAHEAD - self.base), count - 1)
+        if first < 0:
+            first, restart = 0, 0
+        else:
+            restart = self._start(first)
+        relexed = self._relex(restart, offset + removed_len, delta)
+        if relexed is None:
+            return False
+        stream, last = relexed
+        stream.match_brackets()
+        middle = Gather(stream).gather()
+
+        # 替换[first, last)的顶层token组；前一组的宽度随新的第一组的起点变化，一并替换
+        segments = self.segments
+        shift = len(middle) - (last - first)
+        follow = len(self.text) if last == count else self._start(last) + delta
+        starts = [group.position(0) for group in middle]
+        if first:
+            group, width = items[first - 1]
+            middle.insert(0, group)
+            starts.insert(0, restart - width)
+        else:
+            self.base = starts[0] if starts else follow
+        items.replace(first - bool(first), last, self._spaced(middle, starts, follow))
+
+        # 修改处之前的一条语句也可能因边界上的#被修改而延长，从它开始重新解析，直到与修改后的某条旧语句的起点重合
+        head = segments.bisect(max(first - 1, 0))
+        tail = segments.bisect(last - 1) + 1
+        start = segments.prefix(head)
+        parsed = []
+        while True:
+            tail = max(tail, segments.bisect(start - shift - 1) + 1)
+            if tail <= len(segments) and segments.prefix(tail) + shift == start:
+                break
+            segment, start = self._parse_segment(start)
+            parsed.append(segment)
+        # 顶层节点列表原地替换受影响的语句；DOC节点每次新建，按节点缓存的求值信息不会过期
+        nodes = self.ast.children
+        nodes[segments.prefix(head, 1):segments.prefix(tail, 1)] = chain.from_iterable(map(itemgetter(1), parsed))
+        segments.replace(head, tail, parsed)
+        self.ast = PairDocASTNode(PairDocASTNodeTypes.DOC, nodes)
+        return True
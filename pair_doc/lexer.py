@@ -1,5 +1,7 @@
 import re
 import base64
+import codecs
+from array import array
 
 DEBUG = False
 
@@ -12,6 +14,263 @@ class PairDocTokenType:
     TokenType_BASE64 = 'BASE64'
 
 
+class PairDocTokenKind:
+    # TokenStream中使用的整数token类型
+    COMMENT = 0
+    NUMBER = 1
+    STRING = 2
+    SYMBOL = 3
+    IDENTIFIER = 4
+    BASE64 = 5
+
+
+_TOKEN_TYPES = (
+    PairDocTokenType.TokenType_COMMENT,
+    PairDocTokenType.TokenType_NUMBER,
+    PairDocTokenType.TokenType_STRING,
+    PairDocTokenType.TokenType_SYMBOL,
+    PairDocTokenType.TokenType_IDENTIFIER,
+    PairDocTokenType.TokenType_BASE64,
+)
+_TOKEN_KINDS = {token_type: kind for kind, token_type in enumerate(_TOKEN_TYPES)}
+_CLOSING_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+
+class SourceSpan:
+    """
+    源码缓冲区（UTF-8编码的bytes或mmap）中[start, end)的一段文本，
+    只在需要str时才解码，输出时可以直接从缓冲区写出
+    """
+    __slots__ = ('buffer', 'start', 'end')
+
+    def __init__(self, buffer, start, end):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return self.buffer[self.start:self.end].decode('utf-8')
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __eq__(self, value):
+        if isinstance(value, SourceSpan):
+            value = value.buffer[value.start:value.end]
+        elif isinstance(value, str):
+            value = value.encode('utf-8')
+        else:
+            return NotImplemented
+        return len(value) == self.end - self.start and self.buffer[self.start:self.end] == value
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __add__(self, value):
+        return str(self) + value
+
+    def __radd__(self, value):
+        return value + str(self)
+
+    def __getitem__(self, i):
+        return str(self)[i]
+
+    def __int__(self):
+        return int(str(self))
+
+    def __float__(self):
+        return float(str(self))
+
+    def write_to(self, file):
+        # 将原始字节直接写入二进制文件对象
+        with memoryview(self.buffer) as view, view[self.start:self.end] as part:
+            file.write(part)
+
+
+class TokenStream:
+    """
+    struct-of-arrays形式的token流：类型为array中的小整数，位置为并行的偏移数组，
+    文本存放在去重后的文本表中，每个token只记录文本表下标。
+    切片得到不复制数据的TokenStreamView
+    """
+    def __init__(self):
+        self.kinds = array('B')
+        self.offsets = array('q')
+        self.text_ids = array('I')
+        self.texts = []
+        self.text_index = {}
+        self.partners = None # 由match_brackets计算
+        self.balanced = False
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        stream = cls()
+        for token in tokens:
+            stream.append(token['token'], _TOKEN_KINDS[token['type']], token['position'])
+        stream.match_brackets()
+        return stream
+
+    def append(self, text, kind, position):
+        text_id = self.text_index.get(text)
+        if text_id is None:
+            text_id = len(self.texts)
+            self.texts.append(text)
+            self.text_index[text] = text_id
+        self.kinds.append(kind)
+        self.offsets.append(position)
+        self.text_ids.append(text_id)
+
+    def append_unique(self, text, kind, position):
+        # 不参与去重的文本（如SourceSpan），避免为计算哈希而解码
+        self.kinds.append(kind)
+        self.offsets.append(position)
+        self.text_ids.append(len(self.texts))
+        self.texts.append(text)
+
+    def truncate(self, size):
+        del self.kinds[size:]
+        del self.offsets[size:]
+        del self.text_ids[size:]
+
+    def match_brackets(self):
+        """
+        一遍扫描记录每个括号到与之配对的括号的相对距离（其他token为0），保存在partners中，
+        相对距离在切片后依然有效。括号不能完全配对时balanced为False
+        """
+        partners = array('q', bytes(8 * len(self.kinds)))
+        bracket_ids = {}
+        for bracket in ('(', ')', '[', ']', '{', '}'):
+            if bracket in self.text_index:
+                bracket_ids[self.text_index[bracket]] = bracket
+        kinds = self.kinds
+        stack = []
+        balanced = True
+        for i, text_id in enumerate(self.text_ids):
+            if text_id not in bracket_ids or kinds[i] != PairDocTokenKind.SYMBOL:
+                continue
+            bracket = bracket_ids[text_id]
+            if bracket in _CLOSING_BRACKETS:
+                if not stack or _CLOSING_BRACKETS[bracket] != stack[-1][1]:
+                    balanced = False
+                    break
+                j = stack.pop()[0]
+                partners[j] = i - j
+                partners[i] = j - i
+            else:
+                stack.append((i, bracket))
+        self.partners = partners
+        self.balanced = balanced and not stack
+
+    def kind(self, i):
+        return self.kinds[i]
+
+    def text(self, i):
+        return self.texts[self.text_ids[i]]
+
+    def position(self, i):
+        return self.offsets[i]
+
+    def partner(self, i):
+        return self.partners[i]
+
+    def is_symbol(self, i, symbol):
+        return self.kinds[i] == PairDocTokenKind.SYMBOL and self.texts[self.text_ids[i]] == symbol
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if self.partners is None:
+                self.match_brackets()
+            return TokenStreamView(self, 0, len(self.kinds))[i]
+        return {'token': self.text(i), 'type': _TOKEN_TYPES[self.kinds[i]], 'position': self.offsets[i]}
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self[i]
+
+    def to_tokens(self):
+        return list(self)
+
+    def __repr__(self):
+        return repr(self.to_tokens())
+
+
+class TokenStreamView:
+    """
+    TokenStream中[start, end)范围的只读视图，与原流共享全部数组，不复制token
+    """
+    __slots__ = ('stream', 'start', 'end')
+
+    def __init__(self, stream, start, end):
+        self.stream = stream
+        self.start = start
+        self.end = end
+
+    @property
+    def texts(self):
+        return self.stream.texts
+
+    @property
+    def partners(self):
+        return self.stream.partners
+
+    @property
+    def balanced(self):
+        return self.stream.balanced
+
+    def match_brackets(self):
+        # 配对表由原流统一计算
+        pass
+
+    def kind(self, i):
+        return self.stream.kinds[self.start + i if i >= 0 else self.end + i]
+
+    def text(self, i):
+        stream = self.stream
+        return stream.texts[stream.text_ids[self.start + i if i >= 0 else self.end + i]]
+
+    def position(self, i):
+        return self.stream.offsets[self.start + i if i >= 0 else self.end + i]
+
+    def partner(self, i):
+        return self.stream.partners[self.start + i if i >= 0 else self.end + i]
+
+    def is_symbol(self, i, symbol):
+        stream = self.stream
+        i = self.start + i if i >= 0 else self.end + i
+        return stream.kinds[i] == PairDocTokenKind.SYMBOL and stream.texts[stream.text_ids[i]] == symbol
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.end - self.start)
+            if step != 1:
+                raise ValueError('TokenStreamView only supports contiguous slices')
+            return TokenStreamView(self.stream, self.start + start, self.start + max(start, stop))
+        if not -len(self) <= i < len(self):
+            raise IndexError('token index out of range')
+        return self.stream[self.start + i if i >= 0 else self.end + i]
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield self.stream[i]
+
+    def to_tokens(self):
+        return list(self)
+
+    def __repr__(self):
+        return repr(self.to_tokens())
+
+
+_OPERATORS = frozenset({"+", "-", "*", "/", "\\", "%", "&", "!", "^", "~", "=", "==", ">", "<", "<=", ">=", "!=", "?=", "|", "?", ":>", "#",
+                        "&&", ",", ".", "\n", ":", "->", "<<", ">>", "/*", "*/", ";", " ", ":=", "|>", "<|", "::", "--", "=>", "++", "||", '"""', "'''", "---"})
+_BRACKETS = frozenset({"(", ")", "[", "]", "{", "}"})
+
+
 class PairDocLexer:
     def tokenize(self, str):
         tokens = []
@@ -332,12 +591,32 @@ class PairDocLexer:
         return tokens
 
     def is_operator(self, t, type):
-        l = (t in {"+", "-", "*", "/", "\\", "%", "&", "!", "^", "~", "=", "==", ">", "<", "<=", ">=", "!=", "?=", "|", "?", ":>", "#",
-                    "&&", ",", ".", "\n", ":", "->", "<<", ">>", "/*", "*/", ";", " ", ":=", "|>", "<|", "::", "--", "=>", "++", "||", ">>", "<<", '"""', "'''", "---"})
+        l = t in _OPERATORS
         if type == 0:
-            l = l or (t in {"(", ")", "[", "]", "{", "}"})
+            l = l or (t in _BRACKETS)
         return l
 
+    def tokenize_stream(self, str, comments=True):
+        tokens = self.tokenize(str)
+        if not comments:
+            tokens = self.reject_comments(tokens)
+        return TokenStream.from_tokens(tokens)
+
+    def tokenize_buffer(self, buffer, comments=True):
+        # 解码整个缓冲区后扫描，token位置换算为字节偏移
+        text = bytes(buffer).decode('utf-8')
+        stream = TokenStream()
+        _append_decoded(stream, self.tokenize_stream(text, comments), text, 0)
+        stream.match_brackets()
+        return stream
+
+    def iter_tokenize(self, source, chunk_size=65536, comments=True):
+        # 参考实现不支持增量扫描，读入全部输入后再逐个产出
+        tokens = self.tokenize(''.join(_iter_chunks(source, chunk_size)))
+        if not comments:
+            tokens = self.reject_comments(tokens)
+        yield from tokens
+
     def reject_comments(self, tokens):
         return [token for token in tokens if token['type'] != PairDocTokenType.TokenType_COMMENT]
     
@@ -376,11 +655,417 @@ class PairDocLexer:
             offset += 1
         return new_tokens
 
+def _build_master_source():
+    # 按PairDocLexer的尝试顺序组合成一个正则：注释、数字、字符串、base64、运算符、标识符
+    operators = sorted((_OPERATORS | _BRACKETS) - {'\n', ' ', '"""', "'''"}, key=len, reverse=True)
+    breaks = {' ', '\t', '\n', '\r', '\'', '"'} | {op[0] for op in operators}
+    return (
+        r'(?P<space>[ \t\n\r]+)'
+        r'|(?P<comment>//|/\*)'
+        r'|(?P<number>\d*\.?\d+(?:[eE][-+]?\d+)?)'
+        r'|(?P<string>R"|"""|' + "'''" + r'|"|\'|“)'
+        r'|(?P<base64>\$")'
+        r'|(?P<operator>' + '|'.join(re.escape(op) for op in operators) + ')'
+        r'|(?P<identifier>[^' + ''.join(re.escape(ch) for ch in sorted(breaks)) + ']+)'
+    )
+
+
+_MASTER_PATTERN = re.compile(_build_master_source())
+_LINE_COMMENT_PATTERN = re.compile(r'[^\n\r]*')
+_HEX4_PATTERN = re.compile(r'[0-9a-fA-F]{4}')
+# 字节模式下使用的对应正则，bytes正则中的\d只匹配ASCII数字
+_BINARY_MASTER_PATTERN = re.compile(_build_master_source().encode('utf-8'))
+_BINARY_LINE_COMMENT_PATTERN = re.compile(rb'[^\n\r]*')
+_BINARY_HEX4_PATTERN = re.compile(rb'[0-9a-fA-F]{4}')
+_NON_ASCII_DIGIT_PATTERN = re.compile(r'(?![0-9])\d')
+_SIMPLE_ESCAPES = {'n': '\n', 't': '\t'}
+# 组合正则中任一token能否继续延长（如'-'与'---'、'1'与'1e+5'）最多取决于其后的3个字符
+_STREAM_LOOKAHEAD = 3
+
+
+def _append_decoded(stream, tokens, text, start):
+    # 将对text扫描得到的tokens追加到stream，text为缓冲区从字节偏移start开始解码的内容，字符位置换算为字节偏移
+    char_pos = 0
+    byte_pos = start
+    for i in range(len(tokens)):
+        position = tokens.position(i)
+        byte_pos += len(text[char_pos:position].encode('utf-8'))
+        char_pos = position
+        stream.append(tokens.text(i), tokens.kind(i), byte_pos)
+
+
+def _utf8_length(lead):
+    # 根据UTF-8首字节计算字符占用的字节数
+    if lead < 0x80:
+        return 1
+    if lead < 0xE0:
+        return 2
+    if lead < 0xF0:
+        return 3
+    return 4
+
+
+def _iter_chunks(source, chunk_size, encoding='utf-8'):
+    # 将文件对象、str/bytes或chunk的可迭代对象统一为str chunk序列，bytes按增量解码处理多字节字符被切断的情况
+    if isinstance(source, (str, bytes, bytearray)):
+        source = (source,)
+    elif hasattr(source, 'read'):
+        file = source
+        source = iter(lambda: file.read(chunk_size), file.read(0))
+    decoder = None
+    for chunk in source:
+        if isinstance(chunk, (bytes, bytearray)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None:
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+
+
+class PairDocFastLexer(PairDocLexer):
+    """
+    单遍扫描的词法分析器，所有token由一个预编译的组合正则识别，
+    字符串字面量用str.find整段切片，输出与PairDocLexer完全一致的token流。
+    遇到非常规输入（未闭合的字符串、非标准的\\u转义等）时，
+    剩余部分交给PairDocLexer处理，保证行为一致
+    """
+    def tokenize(self, str):
+        return self.tokenize_stream(str).to_tokens()
+
+    def tokenize_stream(self, str, comments=True):
+        stream = TokenStream()
+        append = stream.append
+        currpos = 0
+        length = len(str)
+        match = _MASTER_PATTERN.match
+        while currpos < length:
+            m = match(str, currpos)
+            kind = m.lastgroup
+            if kind == 'space':
+                currpos = m.end()
+                continue
+            position = currpos
+            if kind == 'identifier':
+                currpos = m.end()
+                append(m.group(), PairDocTokenKind.IDENTIFIER, position)
+            elif kind == 'operator':
+                currpos = m.end()
+                append(m.group(), PairDocTokenKind.SYMBOL, position)
+            elif kind == 'number':
+                currpos = m.end()
+                append(m.group(), PairDocTokenKind.NUMBER, position)
+            elif kind == 'comment':
+                if m.group() == '//':
+                    end = _LINE_COMMENT_PATTERN.match(str, currpos + 2).end()
+                    comment = str[currpos + 2:end]
+                    currpos = end
+                else:
+                    end = str.find('*/', currpos + 2)
+                    if end < 0:
+                        comment = str[currpos + 2:]
+                        currpos = length
+                    else:
+                        comment = str[currpos + 2:end]
+                        currpos = end + 2
+                if comments:
+                    append(comment, PairDocTokenKind.COMMENT, position)
+            else:
+                if kind == 'string':
+                    result = self.read_string_at(str, currpos, m.group())
+                    token_kind = PairDocTokenKind.STRING
+                else:
+                    result = self.read_escaped(str, currpos + 2, '"', ('"', '\\'))
+                    token_kind = PairDocTokenKind.BASE64
+                if result is None:
+                    for token in self.reference_tokenize(str, position):
+                        token_kind = _TOKEN_KINDS[token['type']]
+                        if comments or token_kind != PairDocTokenKind.COMMENT:
+                            append(token['token'], token_kind, token['position'])
+                    break
+                token, currpos = result
+                append(token, token_kind, position)
+        stream.match_brackets()
+        return stream
+
+    def tokenize_buffer(self, buffer, comments=True):
+        """
+        直接在UTF-8编码的bytes/bytearray/mmap缓冲区上扫描，token位置为字节偏移。
+        不含转义的字符串字面量与注释以SourceSpan保存，不复制内容
+        """
+        stream = TokenStream()
+        append = stream.append
+        currpos = 0
+        length = len(buffer)
+        match = _BINARY_MASTER_PATTERN.match
+        run_start = 0 # 当前这段无空白间隔的连续token的起始位置与下标
+        run_index = 0
+        while currpos < length:
+            m = match(buffer, currpos)
+            kind = m.lastgroup
+            if kind == 'space':
+                currpos = m.end()
+                run_start = currpos
+                run_index = len(stream)
+                continue
+            position = currpos
+            if kind == 'identifier':
+                token = m.group()
+                if token.isascii():
+                    token = token.decode('ascii')
+                else:
+                    token = token.decode('utf-8')
+                    if _NON_ASCII_DIGIT_PATTERN.search(token):
+                        # 非ASCII数字在str模式下可能与相邻的token组成数字，从这段连续token的开头改为解码后扫描
+                        stream.truncate(run_index)
+                        self.tokenize_decoded(buffer, run_start, stream, comments)
+                        break
+                currpos = m.end()
+                append(token, PairDocTokenKind.IDENTIFIER, position)
+            elif kind == 'operator':
+                currpos = m.end()
+                append(m.group().decode('ascii'), PairDocTokenKind.SYMBOL, position)
+            elif kind == 'number':
+                currpos = m.end()
+                append(m.group().decode('ascii'), PairDocTokenKind.NUMBER, position)
+            elif kind == 'comment':
+                if m.group() == b'//':
+                    end = _BINARY_LINE_COMMENT_PATTERN.match(buffer, currpos + 2).end()
+                    comment = SourceSpan(buffer, currpos + 2, end)
+                    currpos = end
+                else:
+                    end = buffer.find(b'*/', currpos + 2)
+                    if end < 0:
+                        comment = SourceSpan(buffer, currpos + 2, length)
+                        currpos = length
+                    else:
+                        comment = SourceSpan(buffer, currpos + 2, end)
+                        currpos = end + 2
+                if comments:
+                    stream.append_unique(comment, PairDocTokenKind.COMMENT, position)
+            else:
+                if kind == 'string':
+                    result = self.read_span_at(buffer, currpos, m.group())
+                    token_kind = PairDocTokenKind.STRING
+                else:
+                    result = self.read_escaped_span(buffer, currpos + 2, b'"', ('"', '\\'))
+                    token_kind = PairDocTokenKind.BASE64
+                if result is None:
+                    self.tokenize_decoded(buffer, position, stream, comments)
+                    break
+                token, currpos = result
+                if isinstance(token, SourceSpan):
+                    stream.append_unique(token, token_kind, position)
+                else:
+                    append(token, token_kind, position)
+        stream.match_brackets()
+        return stream
+
+    def tokenize_decoded(self, buffer, start, stream, comments):
+        # 将缓冲区从start开始的剩余部分解码后按str模式扫描
+        text = buffer[start:].decode('utf-8')
+        _append_decoded(stream, self.tokenize_stream(text, comments), text, start)
+
+    def read_string_at(self, str, pos, opener):
+        if opener == 'R"':
+            paren = str.find('(', pos + 2)
+            if paren < 0:
+                return None
+            return self.read_escaped(str, paren + 1, ')' + str[pos + 2:paren] + '"', ('"', '\\'))
+        if opener == '"""' or opener == "'''":
+            return self.read_escaped(str, pos + 3, opener, ('"', '\\'))
+        if opener == '“':
+            return self.read_escaped(str, pos + 1, '”', ('“', '\\'))
+        return self.read_escaped(str, pos + 1, opener, (opener, '\\'))
+
+    def read_escaped(self, str, pos, terminator, escapable):
+        """
+        读取到terminator为止的字面量并处理转义，返回(内容, 结束位置)，
+        非常规情况返回None
+        """
+        end = str.find(terminator, pos)
+        parts = []
+        while end >= 0:
+            slash = str.find('\\', pos, end)
+            if slash < 0:
+                parts.append(str[pos:end])
+                return ''.join(parts), end + len(terminator)
+            parts.append(str[pos:slash])
+            if slash + 1 >= len(str):
+                return None
+            escape_char = str[slash + 1]
+            pos = slash + 2
+            if escape_char in _SIMPLE_ESCAPES:
+                parts.append(_SIMPLE_ESCAPES[escape_char])
+            elif escape_char in escapable:
+                parts.append(escape_char)
+            elif escape_char == 'u':
+                hex_str = str[pos:pos + 4]
+                if not _HEX4_PATTERN.fullmatch(hex_str):
+                    return None
+                parts.append(chr(int(hex_str, 16)))
+                pos += 4
+            else:
+                parts.append('\\' + escape_char)
+            if pos > end:
+                end = str.find(terminator, pos)
+        return None
+
+    def read_span_at(self, buffer, pos, opener):
+        if opener == b'R"':
+            paren = buffer.find(b'(', pos + 2)
+            if paren < 0:
+                return None
+            return self.read_escaped_span(buffer, paren + 1, b')' + buffer[pos + 2:paren] + b'"', ('"', '\\'))
+        if opener == b'"""' or opener == b"'''":
+            return self.read_escaped_span(buffer, pos + 3, opener, ('"', '\\'))
+        if opener == '“'.encode('utf-8'):
+            return self.read_escaped_span(buffer, pos + len(opener), '”'.encode('utf-8'), ('“', '\\'))
+        return self.read_escaped_span(buffer, pos + 1, opener, (opener.decode('ascii'), '\\'))
+
+    def read_escaped_span(self, buffer, pos, terminator, escapable):
+        """
+        read_escaped的字节版本，返回(内容, 结束位置)。
+        不含转义时内容为SourceSpan，否则解码后按read_escaped处理转义
+        """
+        start = pos
+        end = buffer.find(terminator, pos)
+        escaped = False
+        while end >= 0:
+            slash = buffer.find(b'\\', pos, end)
+            if slash < 0:
+                if not escaped:
+                    return SourceSpan(buffer, start, end), end + len(terminator)
+                terminator_text = terminator.decode('utf-8')
+                text = buffer[start:end].decode('utf-8') + terminator_text
+                return self.read_escaped(text, 0, terminator_text, escapable)[0], end + len(terminator)
+            escaped = True
+            if slash + 1 >= len(buffer):
+                return None
+            lead = buffer[slash + 1]
+            if lead == ord('u'):
+                if not _BINARY_HEX4_PATTERN.fullmatch(buffer, slash + 2, slash + 6):
+                    return None
+                pos = slash + 6
+            else:
+                pos = slash + 1 + _utf8_length(lead)
+            if pos > end:
+                end = buffer.find(terminator, pos)
+        return None
+
+    def iter_tokenize(self, source, chunk_size=65536, comments=True):
+        """
+        从文件对象或chunk的可迭代对象中增量读取源码并逐个产出token，
+        跨越chunk边界的token会等待后续输入补全。
+        缓冲区只保留尚未消费的部分，内存占用取决于最长的单个token而不是整个文档
+        """
+        chunks = _iter_chunks(source, chunk_size)
+        buffer = ''
+        base = 0 # buffer[0]在整个文档中的位置
+        currpos = 0
+        eof = False
+        while True:
+            result = None
+            if currpos < len(buffer):
+                result = self.scan_token(buffer, currpos, eof)
+            elif eof:
+                return
+            if result is None:
+                if eof:
+                    for token in self.reference_tokenize(buffer, currpos):
+                        if comments or token['type'] != PairDocTokenType.TokenType_COMMENT:
+                            token['position'] += base
+                            yield token
+                    return
+                # 丢弃已消费的部分，并至少读入与剩余部分等长的数据，保证长token的总扫描代价是线性的
+                base += currpos
+                parts = [buffer[currpos:]]
+                wanted = max(chunk_size, len(parts[0]))
+                currpos = 0
+                while wanted > 0:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        eof = True
+                        break
+                    parts.append(chunk)
+                    wanted -= len(chunk)
+                buffer = ''.join(parts)
+                continue
+            token, kind, end = result
+            if kind is not None and (comments or kind != PairDocTokenKind.COMMENT):
+                yield {'token': token, 'type': _TOKEN_TYPES[kind], 'position': base + currpos}
+            currpos = end
+
+    def scan_token(self, str, pos, final):
+        """
+        识别pos处的一个token，返回(token, kind, 结束位置)，空白的kind为None。
+        final为False时，可能被后续输入改变的token返回None表示需要更多输入；
+        final为True时返回None表示需要回退到PairDocLexer
+        """
+        m = _MASTER_PATTERN.match(str, pos)
+        end = m.end()
+        if not final and end + _STREAM_LOOKAHEAD > len(str):
+            return None
+        kind = m.lastgroup
+        if kind == 'space':
+            return None, None, end
+        if kind == 'identifier':
+            return m.group(), PairDocTokenKind.IDENTIFIER, end
+        if kind == 'operator':
+            return m.group(), PairDocTokenKind.SYMBOL, end
+        if kind == 'number':
+            return m.group(), PairDocTokenKind.NUMBER, end
+        if kind == 'comment':
+            if m.group() == '//':
+                end = _LINE_COMMENT_PATTERN.match(str, pos + 2).end()
+                if end == len(str) and not final:
+                    return None
+                return str[pos + 2:end], PairDocTokenKind.COMMENT, end
+            end = str.find('*/', pos + 2)
+            if end < 0:
+                if not final:
+                    return None
+                return str[pos + 2:], PairDocTokenKind.COMMENT, len(str)
+            return str[pos + 2:end], PairDocTokenKind.COMMENT, end + 2
+        if kind == 'string':
+            result = self.read_string_at(str, pos, m.group())
+            kind = PairDocTokenKind.STRING
+        else:
+            result = self.read_escaped(str, pos + 2, '"', ('"', '\\'))
+            kind = PairDocTokenKind.BASE64
+        if result is None:
+            return None
+        return result[0], kind, result[1]
+
+    def reference_tokenize(self, str, pos):
+        # PairDocLexer的结果只依赖于当前位置之后的文本，因此可以直接对剩余部分回退
+        tokens = PairDocLexer.tokenize(self, str[pos:])
+        for token in tokens:
+            token['position'] += pos
+        return tokens
+
+
 class PairDocTokenizer:
-    def __init__(self):
-        self.lexer = PairDocLexer()
+    def __init__(self, lexer=None):
+        # 默认使用PairDocFastLexer，传入PairDocLexer()可切换回参考实现
+        self.lexer = lexer if lexer is not None else PairDocFastLexer()
 
     def parse(self, text):
         tokens = self.lexer.tokenize(text)
         tokens = self.lexer.reject_comments(tokens)
-        return tokens
\ No newline at end of file
+        return tokens
+
+    def parse_stream(self, text):
+        # 返回不含注释的TokenStream
+        return self.lexer.tokenize_stream(text, comments=False)
+
+    def parse_buffer(self, buffer):
+        # 在UTF-8编码的bytes/mmap缓冲区上扫描，返回不含注释的TokenStream，位置为字节偏移
+        return self.lexer.tokenize_buffer(buffer, comments=False)
+
+    def iter_parse(self, source, chunk_size=65536):
+        # 从文件对象或chunk序列中逐个产出不含注释的token
+        return self.lexer.iter_tokenize(source, chunk_size=chunk_size, comments=False)
\ No newline at end of file
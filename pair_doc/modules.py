@@ -0,0 +1,270 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .lexer import PairDocTokenizer
+from .ast import Gather, PairDocPrecedenceParser, PairDocASTNode, PairDocASTNodeTypes
+from .html_builder import Context, Content, ContentTypes, build_content, build_html, module_scope, _MODULE_CALLS
+
+
+def _parse_module(data):
+    # 模块源码为UTF-8编码的bytes，语法树中的文本保留为指向它的SourceSpan
+    tokens = PairDocTokenizer().parse_buffer(data)
+    return PairDocPrecedenceParser(Gather(tokens).gather()).parse_doc()
+
+
+def _resolve_path(path, directory, root):
+    """模块路径path相对于directory解析为真实路径；绝对路径与解析后（含符号链接）不在root之下的路径抛出ValueError"""
+    if os.path.isabs(path) or os.path.splitdrive(path)[0]:
+        raise ValueError("Module path must be relative: ", path)
+    resolved = os.path.realpath(os.path.join(directory, path))
+    if os.path.commonpath((root, resolved)) != root:
+        raise ValueError("Module path outside the module root: ", path)
+    return resolved
+
+
+def _module_paths(ast, directory, root):
+    """语法树中以字面路径import/include的模块的真实路径（按出现顺序，不重复），不允许的路径留到load时再报错"""
+    paths = []
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, PairDocASTNode):
+            continue
+        children = node.children
+        if node.node_type == PairDocASTNodeTypes.FUNCTIONCALL:
+            func, args = children
+            if (isinstance(func, PairDocASTNode) and func.node_type == PairDocASTNodeTypes.VARIABLE and func.children in _MODULE_CALLS
+                    and isinstance(args, PairDocASTNode) and args.node_type == PairDocASTNodeTypes.TUPLE and len(args.children) == 1
+                    and isinstance(args.children[0], PairDocASTNode) and args.children[0].node_type == PairDocASTNodeTypes.TEXT):
+                try:
+                    path = _resolve_path(str(args.children[0].children), directory, root)
+                except ValueError:
+                    path = None
+                if path is not None and path not in paths:
+                    paths.append(path)
+        if isinstance(children, (PairDocASTNode, list)):
+            stack.append(children)
+        elif isinstance(children, tuple):
+            stack.extend(reversed(children))
+    return paths
+
+
+def _mentions_modules(source):
+    # 源码str或缓冲区中出现import或include时才可能有模块调用，其余文档不必遍历语法树
+    if isinstance(source, str):
+        return 'import' in source or 'include' in source
+    return source.find(b'import') >= 0 or source.find(b'include') >= 0
+
+
+def _stamp(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read(path):
+    # 返回(文件的(mtime, 大小), 内容)
+    with open(path, 'rb') as f:
+        stamp = _stamp(os.fstat(f.fileno()))
+        return stamp, f.read()
+
+
+class _ModuleContext(Context):
+    """模块顶层的上下文。模块求值结束后冻结，之后不能再绑定或赋值，可被多个文档同时读取"""
+    def __init__(self):
+        super().__init__(None)
+        self.frozen = False
+    def let(self, key, value):
+        if self.frozen:
+            raise ValueError("Cannot bind variables in an imported module")
+        self.vars[key] = value
+    def update(self, key, value):
+        if key not in self.vars:
+            raise ValueError("Variable not found")
+        if self.frozen:
+            raise ValueError("Cannot assign to an imported variable")
+        self.vars[key] = value
+    def get(self, key):
+        return self.vars.get(key)
+
+
+class PairDocModule:
+    """
+    已求值的模块：context为冻结的导出上下文（模块中定义的函数也在其中运行），
+    content为模块的输出，dependencies为求值时导入的模块
+    """
+    def __init__(self, path, stamp, digest, context, content, dependencies):
+        self.path = path
+        self.stamp = stamp
+        self.digest = digest
+        self.context = context
+        self.content = content
+        self.dependencies = dependencies
+        self._html = None
+
+    @property
+    def exports(self):
+        return self.context.vars
+
+    def html(self):
+        """模块输出的HTML，第一次用到时生成"""
+        if self._html is None:
+            self._html = build_html(self.content)
+        return self._html
+
+    def bind(self, context_vars:Context):
+        """
+        将导出绑定到context_vars中。值由所有导入者共用；块、元组等列表内容相加时会原地追加，
+        这些值绑定的是浅拷贝，导入者对它们做加法不影响模块与其它导入者
+        """
+        for key, value in self.context.vars.items():
+            if (isinstance(value, Content) and isinstance(value.content, list)
+                    and value.content_type != ContentTypes.FUNCTION):
+                value = value.copy()
+            context_vars.let(key, value)
+
+
+class PairDocModuleCache:
+    """
+    import/include的模块缓存，通过module_scope或build_doc(modules=...)启用。
+    只能导入root目录之下的文件：绝对路径，或解析符号链接后位于root之外的路径都会被拒绝。
+    同一文件只解析、求值一次，所有导入者共用同一个冻结的导出上下文；
+    文件的mtime或大小变化时重新读取，内容哈希也不同时才重新求值，导入的模块重新求值后导入它的模块也重新求值。
+    prefetch在求值前并发读取文档直接或间接引用的所有模块文件
+    """
+    def __init__(self, root, max_workers=8):
+        self.root = os.path.realpath(root)
+        self.max_workers = max_workers
+        self.hits = 0
+        self.misses = 0
+        self.modules = {} # 绝对路径 -> PairDocModule
+        self.prefetched = {} # 绝对路径 -> (文件的(mtime, 大小), 内容, 语法树)
+        self.lock = threading.Lock()
+        self.local = threading.local() # loading：当前线程中正在求值的模块路径及其依赖，用于发现循环导入
+
+    def __len__(self):
+        return len(self.modules)
+
+    def clear(self):
+        with self.lock:
+            self.modules.clear()
+            self.prefetched.clear()
+
+    def _current(self, module):
+        # 模块与其依赖的文件都未改变，且依赖仍是缓存中的模块
+        stack = [module]
+        seen = set()
+        while stack:
+            module = stack.pop()
+            if module.path in seen:
+                continue
+            seen.add(module.path)
+            try:
+                if _stamp(os.stat(module.path)) != module.stamp:
+                    return False
+            except OSError:
+                return False
+            for dependency in module.dependencies:
+                if self.modules.get(dependency.path) is not dependency:
+                    return False
+                stack.append(dependency)
+        return True
+
+    def prefetch(self, ast, directory=None):
+        """
+        并发读取并解析ast中以字面路径导入的模块，以及它们导入的模块（逐层进行），
+        结果留给之后的load使用；已缓存且未改变的模块不再读取。读取或解析出错的模块留到load时再报错。
+        相对路径相对于directory，默认为root
+        """
+        pending = _module_paths(ast, directory if directory is not None else self.root, self.root)
+        seen = set()
+        while pending:
+            paths = []
+            for path in pending:
+                if path in seen:
+                    continue
+                seen.add(path)
+                with self.lock:
+                    module = self.modules.get(path)
+                if module is None or not self._current(module):
+                    paths.append(path)
+            if not paths:
+                break
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as pool:
+                results = list(pool.map(self._prefetch_one, paths))
+            pending = []
+            for path, result in zip(paths, results):
+                if result is None:
+                    continue
+                with self.lock:
+                    self.prefetched[path] = result
+                pending.extend(_module_paths(result[2], os.path.dirname(path), self.root))
+
+    def _prefetch_one(self, path):
+        try:
+            stamp, data = _read(path)
+            return stamp, data, _parse_module(data)
+        except Exception:
+            return None
+
+    def _loading(self):
+        loading = getattr(self.local, 'loading', None)
+        if loading is None:
+            loading = self.local.loading = []
+        return loading
+
+    def load(self, path, directory=None):
+        """返回路径对应的PairDocModule，未缓存或已改变时读取并求值；path相对于directory（默认为root）"""
+        module = self._load(_resolve_path(path, directory if directory is not None else self.root, self.root))
+        loading = self._loading()
+        if loading:
+            loading[-1][1].append(module) # 记为正在求值的模块的依赖
+        return module
+
+    def _load(self, path):
+        if any(path == p for p, _ in self._loading()):
+            raise ValueError("Circular import: ", path)
+        with self.lock:
+            module = self.modules.get(path)
+            prefetched = self.prefetched.pop(path, None)
+        if module is not None and self._current(module):
+            self.hits += 1
+            return module
+        return self._reload(path, module, prefetched)
+
+    def _reload(self, path, module, prefetched):
+        stamp = _stamp(os.stat(path))
+        if prefetched is not None and prefetched[0] == stamp:
+            stamp, data, ast = prefetched
+        else:
+            stamp, data = _read(path)
+            ast = None
+        digest = hashlib.sha256(data).hexdigest()
+        if module is not None and module.digest == digest and all(
+                self._load(d.path) is d for d in module.dependencies):
+            module.stamp = stamp # 模块与其依赖的内容都没有改变
+            self.hits += 1
+            return module
+        self.misses += 1
+        if ast is None:
+            ast = _parse_module(data)
+        directory = os.path.dirname(path)
+        if _mentions_modules(data):
+            self.prefetch(ast, directory)
+        context = _ModuleContext()
+        dependencies = []
+        loading = self._loading()
+        loading.append((path, dependencies))
+        try:
+            with module_scope(self, directory):
+                # 顶层各项直接在导出上下文中求值
+                items = [build_content(c, context_vars=context) for c in ast.children]
+        finally:
+            loading.pop()
+        context.frozen = True
+        module = PairDocModule(path, stamp, digest, context, Content(ContentTypes.BLOCK, items), dependencies)
+        with self.lock:
+            self.modules[path] = module
+        return module
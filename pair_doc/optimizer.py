@@ -0,0 +1,193 @@
+from .ast import PairDocASTNode, PairDocASTNodeTypes
+from .html_builder import Context, build_content, build_html
+
+_STYLE = PairDocASTNodeTypes.STYLE
+_TEXT = PairDocASTNodeTypes.TEXT
+_VARIABLE = PairDocASTNodeTypes.VARIABLE
+_DOC = PairDocASTNodeTypes.DOC
+_OPERATION = PairDocASTNodeTypes.OPERATION
+_NUMBER = PairDocASTNodeTypes.NUMBER
+_NONE = PairDocASTNodeTypes.NONE
+_SINGLE_TYPES = (PairDocASTNodeTypes.UNFUNCTIONAL, PairDocASTNodeTypes.NEVERRETURN)
+_LIST_TYPES = (PairDocASTNodeTypes.DOC, PairDocASTNodeTypes.SEPARATOR, PairDocASTNodeTypes.TUPLE)
+_PAIR_TYPES = (PairDocASTNodeTypes.LET, PairDocASTNodeTypes.ASSIGN, PairDocASTNodeTypes.KEYVAL,
+               PairDocASTNodeTypes.FUNCTIONDEF, PairDocASTNodeTypes.FUNCTIONCALL)
+# 子节点都不依赖变量时自身也不依赖变量的节点类型；其余类型（绑定、函数定义与调用等）总是按需求值
+_COMPOSITE_TYPES = (_STYLE, _OPERATION, PairDocASTNodeTypes.KEYVAL) + _SINGLE_TYPES + _LIST_TYPES
+_LEAF_TYPES = (_TEXT, _NUMBER, _NONE)
+
+
+def _subnodes(node):
+    # 节点的直接子节点；结构不完整时抛出异常
+    node_type = node.node_type
+    children = node.children
+    if node_type in _LIST_TYPES:
+        if children.__class__ is not list:
+            raise TypeError('Invalid children')
+        return children
+    if node_type is _STYLE:
+        style, args, body = children
+        return [style, body] if args is None else [style, args, body]
+    if node_type in _SINGLE_TYPES:
+        return [children]
+    if node_type is _OPERATION:
+        left, op, right = children
+        return [left, right]
+    if node_type in _PAIR_TYPES:
+        first, second = children
+        return [first, second]
+    return []
+
+
+def _analyze(root):
+    """
+    自底向上找出不依赖变量的子树，返回(id(节点) -> 读取的变量名集合, 文档中绑定的变量名)，依赖变量的节点为None。
+    这些子树只读取变量（不绑定、不调用函数），变量都未绑定时结果固定：内置变量得到对应的文本，其余变量得到变量名
+    """
+    info = {}
+    bound = set()
+    empty = frozenset()
+    singles = {} # 变量名 -> 只含该名字的集合，相同的集合共用一个对象
+    # 两个并行的栈：节点，以及已展开节点的子节点列表（未展开时为None）
+    stack = [root]
+    expanded = [None]
+    while stack:
+        node = stack.pop()
+        subnodes = expanded.pop()
+        if subnodes is None:
+            if node.__class__ is not PairDocASTNode or id(node) in info:
+                continue
+            try:
+                subnodes = _subnodes(node)
+            except Exception:
+                info[id(node)] = None
+                continue
+            if subnodes:
+                stack.append(node)
+                expanded.append(subnodes)
+                stack.extend(subnodes)
+                expanded.extend([None] * len(subnodes))
+                continue
+        node_type = node.node_type
+        if node_type in _PAIR_TYPES:
+            key = subnodes[0]
+            if key.__class__ is PairDocASTNode and (key.node_type is _VARIABLE or key.node_type is _TEXT):
+                bound.add(str(key.children))
+        if node_type in _LEAF_TYPES:
+            names = empty
+        elif node_type is _VARIABLE:
+            if node.children == '$':
+                names = None
+            else:
+                name = str(node.children)
+                names = singles.get(name)
+                if names is None:
+                    names = singles[name] = frozenset((name,))
+        elif node_type in _COMPOSITE_TYPES:
+            names = empty
+            for c in subnodes:
+                c_names = info.get(id(c)) if c.__class__ is PairDocASTNode else None
+                if c_names is None:
+                    names = None
+                    break
+                if c_names is names or c_names <= names:
+                    continue
+                names = c_names if names <= c_names else names | c_names
+        else:
+            names = None
+        info[id(node)] = names
+    return info, bound
+
+
+def _prerender(node):
+    # 在空上下文中求值并输出；出错时返回None，留到运行时按原样出错
+    try:
+        return build_html(build_content(node, context_vars=Context()))
+    except Exception:
+        return None
+
+
+def _static_names(node, info, bound):
+    # 不依赖变量的子树读取的变量名；读取文档中绑定的变量名时视为依赖变量，返回None
+    names = info.get(id(node)) if node.__class__ is PairDocASTNode else None
+    if names is None or not names.isdisjoint(bound):
+        return None
+    return names
+
+
+def _doc_plan(children, info, bound):
+    """
+    文档各项的输出方案：依赖变量的项原样保留，相邻的不依赖变量的项合并为
+    (HTML, 读取的变量名, 原节点列表)，HTML中已包含项之间的空格
+    """
+    plan = []
+    run_html, run_names, run_nodes = [], frozenset(), []
+    for c in children:
+        names = _static_names(c, info, bound)
+        html = _prerender(c) if names is not None else None
+        if html is not None:
+            run_html.append(html)
+            run_names |= names
+            run_nodes.append(c)
+            continue
+        if run_nodes:
+            plan.append((' '.join(run_html), tuple(run_names), run_nodes))
+            run_html, run_names, run_nodes = [], frozenset(), []
+        plan.append(c)
+    if run_nodes:
+        plan.append((' '.join(run_html), tuple(run_names), run_nodes))
+    return plan
+
+
+def _style_plan(node, info, bound):
+    # 样式名与参数不依赖变量时预先输出开始与结束标签：(开始标签, 结束标签, 读取的变量名)
+    style, args, body = node.children
+    names = _static_names(style, info, bound)
+    if names is None:
+        return None
+    if args is not None:
+        args_names = _static_names(args, info, bound)
+        if args_names is None:
+            return None
+        names = names | args_names
+    try:
+        context = Context()
+        style = build_html(build_content(style, context_vars=context))
+        args = build_content(args, context_vars=context) if args is not None else None
+        if args is not None:
+            return (f'<{style} {build_html(args)}>', f'</{style}>', tuple(names))
+        return (f'<{style}>', f'</{style}>', tuple(names))
+    except Exception:
+        return None
+
+
+def optimize_ast(ast):
+    """
+    为多次输出的语法树（如render_html反复输出的同一语法树、编译的模板）准备语法树并返回它：不依赖变量的子树预先输出为HTML，
+    文档中相邻的不依赖变量的项（文本、内置变量、原始HTML、只含这些的样式块等）合并为一段HTML，
+    样式名与参数不依赖变量时预先生成标签。结果作为render_plan保存在文档与样式节点上，
+    输出时只在所读取的变量都未绑定时使用，语法树本身与build_content的结果不变。
+    分析与预先输出的开销与一次输出相当，只输出一次的语法树（build_doc）不做这一步
+    """
+    info, bound = _analyze(ast)
+    stack = [ast]
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if node.__class__ is not PairDocASTNode or id(node) in seen:
+            continue
+        seen.add(id(node))
+        try:
+            subnodes = _subnodes(node)
+        except Exception:
+            continue
+        if node.node_type is _DOC:
+            plan = _doc_plan(node.children, info, bound)
+            node.render_plan = plan
+            # 合并了的项不会单独输出，只在变量被绑定而回退时按普通方式求值
+            stack.extend([item for item in plan if item.__class__ is PairDocASTNode])
+            continue
+        if node.node_type is _STYLE:
+            node.render_plan = _style_plan(node, info, bound)
+        stack.extend(subnodes)
+    return ast
@@ -1,14 +1,59 @@
 from .lexer import PairDocTokenizer
-from .ast import Gather, PairDocASTParser
-from .html_builder import build_content, build_html
-def build_doc(doc):
+from .ast import Gather, PairDocPrecedenceParser
+from .html_builder import render_html, function_cache_scope, module_scope
+from .arena import PairDocASTArena
+from .modules import _mentions_modules
+import os
+import mmap
+
+def build_doc(doc, output=None, parser_class=PairDocPrecedenceParser, cache=None, function_cache=None, modules=None, base_dir=None):
+    """
+    doc可以是源码str、UTF-8编码的bytes/bytearray/mmap缓冲区，或文件路径（os.PathLike，将被内存映射）。
+    给定output（二进制文件对象或文本流）时HTML逐段写入output并返回None（求值出错时已写出的部分保留），
+    写入二进制文件时源码中不含转义的字符串与原始HTML块从缓冲区直接写出。
+    parser_class可选PairDocPrecedenceParser（默认）或PairDocASTParser，两者生成相同的语法树。
+    给定cache（PairDocASTCache）时按源码哈希读取缓存的语法树，命中则跳过词法与语法分析；
+    给定function_cache（PairDocFunctionCache）时纯函数的调用结果从中读取。
+    给定modules（PairDocModuleCache）时文档可以import/include其root目录之下的模块，求值前并发读取所有引用的模块文件；
+    模块的相对路径相对于base_dir，默认为doc所在目录（doc为路径时）或modules的root。未给定modules时import/include抛出异常
+    """
+    if isinstance(doc, os.PathLike):
+        if base_dir is None:
+            base_dir = os.path.dirname(os.path.abspath(doc))
+        with open(doc, 'rb') as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # 空文件无法映射
+                buffer = b''
+        try:
+            return build_doc(buffer, output, parser_class, cache, function_cache, modules, base_dir)
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+    if cache is not None:
+        key = cache.key(doc, parser_class.__name__)
+        arena = cache.get(key)
+        if arena is not None:
+            ast = arena.to_node(doc.encode('utf-8') if isinstance(doc, str) else doc) # 缓存的语法树可能来自同一内容的缓冲区
+        else:
+            ast = parse_doc(doc, parser_class)
+            cache.put(key, PairDocASTArena.from_node(ast))
+    else:
+        ast = parse_doc(doc, parser_class)
+    if modules is not None and _mentions_modules(doc):
+        modules.prefetch(ast, base_dir)
+    with function_cache_scope(function_cache), module_scope(modules, base_dir):
+        return render_html(ast, output)
+
+
+def parse_doc(doc, parser_class=PairDocPrecedenceParser):
+    """将源码str或UTF-8编码的缓冲区解析为DOC语法树"""
     tokenizer = PairDocTokenizer()
-    tokens = tokenizer.parse(doc)
+    if isinstance(doc, str):
+        tokens = tokenizer.parse_stream(doc)
+    else:
+        tokens = tokenizer.parse_buffer(doc)
     gather = Gather(tokens)
     gathered = gather.gather()
-    parser = PairDocASTParser(gathered)
-    ast = parser.parse_doc()
-    content = build_content(ast)
-    html = build_html(content)
-    return html
-
+    parser = parser_class(gathered)
+    return parser.parse_doc()
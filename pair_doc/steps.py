@@ -0,0 +1,45 @@
+import types
+
+_GENERATOR = types.GeneratorType
+
+def run_steps(steps):
+    """
+    运行生成器steps并返回其结果，以显式栈代替递归。
+    生成器产出另一个生成器表示需要它的结果：该生成器运行结束后，其返回值作为产出表达式的值送回；
+    其中抛出的异常在产出处重新抛出，与直接递归调用时相同。产出的不是生成器时原样送回，用于已知结果的步骤。
+    嵌套深度只受内存限制，每层只保留一个生成器；steps本身不是生成器时就是结果
+    """
+    if steps.__class__ is not _GENERATOR:
+        return steps
+    stack = [steps]
+    top = steps
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                request = top.send(value)
+                while request.__class__ is not _GENERATOR:
+                    request = top.send(request)
+            else:
+                e, error = error, None
+                request = top.throw(e)
+                while request.__class__ is not _GENERATOR:
+                    request = top.send(request)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value
+            top = stack[-1]
+            value = stop.value
+            continue
+        except BaseException as e:
+            stack.pop()
+            if not stack:
+                raise
+            top = stack[-1]
+            error = e
+            continue
+        stack.append(request)
+        top = request
+        value = None
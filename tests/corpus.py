@@ -0,0 +1,46 @@
+# 测试共用的文档：覆盖各类节点、绑定与赋值、别名与原地追加、出错的文档等
+import inspect
+import pair_doc._test as _test
+
+SAMPLE = inspect.getsource(_test.test).split('"""')[1]
+
+DOCS = [
+    SAMPLE,
+    "#!f := (n:0, acc:'')->{ #acc } #f(n:3, acc:'x')",
+    "#a:=1 #b:=a+2 #c:=(1,2,3) #c[1] #c.0 #(x:1, y:2).y #!d:={1 2} #d+3 #d",
+    "#x:=(p:1,q:2) #x.r",
+    "#y",
+    "#!z:=(a:1,b:2)->{#a + b} #z(5) #z(b:7, 1) #z(1,2,3)",
+    "#span[q]{#t} #'div'['id=\"1\"']{ 'a' ; 'b' } #n; #s",
+    "#k := 'a' #k = k + 'b' #k #j = 1",
+    "#(1,2)->{#x} #!g:=(a:1,b:2)->{#span{#a}} #g(g(1))",
+    "#!l := {'a'} #l + 'b' #l",
+    "#!t := (1, 2) #t #t + 3 #span{#t}",
+    "#!m := {'x'} #div[m]{#m} #m + 'y'",
+    "#!o := (1, 2) #!p := o #p + 3 #o",
+    "#span[q := 'c']{#q} #q",
+    "#!w := 1 #span[w = 'c']{#w} #w",
+    "#(a:1) #;",
+    "#f(1)",
+    "'''<b>raw</b>''' \"esc\\naped\" 'plain' 1.5 2e3 #@linebreak #tab #quot",
+    "#!r := (a:1, b:2, c:3, d:4, e:5, f:6, g:7, h:8, i:9) #r.i #r.a #r + (j:10) #r.j",
+    "#!h := (text:'', color:'red')->{#span['style=\"color:' + color + '\"']{#text}} #h('x') #h(color:'blue', text:'y')",
+]
+
+
+def deep_docs(depth):
+    """嵌套depth层的样式、元组与函数调用"""
+    return [
+        "#div{" * depth + "'deep' #n" + "}" * depth,
+        "#(" * depth + "'t'" + ")" * depth,
+        "#!f := (a:0, b:0)->{#span{#a}} " + "#f(" * depth + "1" + ")" * depth,
+        "#!v := 'k' " + "#div{" * depth + "#v #!v := 'j' #v #v = 'i' #v" + "}" * depth + " #v",
+    ]
+
+
+def outcome(f):
+    """f的结果，出错时为(异常类型, 消息)，用于比较两条路径的行为"""
+    try:
+        return f()
+    except Exception as e:
+        return type(e), str(e)
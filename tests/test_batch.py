@@ -0,0 +1,41 @@
+import os
+import multiprocessing
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from pair_doc import build_doc, build_docs
+import pair_doc.batch as batch
+from corpus import DOCS, outcome
+
+
+def built(result):
+    return result.html if result.ok else (type(result.error), str(result.error))
+
+
+@pytest.mark.parametrize('workers, ordered', [(1, True), (2, True), (2, False)])
+def test_matches_build_doc(workers, ordered):
+    results = list(build_docs(DOCS, workers=workers, chunksize=3, ordered=ordered))
+    if ordered:
+        assert [result.index for result in results] == list(range(len(DOCS)))
+    results.sort(key=lambda result: result.index)
+    assert [built(result) for result in results] == [outcome(lambda: build_doc(doc)) for doc in DOCS]
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='替换的build_doc需要由工作进程继承')
+@pytest.mark.parametrize('ordered', [True, False])
+def test_worker_exit(ordered, monkeypatch):
+    # 工作进程直接退出时不会一直等待：受影响的文档报告BrokenProcessPool，之后的文档在新的进程池中构建
+    def exiting_build_doc(source, **kwargs):
+        if source == 'exit':
+            os._exit(1)
+        return build_doc(source, **kwargs)
+    monkeypatch.setattr(batch, 'build_doc', exiting_build_doc)
+    sources = ['#a := 1 #a'] * 4 + ['exit'] + ['#span{x}'] * 20
+    results = sorted(build_docs(sources, workers=2, chunksize=1, ordered=ordered), key=lambda result: result.index)
+    assert [result.index for result in results] == list(range(len(sources)))
+    assert isinstance(results[4].error, BrokenProcessPool)
+    for result in results:
+        if result.ok:
+            assert result.html == build_doc(sources[result.index])
+        else:
+            assert isinstance(result.error, BrokenProcessPool)
+    assert results[-1].ok
@@ -0,0 +1,111 @@
+import os
+import zlib
+import struct
+import pytest
+from pair_doc import PairDocASTCache, PairDocPrecedenceParser, build_doc, parse_doc
+from pair_doc.arena import PairDocASTArena
+from corpus import DOCS, SAMPLE, outcome
+
+
+def entry(payload):
+    return struct.pack('<I', zlib.crc32(payload)) + payload
+
+
+def flipped(data, i):
+    data = bytearray(data)
+    data[i] ^= 0x40
+    return bytes(data)
+
+
+ARENA = PairDocASTArena.from_node(parse_doc(SAMPLE)).to_bytes()
+
+# 损坏的缓存文件：截断、校验和不符，以及校验和正确但内容截断或不合法
+CORRUPTED = {
+    'empty': b'',
+    'short': b'\x01\x02',
+    'truncated': entry(ARENA)[:len(ARENA) // 2],
+    'checksum': flipped(entry(ARENA), 0),
+    'payload': flipped(entry(ARENA), len(ARENA) // 2),
+    'header only': entry(ARENA[:28]),
+    'truncated arena': entry(ARENA[:-1]),
+    'garbage': entry(b'PDA1' + bytes(range(256)) * 4),
+}
+
+
+def test_cached_build_matches(tmp_path):
+    cache = PairDocASTCache(tmp_path)
+    expected = [outcome(lambda: build_doc(doc)) for doc in DOCS]
+    assert [outcome(lambda: build_doc(doc, cache=cache)) for doc in DOCS] == expected
+    misses = cache.misses
+    assert [outcome(lambda: build_doc(doc, cache=cache)) for doc in DOCS] == expected
+    assert cache.misses == misses and cache.hits == len(DOCS)
+
+
+@pytest.mark.parametrize('name', CORRUPTED)
+def test_corrupted_entry_is_a_miss(tmp_path, name):
+    cache = PairDocASTCache(tmp_path)
+    key = cache.key(SAMPLE, PairDocPrecedenceParser.__name__)
+    path = os.path.join(cache.directory, key + '.pdast')
+    with open(path, 'wb') as f:
+        f.write(CORRUPTED[name])
+    assert cache.get(key) is None
+    assert cache.misses == 1 and not os.path.exists(path)
+    # 之后的构建重新解析并写入新的缓存
+    assert build_doc(SAMPLE, cache=cache) == build_doc(SAMPLE)
+    assert cache.get(key) is not None
+
+
+def test_eviction_bounds_size(tmp_path):
+    cache = PairDocASTCache(tmp_path, max_bytes=4 * (len(ARENA) + 4))
+    arena = PairDocASTArena.from_bytes(ARENA)
+    for i in range(20):
+        cache.put('%04d' % i, arena)
+        assert cache.total <= cache.max_bytes
+    assert sum(entry.stat().st_size for entry in os.scandir(tmp_path)) <= cache.max_bytes
+    assert cache.get('0019') is not None and cache.get('0000') is None
+
+
+@pytest.mark.parametrize('doc', DOCS + [SAMPLE, "#'中文' #“引号” #a.b"])
+def test_arena_round_trip(doc):
+    expected = str(parse_doc(doc))
+    arena = PairDocASTArena.from_bytes(PairDocASTArena.from_node(parse_doc(doc)).to_bytes())
+    assert str(arena.to_node()) == expected
+    # 由缓冲区解析时文本只存字节区间，还原时需要源码
+    buffer = doc.encode('utf-8')
+    data = PairDocASTArena.from_node(parse_doc(buffer)).to_bytes()
+    assert str(PairDocASTArena.from_bytes(data).to_node(buffer)) == expected
+    assert PairDocASTArena.from_bytes(bytearray(data)).to_bytes() == data
+    if any(s >= 0 for s in PairDocASTArena.from_bytes(data).span_starts):
+        with pytest.raises(ValueError, match='source buffer'):
+            PairDocASTArena.from_bytes(data).to_node()
+
+
+def patched(arena, name, index, value):
+    arena = PairDocASTArena.from_bytes(arena.to_bytes())
+    getattr(arena, name)[index] = value
+    return arena.to_bytes()
+
+
+def test_arena_rejects_malformed_data():
+    arena = PairDocASTArena.from_node(parse_doc("#a := 'x' #span{#a}"))
+    data = arena.to_bytes()
+    size = len(arena)
+    malformed = [data[:i] for i in range(len(data))] + [data + b'\0', b'PDA2' + data[4:]]
+    malformed += [
+        patched(arena, 'types', 1, 99),
+        patched(arena, 'shapes', 0, 9),
+        patched(arena, 'firsts', 0, size),
+        patched(arena, 'counts', 0, -1),
+        patched(arena, 'counts', 0, size),
+        patched(arena, 'payloads', arena.payloads.index(0), len(arena.strings)),
+        patched(arena, 'payloads', arena.payloads.index(0), -2),
+    ]
+    # 字符串数据不是合法的UTF-8
+    blob = ''.join(arena.strings).encode('utf-8')
+    malformed.append(data[:len(data) - len(blob)] + b'\xff' * len(blob))
+    # 字符串长度为负、总长度不变
+    lengths = len(data) - len(blob) - 8 * len(arena.strings)
+    malformed.append(data[:lengths] + struct.pack('=qq', -1, len(blob) + 1) + data[lengths + 16:])
+    for item in malformed:
+        with pytest.raises(ValueError, match='Invalid AST arena data'):
+            PairDocASTArena.from_bytes(item)
@@ -0,0 +1,52 @@
+import io
+import types
+import pytest
+from pair_doc import (parse_doc, build_doc, build_content, build_html, optimize_ast, generate_module, compile_template,
+                      PairDocFunctionCache, PairDocModuleCache)
+from corpus import DOCS, deep_docs, outcome
+
+
+def load(ast):
+    module = types.ModuleType('pair_doc_template_test')
+    exec(compile(generate_module(ast), module.__name__, 'exec'), module.__dict__)
+    return module
+
+
+def render_to(module, output, **kwargs):
+    module.render(output, **kwargs)
+    value = output.getvalue()
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('doc', DOCS + deep_docs(200))
+def test_generated_module_matches_interpreter(doc, optimize):
+    ast = parse_doc(doc)
+    expected = outcome(lambda: build_doc(doc))
+    module = load(optimize_ast(ast) if optimize else ast)
+    assert outcome(lambda: build_html(module.build_content())) == outcome(lambda: build_html(build_content(ast)))
+    assert outcome(module.render) == expected
+    assert outcome(lambda: module.render(function_cache=PairDocFunctionCache())) == expected
+    if not isinstance(expected, tuple):
+        assert render_to(module, io.StringIO()) == expected
+        assert render_to(module, io.BytesIO()) == expected
+
+
+def test_generate_module_deep():
+    # 生成代码不受Python调用栈限制
+    doc = deep_docs(20000)[0]
+    assert 'def _render0(ctx, out):' in generate_module(parse_doc(doc))
+
+
+def test_compiled_template_imports(tmp_path):
+    # 导入的模块中定义的函数（函数体为语法树）与生成的函数可以互相调用
+    (tmp_path / 'lib.pd').write_text("#!greet := (name:'', tag:'b')->{#tag{#name}} #!title := 'T'", encoding='utf-8')
+    doc = ("#import('lib.pd') #greet('x') #title #!wrap := (f:0, v:'')->{#i{#f(v)}} #wrap(greet, 'y') "
+           "#include('lib.pd') #!import := 3 #import")
+    expected = build_doc(doc, modules=PairDocModuleCache(tmp_path))
+    module = compile_template(doc, tmp_path / 'tpl.py')
+    assert module.render(modules=PairDocModuleCache(tmp_path)) == expected
+    assert render_to(module, io.StringIO(), modules=PairDocModuleCache(tmp_path)) == expected
+    assert module.render(function_cache=PairDocFunctionCache(), modules=PairDocModuleCache(tmp_path)) == expected
+    with pytest.raises(ValueError, match='Module imports are not enabled'):
+        module.render()
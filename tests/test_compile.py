@@ -0,0 +1,52 @@
+import pytest
+from pair_doc import parse_doc, build_content, compile_content, build_html, optimize_ast, function_cache_scope, PairDocFunctionCache
+from pair_doc.html_builder import Context, Content, ContentTypes
+from corpus import DOCS, deep_docs, outcome
+
+# 编译时能确定绑定与不能确定绑定的变量、遮蔽外层变量与闭包
+EXTRA = [
+    "#!a := 1 #!f := (x:0, y:0)->{#a + x} #f(2) #!a := 5 #f(2) #a = 7 #f(2)",
+    "#!n := 'o' #div{#!n := 'i' #n #n = n + 'j' #n} #n",
+    "#!g := (x:0, y:0)->{#!h := (p:0, q:0)->{#x + p} #h(10)} #g(1) #g(2)",
+    "#span{#undefined}",
+    "#v + 1",
+]
+
+
+def built(run, *args):
+    return build_html(run(*args))
+
+
+@pytest.mark.parametrize('optimize', [False, True])
+@pytest.mark.parametrize('doc', DOCS + EXTRA + deep_docs(100))
+def test_compiled_matches_build_content(doc, optimize):
+    ast = parse_doc(doc)
+    if optimize:
+        ast = optimize_ast(ast)
+    expected = outcome(lambda: built(build_content, ast))
+    run = outcome(lambda: compile_content(ast))
+    if isinstance(run, tuple):
+        # 编译时发现的错误与求值时的相同
+        assert run == expected
+        return
+    assert outcome(lambda: built(run)) == expected
+    # 可重复运行，每次运行互不影响
+    assert outcome(lambda: built(run)) == expected
+    with function_cache_scope(PairDocFunctionCache()):
+        assert outcome(lambda: built(run)) == expected
+
+
+@pytest.mark.parametrize('doc', ["#v #w", "#v = v + 'x' #v", "#!f := (a:0, b:0)->{#v} #f(1)"])
+def test_compiled_with_context(doc):
+    # 未在文档中绑定的变量从传入的上下文中查找，赋值写回该上下文
+    ast = parse_doc(doc)
+    run = compile_content(ast)
+
+    def context():
+        ctx = Context()
+        ctx.let('v', Content(ContentTypes.TEXT, 'outer'))
+        ctx.let('w', Content(ContentTypes.INT, 3))
+        return ctx
+    expected_ctx, ctx = context(), context()
+    assert build_html(run(ctx)) == build_html(build_content(ast, context_vars=expected_ctx))
+    assert build_html(ctx.get('v')) == build_html(expected_ctx.get('v'))
@@ -0,0 +1,58 @@
+import pytest
+from pair_doc import build_doc, PairDocFunctionCache
+from pair_doc.html_builder import Content, Context, ContentTypes
+from corpus import DOCS, outcome
+
+PURE = "#!f := (a:0, b:'')->{#span{#a + 1 #b}} #f(1, 'x') #f(2, 'y')"
+
+
+def test_hits_across_builds():
+    # 每次构建都重新解析并创建新的函数，结构相同的函数共用缓存项
+    cache = PairDocFunctionCache()
+    expected = build_doc(PURE)
+    assert build_doc(PURE, function_cache=cache) == expected
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert build_doc(PURE, function_cache=cache) == expected
+    assert (cache.hits, cache.misses) == (2, 2)
+    # 位置不同、格式不同的同一函数也能命中
+    assert build_doc("\n\n  " + PURE.replace(':=', ' := '), function_cache=cache) == build_doc("\n\n  " + PURE)
+    assert cache.hits == 4
+
+
+@pytest.mark.parametrize('docs', [
+    # 读取的外部变量不同
+    ["#!c := 1 #!f := (a:0, b:0)->{#a + c} #f(1)", "#!c := 5 #!f := (a:0, b:0)->{#a + c} #f(1)"],
+    # 函数体不同
+    ["#!f := (a:0, b:0)->{#a + 1} #f(1)", "#!f := (a:0, b:0)->{#a + 2} #f(1)"],
+    # 被调用的函数的默认值与形参顺序不同
+    ["#!g := (p:1, q:0)->{#p} #!f := (a:0, b:0)->{#g()} #f(1)", "#!g := (p:2, q:0)->{#p} #!f := (a:0, b:0)->{#g()} #f(1)"],
+    ["#!g := (p:1, q:2)->{#p} #!f := (a:0, b:0)->{#g(a)} #f(7)", "#!g := (q:2, p:1)->{#p} #!f := (a:0, b:0)->{#g(a)} #f(7)"],
+    # 文本与数字
+    ["#!f := (a:0, b:0)->{#a + a} #f(1)", "#!f := (a:0, b:0)->{#a + a} #f('1')"],
+])
+def test_no_false_hits(docs):
+    cache = PairDocFunctionCache()
+    for doc in docs + docs:
+        assert outcome(lambda: build_doc(doc, function_cache=cache)) == outcome(lambda: build_doc(doc))
+
+
+def test_entries_do_not_hold_functions():
+    cache = PairDocFunctionCache()
+    build_doc("#!c := 1 #!g := (p:0, q:0)->{#p + c} #!f := (a:0, b:0)->{#g(a)} #f(1) #span{#f(2)}", function_cache=cache)
+    assert len(cache) == 4 # f与g各两次调用
+    stack = list(cache.entries.items())
+    while stack:
+        item = stack.pop()
+        assert not isinstance(item, Context)
+        if isinstance(item, Content):
+            assert item.content_type != ContentTypes.FUNCTION
+        elif isinstance(item, tuple):
+            stack.extend(item)
+
+
+def test_shared_cache_over_corpus():
+    cache = PairDocFunctionCache()
+    expected = [outcome(lambda: build_doc(doc)) for doc in DOCS]
+    for _ in range(2):
+        assert [outcome(lambda: build_doc(doc, function_cache=cache)) for doc in DOCS] == expected
+    assert cache.hits
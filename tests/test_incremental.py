@@ -0,0 +1,75 @@
+import random
+import pytest
+from pair_doc import PairDocDocument, parse_doc
+import pair_doc.incremental as incremental
+from corpus import DOCS, deep_docs, outcome
+
+# 插入的片段：语句边界、括号、引号、注释与普通文本
+FRAGMENTS = ['#', '# ', '{', '}', '(', ')', '[', ']', "'", '"', ',', ';', ':=', '+', '//', '/*', '*/',
+             ' ', '\n', 'x', '12', '#a ', '#!', '#span{#b}', "#f(1, 'y')", '#(1, 2)', '']
+
+
+def full_parse(text):
+    return str(parse_doc(text))
+
+
+def random_edits(document, rng, count):
+    for _ in range(count):
+        text = document.text
+        offset = rng.randint(0, len(text))
+        removed = min(rng.choice((0, 0, 1, 2, 5)), len(text) - offset)
+        inserted = rng.choice(FRAGMENTS)
+        new_text = text[:offset] + inserted + text[offset + removed:]
+        yield offset, removed, inserted, new_text
+
+
+@pytest.mark.parametrize('chunk', [incremental._CHUNK, 2])
+@pytest.mark.parametrize('source', DOCS + deep_docs(20))
+def test_edits_match_full_parse(source, chunk, monkeypatch):
+    # 块很小时每次修改都会拆分与合并块
+    monkeypatch.setattr(incremental, '_CHUNK', chunk)
+    rng = random.Random(source)
+    document = PairDocDocument(source)
+    assert str(document.ast) == full_parse(source)
+    for offset, removed, inserted, new_text in random_edits(document, rng, 60):
+        result = outcome(lambda: str(document.apply_edit(offset, removed, inserted)))
+        assert document.text == new_text
+        assert result == outcome(lambda: full_parse(new_text)), (offset, removed, inserted)
+
+
+def test_edits_on_long_document():
+    # 跨越多个分块的文档：在开头、中间与末尾修改，并删除整段语句
+    source = ' '.join(f"#v{i} := {i} #span{{#v{i}}}" for i in range(2000))
+    document = PairDocDocument(source)
+    rng = random.Random(0)
+    edits = [(0, 0, '#!z := 1 '), (len(source) // 2, 0, '#div{'), (len(source) // 2 + 5, 0, '}'),
+             (len(source), 0, ' #end'), (100, 3000, ''), (0, 50, '#(')]
+    for offset, removed, inserted in edits:
+        new_text = document.text[:offset] + inserted + document.text[offset + removed:]
+        result = outcome(lambda: str(document.apply_edit(offset, removed, inserted)))
+        assert result == outcome(lambda: full_parse(new_text))
+    for offset, removed, inserted, new_text in random_edits(document, rng, 200):
+        result = outcome(lambda: str(document.apply_edit(offset, removed, inserted)))
+        assert result == outcome(lambda: full_parse(new_text)), (offset, removed, inserted)
+
+
+def test_empty_and_invalid_edits():
+    document = PairDocDocument('')
+    assert str(document.apply_edit(0, 0, '#a #b')) == full_parse('#a #b')
+    assert str(document.apply_edit(0, 5, '  ')) == full_parse('  ')
+    assert str(document.apply_edit(2, 0, '#c')) == full_parse('  #c')
+    with pytest.raises(ValueError):
+        document.apply_edit(3, 5, '')
+
+
+@pytest.mark.parametrize('chunk', [incremental._CHUNK, 2])
+@pytest.mark.parametrize('pad', [0, 20, 80])
+def test_error_positions_after_edit(chunk, pad, monkeypatch):
+    # 在前面插入后修改出错语句的末尾：语句开头复用的token组在错误中报告的仍是修改后文本中的位置
+    monkeypatch.setattr(incremental, '_CHUNK', chunk)
+    document = PairDocDocument('#a #:=1' + ' ' * pad + '1')
+    document.apply_edit(0, 0, '#c := 12 ')
+    new_text = document.text + ';->'
+    result = outcome(lambda: str(document.apply_edit(len(document.text), 0, ';->')))
+    assert result[0] is Exception and "'position': 13" in result[1]
+    assert result == outcome(lambda: full_parse(new_text))
@@ -0,0 +1,98 @@
+import io
+import pytest
+from pair_doc import PairDocLexer, PairDocFastLexer, PairDocTokenizer, PairDocTokenType
+from corpus import DOCS, outcome
+
+# 除语料外，还包含未闭合的字符串与注释、转义、负数、多字节字符等非常规输入
+SOURCES = DOCS + [
+    "#'unterminated",
+    '#"a\\u00e9\\n\\"b" #\'c\\\'d\'',
+    '#"bad \\u12 escape"',
+    "#a /* open comment",
+    "#a // line comment\n#b",
+    "#x := -1 #y := 2 - -3.5e2 #-z",
+    "#'''multi\nline''' '''second'''",
+    '#R"aGVsbG8="',
+    '#"中文"  “引号” #a “x',
+    "#{[(]}) #)",
+    "",
+]
+
+
+def normalized(stream):
+    return [(str(t['token']), t['type'], t['position']) for t in stream.to_tokens()]
+
+
+@pytest.mark.parametrize('source', SOURCES)
+def test_fast_lexer_matches_reference(source):
+    expected = outcome(lambda: PairDocLexer().tokenize(source))
+    assert outcome(lambda: PairDocFastLexer().tokenize(source)) == expected
+    for comments in (True, False):
+        assert (outcome(lambda: PairDocFastLexer().tokenize_stream(source, comments).to_tokens())
+                == outcome(lambda: PairDocLexer().tokenize_stream(source, comments).to_tokens()))
+
+
+@pytest.mark.parametrize('source', SOURCES)
+def test_buffer_matches_reference(source):
+    buffer = source.encode('utf-8')
+    for comments in (True, False):
+        expected = outcome(lambda: normalized(PairDocLexer().tokenize_buffer(buffer, comments)))
+        assert outcome(lambda: normalized(PairDocFastLexer().tokenize_buffer(buffer, comments))) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64])
+@pytest.mark.parametrize('source', SOURCES)
+def test_incremental_matches_reference(source, chunk_size):
+    expected = outcome(lambda: PairDocLexer().tokenize(source))
+    assert outcome(lambda: list(PairDocFastLexer().iter_tokenize(io.StringIO(source), chunk_size))) == expected
+
+
+# 多字节字符与'''块：bytes chunk可能切在一个字符的UTF-8编码中间或'''块的任意位置
+SPLIT_SOURCES = [
+    "#'''中文\n#x /* y */''' “引号” #é := '€'",
+    "#a '''raw '' #{b} 字''' #c ''''''",
+    "#'''未闭合 中",
+    "#😀 // 注释 ü\n#'''😀'''",
+]
+
+
+@pytest.mark.parametrize('source', SPLIT_SOURCES)
+def test_bytes_chunks_split_anywhere(source):
+    data = source.encode('utf-8')
+    expected = outcome(lambda: PairDocLexer().tokenize(source))
+    expected_parse = outcome(lambda: PairDocTokenizer(PairDocLexer()).parse(source))
+    tokenizer = PairDocTokenizer(PairDocFastLexer())
+    for i in range(len(data) + 1):
+        chunks = [data[:i], data[i:]]
+        assert outcome(lambda: list(PairDocFastLexer().iter_tokenize(chunks, 4))) == expected, i
+        assert outcome(lambda: list(tokenizer.iter_parse(iter(chunks), 4))) == expected_parse, i
+    # 逐字节输入
+    assert outcome(lambda: list(PairDocFastLexer().iter_tokenize([data[i:i + 1] for i in range(len(data))], 1))) == expected
+    assert outcome(lambda: list(tokenizer.iter_parse(io.BytesIO(data), 1))) == expected_parse
+
+
+@pytest.mark.parametrize('source', DOCS + ["#f({[x]}, (y)) #{#a[1]} #'(' /* ) */", "#{[(]}) #)", "#(1, [2) #a", "#((x)", "#x)(", ""])
+def test_bracket_partners(source):
+    # 配对表与按栈逐个匹配的结果相同，第一处不配对之后的括号不再配对
+    stream = PairDocFastLexer().tokenize_stream(source, False)
+    stream.match_brackets()
+    tokens = stream.to_tokens()
+    expected = [0] * len(tokens)
+    stack = []
+    balanced = True
+    for i, token in enumerate(tokens):
+        if token['type'] != PairDocTokenType.TokenType_SYMBOL or token['token'] not in ('(', ')', '[', ']', '{', '}'):
+            continue
+        if token['token'] in '([{':
+            stack.append(i)
+        elif stack and tokens[stack[-1]]['token'] + token['token'] in ('()', '[]', '{}'):
+            j = stack.pop()
+            expected[j], expected[i] = i - j, j - i
+        else:
+            balanced = False
+            break
+    assert list(stream.partners) == expected
+    assert stream.balanced == (balanced and not stack)
+    # 切片后相对距离不变
+    view = stream[1:]
+    assert [view.partner(i) for i in range(len(view))] == expected[1:]
@@ -0,0 +1,74 @@
+import os
+import pytest
+from pair_doc import PairDocModuleCache, build_doc
+
+LIB = "#!greet := (name:'', tag:'b')->{#tag{#name}} #!title := 'T'"
+
+
+@pytest.fixture
+def root(tmp_path):
+    """模块根目录root，其外有secret.pd，root中的link.pd与out目录是指向外面的符号链接"""
+    root = tmp_path / 'root'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'lib.pd').write_text(LIB, encoding='utf-8')
+    (root / 'sub' / 'inner.pd').write_text("#import('../lib.pd') #!inner := title", encoding='utf-8')
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'secret.pd').write_text("#!title := 'secret'", encoding='utf-8')
+    try:
+        os.symlink(outside / 'secret.pd', root / 'link.pd')
+        os.symlink(outside, root / 'out', target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip('symlinks are not supported')
+    return root
+
+
+def test_imports_inside_root(root):
+    modules = PairDocModuleCache(root)
+    assert build_doc("#import('lib.pd') #greet('x') #title", modules=modules) == ' <b>x</b> T'
+    # 模块中的相对路径相对于模块所在目录，../只要仍在root之下就允许
+    assert build_doc("#import('sub/inner.pd') #inner #import('sub/../lib.pd') #title", modules=modules) == ' T  T'
+    assert build_doc("#include('lib.pd')", modules=modules) == build_doc(LIB)
+
+
+@pytest.mark.parametrize('path', ['../outside/secret.pd', 'sub/../../outside/secret.pd', 'link.pd', 'out/secret.pd'])
+def test_paths_outside_root_are_rejected(root, path):
+    modules = PairDocModuleCache(root)
+    with pytest.raises(ValueError, match='outside the module root'):
+        build_doc(f"#import('{path}') #title", modules=modules)
+    with pytest.raises(ValueError, match='outside the module root'):
+        modules.load(path)
+    assert len(modules) == 0
+
+
+def test_absolute_paths_are_rejected(root):
+    modules = PairDocModuleCache(root)
+    path = str(root / 'lib.pd').replace('\\', '/')
+    with pytest.raises(ValueError, match='must be relative'):
+        build_doc(f"#import('{path}')", modules=modules)
+    with pytest.raises(ValueError, match='must be relative'):
+        modules.load(os.path.abspath(root / 'lib.pd'))
+
+
+def test_modules_are_opt_in(root, monkeypatch):
+    monkeypatch.chdir(root)
+    with pytest.raises(ValueError, match='Module imports are not enabled'):
+        build_doc("#import('lib.pd')")
+    with pytest.raises(ValueError, match='Module imports are not enabled'):
+        build_doc("#include('lib.pd')")
+    # 绑定了import的文档不是导入
+    assert build_doc("#!import := 3 #import") == build_doc("#!x := 3 #x")
+
+
+def test_prefetch_only_for_module_calls(root, monkeypatch):
+    modules = PairDocModuleCache(root)
+    calls = []
+    prefetch = modules.prefetch
+    monkeypatch.setattr(modules, 'prefetch', lambda *args: calls.append(args) or prefetch(*args))
+    build_doc("#!x := 1 #span{#x}", modules=modules)
+    assert not calls
+    # lib.pd本身没有import/include，求值时也不遍历其语法树
+    build_doc("#import('lib.pd') #title", modules=modules)
+    assert len(calls) == 1
+    build_doc("#import('sub/inner.pd') #inner", modules=modules)
+    assert len(calls) == 3
@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pair_doc import PairDocTokenizer, Gather, PairDocASTParser, PairDocPrecedenceParser
+from pair_doc import TokenStream
+from pair_doc.ast import NextToken, TokenListView, node_matcher, _group_code
+from corpus import DOCS, deep_docs, outcome
+
+# 除语料外，还包含括号不配对、分隔符与运算符位置异常的文档
+SOURCES = DOCS + deep_docs(40) + [
+    "#{[(]}) #)",
+    "#(1, 2",
+    "#a ;; b #c ,",
+    "#a + #b - ; #!",
+    "#x := #y = 1",
+    "#f(a: , b:)",
+    "#(a, b) -> 1 #(a)->{#a}",
+    "#a.b.c[1](2).d #a[",
+]
+
+# 成员访问链：访问点之间夹有运算符、赋值与不能完整匹配的部分
+ACCESS_CHAINS = [
+    "#a" + ".b" * 8,
+    "#a" + "[1]" * 6 + " #b" + "(1, 2)" * 6,
+    "#a" + ".b[c.d](e)" * 3,
+    "#x := a" + ".b + c(1)" * 3 + " #y = p.q[r := 1].s",
+    "#f(1)(2).g[3] + h.i(4, j.k) - l[m].n",
+    "#a.b : c.d #a.(1) #a.[2] #(1).x #{1}.y #a.b.c{#d} #a[1][2]{#b}",
+    "#a.b.c(1) . d #a .b. c",
+]
+
+
+def gathered(source):
+    return Gather(PairDocTokenizer().parse_stream(source)).gather()
+
+
+def parse(parser_class, source, **kwargs):
+    try:
+        return str(parser_class(gathered(source), **kwargs).parse_doc())
+    except IndexError:
+        # 越界的消息取决于越界的是列表还是视图，只比较异常类型
+        raise IndexError from None
+
+
+@pytest.mark.parametrize('source', SOURCES + ACCESS_CHAINS)
+def test_precedence_matches_chain(source):
+    expected = outcome(lambda: parse(PairDocASTParser, source))
+    assert outcome(lambda: parse(PairDocASTParser, source, memoize=False)) == expected
+    assert outcome(lambda: parse(PairDocPrecedenceParser, source)) == expected
+
+
+@pytest.mark.parametrize('source', SOURCES)
+def test_gather_matches_next_token(source):
+    # 按配对表切分的结果与逐个token匹配括号的结果相同
+    tokens = PairDocTokenizer().parse_stream(source)
+
+    def reference():
+        groups = []
+        next_tokens = NextToken(tokens)
+        while group := next_tokens.next(sum(map(len, groups))):
+            groups.append(group)
+        return [repr(group) for group in groups]
+    assert outcome(lambda: [repr(group) for group in Gather(tokens).gather()]) == outcome(reference)
+
+
+def test_precedence_parser_deep():
+    # 预测式解析器不受递归深度限制
+    doc = "#div{" * 5000 + "'deep'" + "}" * 5000
+    ast = PairDocPrecedenceParser(gathered(doc)).parse_doc()
+    for _ in range(5000):
+        ast = ast.children[0].children[2]
+    assert str(ast) == "DOC [TEXT deep]"
+
+
+
+
+def test_chain_memo_is_per_parse():
+    # 记忆表只在一次顶层解析期间存在，重复的子匹配命中；关闭时不建表
+    source = "#a.b.c(1).d[2] + e"
+    parser = PairDocASTParser(gathered(source))
+    expected = str(parser.parse_doc())
+    assert parser.memo.hits and parser.memo.misses
+    assert node_matcher.memo is None
+    unmemoized = PairDocASTParser(gathered(source), memoize=False)
+    assert str(unmemoized.parse_doc()) == expected and unmemoized.memo is None
+    # 各线程有独立的记忆表
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda doc: parse(PairDocASTParser, doc), DOCS * 2))
+    assert results == [parse(PairDocASTParser, doc) for doc in DOCS * 2]
+
+
+
+@pytest.mark.parametrize('source', SOURCES[:len(DOCS) + 10] + ACCESS_CHAINS)
+def test_dispatch_matches_all_matchers(source, monkeypatch):
+    # 按首/次token组分类分派的结果与依次尝试全部匹配器相同
+    expected = outcome(lambda: parse(PairDocASTParser, source))
+    every = tuple((priority, node_matcher.matchers[name][0]) for priority, name in node_matcher.matcher_order)
+    monkeypatch.setattr(node_matcher, 'candidates', lambda first, second: every)
+    assert outcome(lambda: parse(PairDocASTParser, source)) == expected
+
+
+@pytest.mark.parametrize('source', DOCS + ACCESS_CHAINS)
+def test_group_code_on_views(source):
+    # 视图上直接读数组的分类与通用判断相同
+    for group in gathered(source):
+        assert _group_code(group) == _group_code(TokenStream.from_tokens(group.to_tokens()))
+
+
+@pytest.mark.parametrize('source', ["#f({[x]}, (y)) #{#a[1]} #b", "#a", ""])
+def test_views_match_list_slices(source):
+    # token流与token组列表的视图在各种切片下都与对应的列表切片一致，且不复制数据
+    stream = PairDocTokenizer().parse_stream(source)
+    groups = Gather(stream).gather()
+    tokens = stream.to_tokens()
+    bounds = [None, 0, 1, 3, -1, -2, 100, -100]
+    for start in bounds:
+        for stop in bounds:
+            view = stream[start:stop]
+            assert view.stream is stream
+            assert view.to_tokens() == tokens[start:stop]
+            assert view[1:-1].to_tokens() == tokens[start:stop][1:-1]
+            assert [view[i] for i in range(-len(view), len(view))] == tokens[start:stop] * 2
+            items = TokenListView(groups, 0, len(groups))[start:stop]
+            assert list(items) == groups[start:stop]
+            assert list(items[1:][:2]) == groups[start:stop][1:][:2]
+    with pytest.raises(IndexError):
+        stream[1:][len(tokens)]
+    with pytest.raises(IndexError):
+        TokenListView(groups, 1, len(groups))[-len(groups)]
+
+
+@pytest.mark.parametrize('unit', [".b", "[1]", "(1)", ".b[1](2)"])
+def test_access_chain_is_linear(unit):
+    # 访问链的长度加倍时，检查的子区间次数也只是大约加倍
+    def checks(n):
+        parser = PairDocPrecedenceParser(gathered("#a" + unit * n))
+        match_view = parser._match_view
+        calls = []
+        parser._match_view = lambda *args: calls.append(args) or match_view(*args)
+        parser.parse_doc()
+        return len(calls)
+    assert checks(800) <= 2.2 * checks(400)
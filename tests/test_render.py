@@ -0,0 +1,221 @@
+import io
+import pytest
+from pair_doc import (parse_doc, build_doc, build_docs, build_content, compile_content, build_html, render_html, optimize_ast,
+                      PairDocFunctionCache)
+from pair_doc import html_builder, SourceSpan
+from pair_doc.html_builder import TextRope, Context, Content, ContentTypes
+from pair_doc.steps import run_steps
+from corpus import DOCS, deep_docs, outcome
+
+
+def reference(ast):
+    """以步骤求值（不经过递归的快速路径）再输出，作为对照"""
+    return build_html(run_steps(html_builder._content(ast, None)))
+
+
+def render_to(ast, output):
+    render_html(ast, output)
+    value = output.getvalue()
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+@pytest.mark.parametrize('doc', DOCS + deep_docs(html_builder._MAX_DEPTH + 5))
+def test_render_matches_two_pass(doc):
+    ast = parse_doc(doc)
+    expected = outcome(lambda: reference(ast))
+    assert outcome(lambda: build_html(build_content(ast))) == expected
+    assert outcome(lambda: render_html(ast)) == expected
+    assert outcome(lambda: build_doc(doc)) == expected
+    assert outcome(lambda: build_doc(doc.encode('utf-8'))) == expected
+    assert outcome(lambda: build_doc(doc, function_cache=PairDocFunctionCache())) == expected
+    if not isinstance(expected, tuple):
+        assert render_to(ast, io.StringIO()) == expected
+        assert render_to(parse_doc(doc.encode('utf-8')), io.BytesIO()) == expected
+        assert render_html(optimize_ast(parse_doc(doc))) == expected
+
+
+@pytest.mark.parametrize('doc', deep_docs(5000))
+def test_deep_documents(doc):
+    ast = parse_doc(doc)
+    assert render_html(ast) == build_html(build_content(ast))
+
+
+def test_streaming_flushes_before_errors():
+    doc = "#span{'a'} #n " * 2000 + "#missing(1)"
+    output = io.StringIO()
+    with pytest.raises(ValueError):
+        build_doc(doc, output)
+    assert output.getvalue().startswith('<span>a</span> <br>')
+
+
+def test_streaming_defers_values_modified_later():
+    doc = "#!l := (1, 2) " + "#l #span{'a'} " * 2000 + "#l + 3"
+    output = io.StringIO()
+    build_doc(doc, output)
+    assert output.getvalue() == build_html(build_content(parse_doc(doc)))
+    assert output.getvalue().startswith(' (1, 2, 3)')
+
+
+# 下标为文本的文档：缓冲区输入时文本是SourceSpan，转换为数字的结果与str相同
+INDEX_DOCS = [
+    "#'abc'['1']",
+    "#!t := (1, 2) #t['1'] #t['0' + '']",
+    "#!s := 'xyz' #s['2'] #s[0] #s['1' + '']",
+    "#(1.5, 2)['0'] #'abc'['x']",
+]
+
+
+@pytest.mark.parametrize('doc', INDEX_DOCS)
+def test_text_index_on_buffer_input(doc, tmp_path):
+    expected = outcome(lambda: build_doc(doc))
+    data = doc.encode('utf-8')
+    path = tmp_path / 'doc.pd'
+    path.write_bytes(data)
+    assert outcome(lambda: build_doc(data)) == expected
+    assert outcome(lambda: build_doc(path)) == expected
+    assert outcome(lambda: build_html(compile_content(parse_doc(data))())) == expected
+    result, = build_docs([data], workers=1)
+    assert (result.html if result.ok else (type(result.error), str(result.error))) == expected
+
+
+# 关键字参数与按位置的参数混用：关键字先赋值，其余按顺序赋给未被赋值的形参；
+# 按位置的参数多于形参个数时出错，只是多于剩余的形参时多余的被忽略
+BINDINGS = {
+    "#!f := (a:1, b:2, c:3)->{#a #b #c} #f(b:'x', 7) #f(9, c:'z', 8) #f(c:0, b:0, a:0) #f() #f(4, 5, 6)":
+        ' 7 x 3 9 8 z 0 0 0 1 2 3 4 5 6',
+    "#!f := (a:1, b:2)->{#a #b #d} #f(d:'extra', 5)": ' 5 2 extra',
+    "#!f := (a:1, a:2, b:3)->{#a #b} #f(7, 8) #f(b:1, 7, 8)": ' 7 8 7 1',
+    "#!f := (a:1, b:2)->{#a #b} #f(a:5, b:6, 7) #f(a:5, 6, 7)": ' 5 6 5 6',
+    "#!f := (a:1, b:2)->{#b} #f(b:1, 2, 3)": ' 1',
+    "#!g := (x:0, y:0)->{#x + y} #!f := (a:1, b:2)->{#g(b, a) #g(y:a)} #f(b:10, 3) #f(4)": '  13 3 6 4',
+}
+
+
+@pytest.mark.parametrize('doc', BINDINGS)
+def test_argument_binding(doc):
+    assert build_doc(doc) == BINDINGS[doc]
+    assert build_html(compile_content(parse_doc(doc))()) == BINDINGS[doc]
+    assert build_doc(doc, function_cache=PairDocFunctionCache()) == BINDINGS[doc]
+
+
+def test_too_many_arguments():
+    for doc in ["#!f := (a:1, b:2)->{#a} #f(1, 2, 3)", "#!f := (a:1, b:2)->{#a} #f(a:1, 2, 3, 4)"]:
+        with pytest.raises(ValueError, match='Too many arguments'):
+            build_doc(doc)
+
+
+# 建立键索引之后再向元组末尾追加：新追加的键、重复的键（取第一个）、非键值对之后的键与不存在的键
+RECORD = "#!t := (a:1, b:2, c:3, d:4, e:5, f:6, g:7, h:8) "
+RECORDS = {
+    RECORD + "#t.a #t.h #!x := t + (i:9) #t.i #!x := t + (a:10) #t.a #!x := t + (j:11) #t.j": ' 1 8  9  1  11',
+    RECORD + "#t.c #!u := t + (x:1) #u.x #t.x": ' 3  1 1',
+    RECORD + "#t.b #!x := t + 5 #t.h": ' 2  8',
+    RECORD + "#t.h #!x := t + 5 #!x := t + (k:2) #t.k": (ValueError, 'Not a key-value pair'),
+    RECORD + "#t.a #t.zz": (ValueError, 'Key not found: zz'),
+    "#!t := (a:1, a:2, b:3, a:4, c:5, d:6, e:7, f:8, b:9) #t.a #t.b #!x := t + (g:1) #!x := t + (g:2) #t.a #t.g": ' 1 3   1 1',
+    "#!t := (1:'n', '1':'s', a:1, b:2, c:3, d:4, e:5, f:6) #t.'1' #t.a": ' s 1',
+}
+
+
+@pytest.mark.parametrize('record_min', [html_builder._RECORD_MIN, 1, 10 ** 9])
+@pytest.mark.parametrize('doc', RECORDS)
+def test_record_lookup_after_append(doc, record_min, monkeypatch):
+    # 键索引与按顺序查找的结果相同，record_min很大时不建立索引
+    monkeypatch.setattr(html_builder, '_RECORD_MIN', record_min)
+    assert outcome(lambda: build_doc(doc)) == RECORDS[doc]
+    assert outcome(lambda: build_html(compile_content(parse_doc(doc))())) == RECORDS[doc]
+
+
+def rope_pieces():
+    # str与指向含多字节字符的源码缓冲区的SourceSpan交替拼接，超过_ROPE_MIN后成为TextRope
+    buffer = ('中文' * 40 + '0123456789' * 20).encode('utf-8')
+    pieces = ['1' * 50, SourceSpan(buffer, 0, 60), '2', SourceSpan(buffer, 240, 440), '34' * 70]
+    expected = ''.join(map(str, pieces))
+    text = pieces[0]
+    for piece in pieces[1:]:
+        text = TextRope.concat(text, piece)
+    return text, expected
+
+
+def test_text_rope_behaves_like_str():
+    rope, expected = rope_pieces()
+    assert isinstance(rope, TextRope)
+    assert ''.join(map(str, rope.chunks())) == expected and rope.flat is None
+    for i in (0, 1, 50, 69, 70, len(expected) - 1, -1, -len(expected)):
+        assert rope[i] == expected[i]
+    for piece in (slice(None), slice(3, 80), slice(-20, None), slice(None, None, -3), slice(60, 10), slice(5, 10 ** 6)):
+        assert rope[piece] == expected[piece]
+    with pytest.raises(IndexError):
+        rope[len(expected)]
+    assert len(rope) == len(expected) and list(rope) == list(expected)
+    assert rope == expected and hash(rope) == hash(expected) and '中文2' in rope
+    assert rope + 'x' == expected + 'x' and 'x' + rope == 'x' + expected
+    # 被其他TextRope共享的节点展开后，共享它的节点仍能得到完整文本
+    longer = TextRope.concat(rope, rope)
+    assert str(rope) == expected and longer == expected * 2
+
+
+def test_text_rope_numbers():
+    digits = TextRope.concat('1' * 100, '2' * 100)
+    assert int(digits) == int('1' * 100 + '2' * 100)
+    assert float(TextRope.concat('0' * 100, '.5' + '0' * 100)) == 0.5
+    with pytest.raises(ValueError):
+        int(TextRope.concat('1' * 100, 'x' * 100))
+
+
+# 文档中拼接出的长文本用作下标与被下标，变量赋值后原值不受之后的拼接影响
+ROPE_DOCS = [
+    "#!s := '" + 'a' * 100 + "' #s = s + '" + 'b' * 100 + "' #s[0] #s[150] #s[199]",
+    "#!k := '" + '0' * 127 + "' #k = k + '5' #!s := 'abcdefg' #s[k] #!t := (1, 2, 3, 4, 5, 6) #t[k] #'abcdefg'[k[127]]",
+    "#!s := '" + 'x' * 100 + "' #!t := s #s = s + '" + 'y' * 100 + "' #!u := s #u = u + 'z' #t #s #u #u[200]",
+]
+
+
+@pytest.mark.parametrize('doc', ROPE_DOCS)
+def test_text_rope_in_documents(doc, monkeypatch):
+    # 与从不建立TextRope时的结果相同
+    expected = outcome(lambda: build_doc(doc))
+    monkeypatch.setattr(html_builder, '_ROPE_MIN', 10 ** 9)
+    assert outcome(lambda: build_doc(doc)) == expected
+    assert not isinstance(expected, tuple)
+
+
+OPTIMIZED = "hello #span{x} world #w #!v := 1 #v tail #b{#i{y}} #div['id=\"1\"']{#v} end"
+
+
+def test_optimize_merges_static_items():
+    # 相邻的不依赖变量的项合并为一段预先输出的HTML，依赖变量的项原样保留
+    ast = parse_doc(OPTIMIZED)
+    expected = build_doc(OPTIMIZED)
+    children = list(ast.children)
+    assert optimize_ast(ast) is ast and ast.children == children
+    plan = [(item[0], set(item[1]), item[2]) if isinstance(item, tuple) else item for item in ast.render_plan]
+    assert plan == [
+        ('hello <span>x</span> world w', {'span', 'w'}, children[:4]),
+        children[4],
+        children[5],
+        ('tail <b><i>y</i></b>', {'b', 'i'}, children[6:8]),
+        children[8],
+        ('end', set(), children[9:]),
+    ]
+    # 样式名与参数不依赖变量时预先生成标签
+    assert children[8].render_plan == ('<div id="1">', '</div>', ('div',))
+    assert not hasattr(children[1], 'render_plan')
+    for _ in range(2):
+        assert render_html(ast) == expected
+        assert build_html(compile_content(ast)()) == expected
+        assert build_html(build_content(ast)) == expected
+
+
+def test_optimized_falls_back_when_names_are_bound():
+    # 合并的项所读取的变量在上下文中被绑定时按普通方式求值
+    ast = optimize_ast(parse_doc(OPTIMIZED))
+    plain = parse_doc(OPTIMIZED)
+    for name in ('w', 'span', 'i', 'div', 'v'):
+        def context():
+            ctx = Context()
+            ctx.let(name, Content(ContentTypes.TEXT, 'bound'))
+            return ctx
+        expected = outcome(lambda: build_html(build_content(plain, context_vars=context())))
+        assert outcome(lambda: build_html(compile_content(ast)(context()))) == expected
+        assert outcome(lambda: build_html(compile_content(plain)(context()))) == expected